@@ -1,14 +1,26 @@
 """
 Fulfillment Agent - Handles order fulfillment and delivery
 """
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
 import requests
+import sys
+import os
 from agents.base_agent import BaseAgent
 
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.allocation import OrderAllocator
+from src import data_client
+
+# "auto" picks exact search for small carts; set to "greedy" during peak hours
+ALLOCATION_STRATEGY = os.getenv('ALLOCATION_STRATEGY', 'auto')
+
 class FulfillmentAgent(BaseAgent):
     def __init__(self, api_base_url: str = "http://localhost:8080"):
         super().__init__(api_base_url)
         self.name = "FulfillmentAgent"
+        self.allocator = OrderAllocator()
     
     def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -20,7 +32,8 @@ class FulfillmentAgent(BaseAgent):
                 "cart_items": List[Dict],
                 "fulfillment_type": str (ship_to_home, pick_up, reserve),
                 "delivery_address": Dict (optional),
-                "store_location": str (optional)
+                "store_location": str (optional),
+                "customer_location": str (optional, city used for allocation)
             }
         """
         self.log("Processing order fulfillment...")
@@ -31,13 +44,30 @@ class FulfillmentAgent(BaseAgent):
         delivery_address = task.get('delivery_address')
         store_location = task.get('store_location')
         
+        # Decide which warehouse/store ships each line (home delivery only;
+        # pickups and reservations are served by the chosen store)
+        allocation = None
+        if fulfillment_type == 'ship_to_home' and cart_items:
+            destination = task.get('customer_location') or self._resolve_destination(customer_id, delivery_address)
+            allocation = self.allocate(cart_items, destination)
+            if allocation and not allocation['fully_allocated']:
+                # Never ship part of an order or let the server oversell: the order is held
+                self.log(f"⛔ Order held, lines without stock: {allocation['unallocated']}")
+                return {
+                    "success": False,
+                    "on_hold": True,
+                    "error": "Not enough stock to fulfil every item",
+                    "unallocated": allocation['unallocated']
+                }
+        
         # Create order
         order_data = {
             "customer_id": customer_id,
             "items": cart_items,
             "fulfillment_type": fulfillment_type,
             "delivery_address": delivery_address,
-            "store_location": store_location
+            "store_location": store_location,
+            "allocation": allocation
         }
         
         try:
@@ -64,7 +94,19 @@ class FulfillmentAgent(BaseAgent):
                     "order_id": result.get('order_id'),
                     "tracking_number": result.get('tracking_number'),
                     "fulfillment_details": fulfillment_details,
-                    "estimated_delivery": result.get('estimated_delivery')
+                    "estimated_delivery": result.get('estimated_delivery'),
+                    "allocation": allocation,
+                    "shipments": result.get('shipments', [])
+                }
+            elif response.status_code == 409:
+                # Stock changed since the plan was made; nothing was reserved
+                shortfalls = response.json().get('shortfalls', [])
+                self.log(f"⛔ Order refused, stock shortfall: {shortfalls}")
+                return {
+                    "success": False,
+                    "on_hold": True,
+                    "error": "Not enough stock to fulfil every item",
+                    "unallocated": [{"sku": s['sku'], "quantity": s['requested'] - s['available']} for s in shortfalls]
                 }
             else:
                 return {
@@ -78,6 +120,47 @@ class FulfillmentAgent(BaseAgent):
                 "error": f"Order creation failed: {str(e)}"
             }
     
+    def allocate(self, cart_items: List[Dict[str, Any]], destination: Optional[str] = None,
+                 strategy: str = ALLOCATION_STRATEGY) -> Optional[Dict[str, Any]]:
+        """Plan shipments for cart lines against current stock"""
+        skus = list({item['sku'] for item in cart_items if item.get('sku')})
+        try:
+            response = requests.post(
+                f"{self.api_base_url}/api/inventory/batch",
+                json={"skus": skus},
+                timeout=5
+            )
+            inventory = response.json()
+        except Exception as e:
+            self.log(f"Warning: Could not fetch inventory for allocation: {str(e)}")
+            return None
+        
+        lines = [{"sku": item['sku'], "quantity": item.get('quantity', 1)} for item in cart_items if item.get('sku')]
+        plan = self.allocator.allocate(lines, inventory, destination, strategy)
+        
+        self.log(f"📦 Allocation ({plan['strategy']}): {plan['shipment_count']} shipment(s), {plan['total_distance_km']} km")
+        for shipment in plan['shipments']:
+            self.log(f"  {shipment['location']} → {len(shipment['items'])} line(s)")
+        if plan['unallocated']:
+            self.log(f"⚠️ Unallocated lines: {plan['unallocated']}")
+        
+        return plan
+    
+    def _resolve_destination(self, customer_id, delivery_address):
+        """Best-effort delivery city from the address or the customer's profile"""
+        if isinstance(delivery_address, dict) and delivery_address.get('city'):
+            return delivery_address['city']
+        if isinstance(delivery_address, str) and delivery_address:
+            return delivery_address
+        
+        try:
+            response = data_client.get(f"{self.api_base_url}/api/customers/{customer_id}", timeout=5)
+            if response.status_code == 200:
+                return response.json().get('demographics', {}).get('location')
+        except Exception as e:
+            self.log(f"Warning: Could not fetch customer location: {str(e)}")
+        return None
+    
     def _process_fulfillment(self, fulfillment_type, order_id, store_location, delivery_address):
         """Process fulfillment based on type"""
         details = {
@@ -131,7 +214,7 @@ class FulfillmentAgent(BaseAgent):
         self.log(f"Tracking order {order_id}...")
         
         try:
-            response = requests.get(
+            response = data_client.get(
                 f"{self.api_base_url}/api/orders/{order_id}",
                 timeout=5
             )
@@ -4,6 +4,10 @@ Inventory Agent - Checks stock availability across warehouses and stores
 from typing import Dict, Any, List
 import requests
 from agents.base_agent import BaseAgent
+from src import data_client
+
+# Seconds a batch stock check may take; after that the items count as unchecked, not available
+INVENTORY_CHECK_DEADLINE = 3
 
 class InventoryAgent(BaseAgent):
     def __init__(self, api_base_url: str = "http://localhost:8080"):
@@ -31,7 +35,7 @@ class InventoryAgent(BaseAgent):
         
         # Get inventory data
         try:
-            inventory_response = requests.get(
+            inventory_response = data_client.get(
                 f"{self.api_base_url}/api/inventory/{sku}",
                 timeout=5
             )
@@ -61,6 +65,45 @@ class InventoryAgent(BaseAgent):
             "availability": availability
         }
     
+    def check_many(self, skus: List[str], quantity: int = 1, customer_location: str = None,
+                   timeout: float = 5) -> Dict[str, Dict[str, Any]]:
+        """
+        execute() for several SKUs with one /api/inventory/batch call.
+        If the call fails, every SKU gets {"success": False, "error": ...}:
+        stock that could not be read is never reported as available.
+        """
+        skus = list(dict.fromkeys(skus))
+        if not skus:
+            return {}
+        self.log(f"Checking inventory availability for {len(skus)} SKU(s)...")
+        
+        try:
+            response = data_client.get(
+                f"{self.api_base_url}/api/inventory/batch",
+                params={"skus": ",".join(skus)},
+                timeout=timeout
+            )
+            response.raise_for_status()
+            inventory = response.json()
+        except requests.exceptions.Timeout:
+            error = "Timeout checking inventory - please try again"
+            return {sku: {"success": False, "sku": sku, "error": error} for sku in skus}
+        except Exception as e:
+            error = f"Failed to fetch inventory: {str(e)}"
+            return {sku: {"success": False, "sku": sku, "error": error} for sku in skus}
+        
+        results = {}
+        for sku in skus:
+            # SKUs without an inventory record have no stock anywhere
+            record = inventory.get(sku, {})
+            results[sku] = {
+                "success": True,
+                "sku": sku,
+                "product_name": record.get('name'),
+                "availability": self._check_availability(record, quantity, None, customer_location)
+            }
+        return results
+    
     def _check_availability(self, inventory, quantity, preferred_location, customer_location):
         """Check where the product is available"""
         availability = {
@@ -119,3 +162,34 @@ class InventoryAgent(BaseAgent):
             availability['suggestion'] = "Would you like me to notify you when it's back in stock, or show you similar products?"
         
         return availability
+    
+    def notify_when_available(self, sku: str, customer_id: str, channel: str = "web") -> Dict[str, Any]:
+        """Subscribe a customer to a back-in-stock notification for a SKU"""
+        self.log(f"Registering back-in-stock alert for {sku} ({customer_id})...")
+        
+        try:
+            response = requests.post(
+                f"{self.api_base_url}/api/inventory/notify",
+                json={
+                    "sku": sku,
+                    "customer_id": customer_id,
+                    "channel": channel
+                },
+                timeout=5
+            )
+            data = response.json()
+            if response.status_code == 200 and data.get('success'):
+                return {
+                    "success": True,
+                    "sku": sku,
+                    "message": "We'll notify you as soon as it's back in stock."
+                }
+            return {
+                "success": False,
+                "error": data.get('error', 'Could not register notification')
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Failed to register notification: {str(e)}"
+            }
@@ -4,6 +4,7 @@ Loyalty and Offers Agent - Manages loyalty points and promotions
 from typing import Dict, Any, List
 import requests
 from agents.base_agent import BaseAgent
+from src import data_client
 
 class LoyaltyAgent(BaseAgent):
     def __init__(self, api_base_url: str = "http://localhost:8080"):
@@ -39,7 +40,7 @@ class LoyaltyAgent(BaseAgent):
         
         # Get customer loyalty info
         try:
-            loyalty_response = requests.get(
+            loyalty_response = data_client.get(
                 f"{self.api_base_url}/api/loyalty/{customer_id}",
                 timeout=5
             )
@@ -116,7 +117,7 @@ class LoyaltyAgent(BaseAgent):
         promotions = []
         
         try:
-            response = requests.get(f"{self.api_base_url}/api/promotions", timeout=5)
+            response = data_client.get(f"{self.api_base_url}/api/promotions", timeout=5)
             all_promos = response.json()
             
             categories = [item.get('category') for item in cart_items]
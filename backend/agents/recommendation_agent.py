@@ -1,25 +1,58 @@
 """
 Recommendation Agent - Analyzes customer profile and suggests products
 """
-from typing import Dict, Any, List
-import requests
+from typing import Dict, Any, List, Optional, Tuple
 import sys
 import os
+import time
 from agents.base_agent import BaseAgent
+from agents.inventory_agent import InventoryAgent, INVENTORY_CHECK_DEADLINE
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from src.recommendation_engine import recommendation_engine, parse_budget_range, KEYWORD_MATCH_SCORE
+from src.query_parser import get_query_parser, peek_query_parser
+from src.bm25_index import get_bm25_index
+from src.similarity_index import get_similarity_index
+from src.copurchase import get_copurchase_index, get_product_keys
+from src.recommendation_cache import recommendation_cache
+from src.precomputed_store import get_precomputed_store
+from src.metrics import metrics
+from src.concurrency import fan_out
+from src.conversation_context import carry_over, render_request, CARRIED_SLOTS
+from src import data_client
+
+# How many retrieved candidates are personalized per request
+BM25_CANDIDATES = int(os.getenv('BM25_CANDIDATES', 100))
+
+# Categories that complete an outfit from each main category
+COMPLEMENTARY_CATEGORIES = {
+    "Women's Ethnic": ["Accessories", "Footwear"],
+    "Women's Western": ["Accessories", "Footwear"],
+    "Men's Formal": ["Accessories", "Footwear"],
+    "Men's Casual": ["Accessories", "Footwear"],
+    "Men's Ethnic": ["Accessories", "Footwear"]
+}
+
 try:
-    from src.gemini_helper import gemini_assistant
+    from src.gemini_helper import gemini_assistant, parse_json_response
     GEMINI_ENABLED = True
 except ImportError:
     GEMINI_ENABLED = False
 
+
+def _is_json_response(text: str) -> bool:
+    try:
+        return isinstance(parse_json_response(text), dict)
+    except (ValueError, IndexError):
+        return False
+
 class RecommendationAgent(BaseAgent):
     def __init__(self, api_base_url: str = "http://localhost:8080"):
         super().__init__(api_base_url)
         self.name = "RecommendationAgent"
+        self.inventory_agent = InventoryAgent(api_base_url)
     
     def execute(self, task: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -29,8 +62,11 @@ class RecommendationAgent(BaseAgent):
             task: {
                 "customer_id": str,
                 "context": str (optional),
+                "conversation": dict (optional, slots carried from earlier turns),
                 "occasion": str (optional),
-                "budget": int (optional)
+                "budget": int (optional),
+                "nlu": dict (optional, see _generate_recommendations),
+                "with_message": bool (optional, False skips the Gemini message)
             }
         """
         self.log("Analyzing customer profile for recommendations...")
@@ -39,104 +75,285 @@ class RecommendationAgent(BaseAgent):
         context = task.get('context', '')
         occasion = task.get('occasion', '')
         budget = task.get('budget')
-        
-        # Get customer profile
-        try:
-            customer_response = requests.get(
-                f"{self.api_base_url}/api/customers/{customer_id}",
-                timeout=5
-            )
-            customer = customer_response.json()
-        except requests.exceptions.Timeout:
+        nlu = task.get('nlu')
+        with_message = task.get('with_message', True)
+        carried = task.get('conversation') or {}
+        
+        # Vague requests get the precomputed picks; otherwise serve a cached
+        # result if the catalog and profile are unchanged. Stock is not
+        # part of the entry (any stock change anywhere would invalidate every entry);
+        # out-of-stock items are dropped from whatever is served instead.
+        versions = self._data_versions(customer_id)
+        cache_versions = (versions[0], versions[2]) if versions else None
+        parser = peek_query_parser(versions[0]) if versions else None
+        slots = None
+        # Vagueness is a property of this message alone: slots carried from earlier turns
+        # would make "show me something" look specific after any earlier discovery turn
+        vague = not budget and not occasion
+        if parser is not None:
+            own_slots = parser.parse(context)
+            vague = vague and self._is_vague(context, self._with_nlu(own_slots, nlu), nlu)
+            context, slots = self._resolve_context(parser, context, carried, own_slots)
+        else:
+            vague = vague and self._is_vague(context, None, nlu)
+        
+        # Vague requests ("show me something") get the batch-precomputed picks
+        if versions and vague:
+            precomputed = self.precomputed(customer_id, versions, with_message=with_message)
+            if precomputed:
+                return precomputed
+        
+        # The turn understanding shapes the results too, so the cache key includes it
+        request_slots = self._with_nlu(slots, nlu) if slots is not None else None
+        cache_key = None
+        if request_slots is not None:
+            cache_key = recommendation_cache.make_key(customer_id, request_slots, budget, occasion, with_message)
+            cached = recommendation_cache.get(cache_key, cache_versions)
+            if cached is not None:
+                self.log(f"⚡ Serving {len(cached['recommendations'])} cached recommendations")
+                return self._drop_out_of_stock(cached) or self._stock_unchecked()
+        
+        started = time.perf_counter()
+        
+        # Customer profile and catalog are fetched concurrently
+        fetched = fan_out({
+            "customer": (lambda: data_client.get(f"{self.api_base_url}/api/customers/{customer_id}", timeout=5).json(), 5),
+            "products": (lambda: data_client.get(f"{self.api_base_url}/api/products", timeout=5), 5)
+        }, log=self.log)
+        
+        customer = fetched['customer']
+        if customer is None:
             return {
                 "success": False,
-                "error": "Timeout fetching customer data - please try again"
+                "error": "Failed to fetch customer data - please try again"
             }
-        except Exception as e:
+        
+        products_response = fetched['products']
+        if products_response is None:
             return {
                 "success": False,
-                "error": f"Failed to fetch customer data: {str(e)}"
+                "error": "Failed to fetch products - please try again"
             }
-        
-        # Get all products
         try:
-            products_response = requests.get(f"{self.api_base_url}/api/products", timeout=5)
             all_products = products_response.json()
-        except requests.exceptions.Timeout:
-            return {
-                "success": False,
-                "error": "Timeout fetching products - please try again"
-            }
+            catalog_version = products_response.headers.get('X-Catalog-Version')
         except Exception as e:
             return {
                 "success": False,
                 "error": f"Failed to fetch products: {str(e)}"
             }
+        if slots is None:
+            context, slots = self._resolve_context(get_query_parser(all_products, catalog_version), context, carried)
         
         # Recommendation logic
         recommendations = self._generate_recommendations(
-            customer, all_products, context, occasion, budget
+            customer, all_products, context, occasion, budget, catalog_version, nlu=nlu
         )
         
         # Add complementary items
-        complementary = self._suggest_complementary_items(recommendations, all_products)
+        complementary = self._suggest_complementary_items(recommendations, all_products, catalog_version)
         
         self.log(f"Generated {len(recommendations)} recommendations")
         
-        return {
+        result = {
             "success": True,
             "recommendations": recommendations,
             "complementary_items": complementary,
-            "personalized_message": self._create_personalized_message(customer, recommendations)
+            "personalized_message": self._create_personalized_message(customer, recommendations, use_gemini=with_message),
+            "request": {key: slots[key] for key in CARRIED_SLOTS if slots.get(key)}
         }
-    
-    def _generate_recommendations(self, customer, all_products, context, occasion, budget):
-        """Generate personalized recommendations"""
-        recommendations = []
+        metrics.observe("recommendations.generate", (time.perf_counter() - started) * 1000)
         
+        if versions:
+            if cache_key is None:
+                cache_key = recommendation_cache.make_key(customer_id, self._with_nlu(slots, nlu), budget, occasion, with_message)
+            recommendation_cache.put(cache_key, cache_versions, result)
+        return self._drop_out_of_stock(result) or self._stock_unchecked()
+    
+    def precomputed(self, customer_id: str, versions: Optional[Tuple[str, str, str]] = None,
+                    limit: int = 5, with_message: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Recommendations from precompute_recommendations.py, if they are current
+        for this customer's profile and the catalog (None otherwise). Picks
+        out of stock everywhere are skipped.
+        """
+        store = get_precomputed_store()
+        if store is None:
+            return None
+        versions = versions or self._data_versions(customer_id)
+        if not versions:
+            return None
+        
+        entry = store.get(customer_id, versions[0], versions[2])
+        if not entry:
+            metrics.increment("precomputed.misses")
+            return None
+        
+        # All picks are fetched so the ones out of stock can be replaced from further down the list
+        rec_skus = entry['recommendations']
+        skus = rec_skus + [sku for sku in entry['complementary_items'] if sku not in rec_skus]
+        try:
+            response = data_client.get(f"{self.api_base_url}/api/products", params={"skus": ",".join(skus)}, timeout=5)
+            by_sku = {p['sku']: p for p in response.json()}
+            customer = {}
+            if with_message:
+                customer = data_client.get(f"{self.api_base_url}/api/customers/{customer_id}", timeout=5).json()
+        except Exception as e:
+            self.log(f"Could not load precomputed recommendations: {e}")
+            return None
+        
+        # Picks are an extra: without a stock check they are not shown at all
+        picks = self._drop_out_of_stock({
+            "recommendations": [by_sku[sku] for sku in rec_skus if sku in by_sku],
+            "complementary_items": [by_sku[sku] for sku in entry['complementary_items'] if sku in by_sku]
+        })
+        if not picks or not picks['recommendations']:
+            return None
+        recommendations = picks['recommendations'][:limit]
+        metrics.increment("precomputed.hits")
+        self.log(f"⚡ Serving {len(recommendations)} precomputed recommendations")
+        return {
+            "success": True,
+            "recommendations": recommendations,
+            "complementary_items": picks['complementary_items'],
+            "personalized_message": self._create_personalized_message(customer, recommendations) if with_message else "",
+            "precomputed": True
+        }
+    
+    def _drop_out_of_stock(self, result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        `result` without the recommended and complementary items that are out
+        of stock everywhere, checked with one batch inventory call. The check
+        of each item kept is in result['stock'], so callers don't check again.
+        None if stock can't be read: unchecked items are never shown.
+        """
+        skus = [p['sku'] for p in result['recommendations'] + result['complementary_items']]
+        stock = self.inventory_agent.check_many(skus, 1, timeout=INVENTORY_CHECK_DEADLINE)
+        if any(not check['success'] for check in stock.values()):
+            self.log(f"Could not check stock for recommendations: {next(iter(stock.values()))['error']}")
+            return None
+        
+        def in_stock(product):
+            if stock[product['sku']]['availability']['status'] == 'available':
+                return True
+            self.log(f"⚠️ Filtering out {product['name']} (SKU: {product['sku']}): out of stock")
+            return False
+        
+        result['recommendations'] = [p for p in result['recommendations'] if in_stock(p)]
+        result['complementary_items'] = [p for p in result['complementary_items'] if in_stock(p)]
+        result['stock'] = {p['sku']: stock[p['sku']] for p in result['recommendations'] + result['complementary_items']}
+        return result
+    
+    def _stock_unchecked(self) -> Dict[str, Any]:
+        return {
+            "success": False,
+            "stock_unchecked": True,
+            "error": "Could not check stock for recommendations - please try again"
+        }
+    
+    def _resolve_context(self, parser, context: str, carried: Dict[str, Any],
+                         slots: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, Any]]:
+        """
+        The request with what it leaves out filled in from earlier turns
+        ("in blue" after "show me shirts" -> "in blue shirt"), and its slots.
+        `slots` is the request already parsed on its own, if the caller has it.
+        """
+        slots = slots if slots is not None else parser.parse(context)
+        extra = carry_over(slots, carried)
+        if not extra:
+            return context, slots
+        context = f"{context} {render_request(extra)}".strip()
+        self.log(f"📝 Request with conversation context: '{context}'")
+        return context, parser.parse(context)
+    
+    def _with_nlu(self, slots: Dict[str, Any], nlu: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Parsed slots with the caller's turn understanding folded in the way
+        _generate_recommendations uses it: its product type and modifiers
+        replace the parsed ones, its quantity comes first, and its budget
+        and occasion fill in what the text left out
+        """
+        if not nlu:
+            return slots
+        merged = dict(slots)
+        if nlu.get('product_type'):
+            merged['product_types'] = [str(nlu['product_type']).strip().lower()]
+            merged['modifiers'] = [str(m).strip().lower() for m in nlu.get('modifiers') or []]
+        try:
+            quantity = int(nlu['quantity']) if nlu.get('quantity') else None
+        except (TypeError, ValueError):
+            quantity = None
+        merged['quantity'] = quantity or slots['quantity']
+        merged['max_budget'] = slots['max_budget'] or nlu.get('max_budget')
+        merged['occasion'] = slots['occasion'] or nlu.get('occasion')
+        return merged
+    
+    def _is_vague(self, context: str, slots: Optional[Dict[str, Any]], nlu: Optional[Dict[str, Any]] = None) -> bool:
+        """No product, color, material, audience, occasion, quantity or budget in the request (or its nlu)"""
+        if slots is not None:
+            return not any(slots.get(key) for key in (
+                'product_types', 'colors', 'materials', 'modifiers', 'audience', 'occasion', 'quantity', 'max_budget'
+            ))
+        # Parser not built yet in this worker: only an empty request is known to be vague
+        if context and context.strip():
+            return False
+        return not any((nlu or {}).get(key) for key in ('product_type', 'quantity', 'modifiers', 'max_budget', 'occasion'))
+    
+    def _data_versions(self, customer_id: str) -> Optional[Tuple[str, str, str]]:
+        """(catalog, inventory, customer profile) versions; None disables caching for this request"""
+        try:
+            response = data_client.get(
+                f"{self.api_base_url}/api/versions",
+                params={"customer_id": customer_id},
+                timeout=5
+            )
+            if response.status_code != 200:
+                return None
+            versions = response.json()
+            return (versions['catalog'], versions['inventory'], versions['customer'])
+        except Exception as e:
+            self.log(f"Could not fetch data versions, skipping cache: {e}")
+            return None
+    
+    def _generate_recommendations(self, customer, all_products, context, occasion, budget, catalog_version=None, limit=5, nlu=None):
+        """
+        Generate personalized recommendations
+
+        `nlu` is the caller's structured reading of the request (product_type,
+        quantity, modifiers, max_budget, occasion); when given, no Gemini
+        parsing is done here.
+        """
         self.log(f"🔍 Generating recommendations with context: '{context}'")
         
-        # Get customer preferences
-        browsing_history = customer.get('browsing_history', [])
-        purchase_history = customer.get('purchase_history', [])
-        preferences = customer.get('preferences', {})
-        favorite_colors = preferences.get('favorite_colors', [])
-        budget_range = preferences.get('budget_range', '0-999999')
-        
         # Parse budget
+        budget_range = customer.get('preferences', {}).get('budget_range', '0-999999')
         if not budget:
-            min_budget, max_budget = map(int, budget_range.split('-'))
+            min_budget, max_budget = parse_budget_range(budget_range)
         else:
             min_budget, max_budget = 0, budget
         
-        # Check if user explicitly mentioned budget constraint in context
-        has_explicit_budget = False
-        if context:
-            context_lower = context.lower()
-            # Check for price mentions like "under 700", "below 1000", "less than 500"
-            import re
-            price_patterns = [
-                r'under\s+(\d+)',
-                r'below\s+(\d+)', 
-                r'less\s+than\s+(\d+)',
-                r'within\s+(\d+)',
-                r'max\s+(\d+)',
-                r'maximum\s+(\d+)',
-                r'up\s+to\s+(\d+)'
-            ]
-            for pattern in price_patterns:
-                match = re.search(pattern, context_lower)
-                if match:
-                    max_budget = int(match.group(1))
-                    has_explicit_budget = True
-                    self.log(f"💰 Detected explicit budget constraint: max ₹{max_budget}")
-                    break
-        
-        # Use Gemini to intelligently parse user query
-        context_keywords = []
+        # Parse the request once: product type, quantity, budget, occasion...
+        slots = get_query_parser(all_products, catalog_version).parse(context)
+        
+        # Check if user explicitly mentioned budget constraint in context ("under 700", "below 1000")
+        has_explicit_budget = slots['max_budget'] is not None
+        if has_explicit_budget:
+            max_budget = slots['max_budget']
+            self.log(f"💰 Detected explicit budget constraint: max ₹{max_budget}")
+        elif nlu and nlu.get('max_budget'):
+            max_budget, has_explicit_budget = nlu['max_budget'], True
+            self.log(f"💰 Budget constraint from turn understanding: max ₹{max_budget}")
+        
+        if not occasion:
+            occasion = slots['occasion'] or (nlu or {}).get('occasion') or ""
+        
+        # Use Gemini to intelligently parse user query (unless the caller already did for this turn)
+        context_keywords = []   # What they asked for (product type)
+        context_modifiers = []  # How they want it (color, material, style...)
         requested_count = None  # How many items user wants to see
         
-        if context and GEMINI_ENABLED and gemini_assistant.is_available():
+        parsed = nlu
+        if parsed is None and context and GEMINI_ENABLED and gemini_assistant.is_available():
             try:
                 prompt = f"""Analyze this customer request and extract information in JSON format: "{context}"
 
@@ -151,195 +368,163 @@ Return ONLY valid JSON like:
 or if no specific product:
 {{"product_type": null, "quantity_requested": null, "modifiers": []}}"""
                 
-                response = gemini_assistant.model.generate_content(prompt)
-                result_text = response.text.strip()
-                
-                # Extract JSON from response (handle markdown code blocks)
-                import json
-                if '```json' in result_text:
-                    result_text = result_text.split('```json')[1].split('```')[0].strip()
-                elif '```' in result_text:
-                    result_text = result_text.split('```')[1].split('```')[0].strip()
-                
-                parsed = json.loads(result_text)
-                
-                if parsed.get('product_type'):
-                    context_keywords = [parsed['product_type']]
-                    if parsed.get('modifiers'):
-                        context_keywords.extend(parsed['modifiers'])
-                
-                if parsed.get('quantity_requested'):
-                    requested_count = int(parsed['quantity_requested'])
-                    self.log(f"📊 User requested {requested_count} products")
-                
+                result_text = gemini_assistant.generate_text(prompt, "query_parse", validate=_is_json_response)
+                parsed = parse_json_response(result_text)
+                parsed['quantity'] = parsed.pop('quantity_requested', None)
                 self.log(f"🤖 Gemini parsed: {parsed}")
             except Exception as e:
                 self.log(f"Gemini parsing failed, using fallback: {e}")
+                parsed = None
         
-        # Fallback: Extract keywords and quantity manually if Gemini failed or unavailable
-        if not context_keywords and context:
-            context_lower = context.lower()
-            
-            # Extract quantity manually
-            import re
-            if not requested_count:
-                # Look for patterns like "2 shirts", "3 watches", etc.
-                quantity_patterns = [
-                    r'(\d+)\s+(shirt|watch|shoe|dress|saree|jean|bag)',
-                    r'(two|three|four|five|six|seven|eight|nine|ten)\s+(shirt|watch|shoe|dress|saree|jean|bag)'
-                ]
-                word_to_num = {'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10}
-                
-                for pattern in quantity_patterns:
-                    match = re.search(pattern, context_lower)
-                    if match:
-                        qty = match.group(1)
-                        if qty.isdigit():
-                            requested_count = int(qty)
-                        else:
-                            requested_count = word_to_num.get(qty, None)
-                        self.log(f"📊 Manually extracted quantity: {requested_count}")
-                        break
-            
-            # Extract product keywords
-            if 'watch' in context_lower:
-                context_keywords.append('watch')
-            if 'shoe' in context_lower or 'shoes' in context_lower:
-                context_keywords.extend(['shoe', 'shoes'])
-            if 'shirt' in context_lower:
-                context_keywords.append('shirt')
-            if 'dress' in context_lower:
-                context_keywords.append('dress')
-            if 'saree' in context_lower or 'sari' in context_lower:
-                context_keywords.append('saree')
-            if 'jeans' in context_lower:
-                context_keywords.append('jeans')
-            if 'bag' in context_lower or 'handbag' in context_lower:
-                context_keywords.extend(['bag', 'handbag'])
-            self.log(f"📋 Fallback keywords extracted: {context_keywords}")
-        
-        # Score products
-        scored_products = []
-        for product in all_products:
-            # HARD FILTER: Skip products over budget if user explicitly mentioned price limit
-            if has_explicit_budget and product['price'] > max_budget:
-                continue
-            
-            score = 0
-            product_name_lower = product['name'].lower()
-            product_category_lower = product.get('category', '').lower()
-            
-            # HIGHEST PRIORITY: Direct match with user's request
-            if context_keywords:
-                for keyword in context_keywords:
-                    if keyword in product_name_lower or keyword in product_category_lower:
-                        score += 100  # Very high priority for direct match
-                        self.log(f"✅ Keyword match '{keyword}' in '{product['name']}' - score: {score}")
-                        break
-            
-            # Category match with browsing history
-            if product['category'] in browsing_history:
-                score += 30
-            
-            # Category match with purchase history
-            past_categories = [p['category'] for p in purchase_history]
-            if product['category'] in past_categories:
-                score += 20
-            
-            # Color preference
-            product_colors = product.get('attributes', {}).get('color', [])
-            if any(color in favorite_colors for color in product_colors):
-                score += 15
-            
-            # Budget match
-            if min_budget <= product['price'] <= max_budget:
-                score += 25
-            
-            # Occasion match
-            if occasion:
-                product_occasion = product.get('attributes', {}).get('occasion', '')
-                if occasion.lower() in product_occasion.lower():
-                    score += 20
-            
-            # High rating
-            if product.get('rating', 0) >= 4.5:
-                score += 10
+        if parsed:
+            if parsed.get('product_type'):
+                context_keywords = [parsed['product_type']]
+                if parsed.get('modifiers'):
+                    context_modifiers = list(parsed['modifiers'])
             
-            # Discount
-            if product.get('discount', 0) >= 30:
-                score += 5
-            
-            scored_products.append({
-                "product": product,
-                "score": score
-            })
+            try:
+                requested_count = int(parsed['quantity']) if parsed.get('quantity') else None
+            except (TypeError, ValueError):
+                requested_count = None
+            if requested_count:
+                self.log(f"📊 User requested {requested_count} products")
         
-        # Sort by score and get top recommendations
-        scored_products.sort(key=lambda x: x['score'], reverse=True)
+        # Fallback: use the parsed slots if Gemini failed or unavailable
+        if not context_keywords and context:
+            if not requested_count and slots['quantity']:
+                requested_count = slots['quantity']
+                self.log(f"📊 Manually extracted quantity: {requested_count}")
+            context_keywords = list(slots['keywords'])
+            context_modifiers = slots['colors'] + slots['materials']
+            self.log(f"📋 Fallback keywords extracted: {context_keywords} (modifiers: {context_modifiers})")
+        
+        catalog = recommendation_engine.catalog(all_products, catalog_version)
+        budget_bounds = None
+        if budget or has_explicit_budget:
+            budget_bounds = (min_budget, max_budget)
+        hard_max_price = max_budget if has_explicit_budget else None
         
         # Determine how many products to return
-        num_to_return = requested_count if requested_count and requested_count > 0 else 5
+        num_to_return = requested_count if requested_count and requested_count > 0 else limit
         self.log(f"🔢 Will return {num_to_return} products")
         
+        # Candidate generation: BM25 top-N for the requested product, then personalize only those
+        candidates = None
+        if context_keywords:
+            candidates, relevance = get_bm25_index(all_products, catalog_version).search(
+                context_keywords, context_modifiers, top_n=BM25_CANDIDATES
+            )
+            self.log(f"🔎 Retrieved {len(candidates)} candidates for {context_keywords}")
+        
+        if candidates is not None and len(candidates):
+            scores = recommendation_engine.score_candidates(
+                catalog, customer, candidates, relevance, modifiers=context_modifiers,
+                occasion=occasion, budget_bounds=budget_bounds, hard_max_price=hard_max_price
+            )
+            ranked = recommendation_engine.top_k(scores, num_to_return)
+            top_indices = [int(candidates[i]) for i in ranked]
+            top_scores = [int(scores[i]) for i in ranked]
+        else:
+            # No query (or nothing retrieved): rank the whole catalog by personalization
+            scores = recommendation_engine.score(
+                catalog, customer, keywords=context_keywords + context_modifiers,
+                occasion=occasion, budget_bounds=budget_bounds, hard_max_price=hard_max_price
+            )
+            top_indices = recommendation_engine.top_k(scores, num_to_return)
+            top_scores = [int(scores[i]) for i in top_indices]
+        
         # Log top scored products
-        self.log(f"🏆 Top {min(num_to_return, len(scored_products))} products by score:")
-        for idx, item in enumerate(scored_products[:num_to_return], 1):
-            self.log(f"  {idx}. {item['product']['name']} - Score: {item['score']}")
+        self.log(f"🏆 Top {len(top_indices)} products by score:")
+        for idx, (i, score) in enumerate(zip(top_indices, top_scores), 1):
+            self.log(f"  {idx}. {all_products[i]['name']} - Score: {score}")
         
         # If user has specific request (context keywords), filter strictly to relevant items ONLY
-        if context_keywords and scored_products:
+        if context_keywords and top_indices:
             self.log(f"🔍 User has specific request with keywords: {context_keywords}")
-            top_score = scored_products[0]['score']
-            self.log(f"🔍 Top score: {top_score}")
+            self.log(f"🔍 Top score: {top_scores[0]}")
             
             # Only show products with score >= 100 (direct keyword match) when user has specific request
-            if top_score >= 100:
-                relevant_products = [item for item in scored_products if item['score'] >= 100]
-                self.log(f"✅ Found {len(relevant_products)} products with score >= 100")
-                if relevant_products:
-                    # Limit to requested count
-                    limited_products = relevant_products[:num_to_return]
-                    self.log(f"✅ Returning {len(limited_products)} products matching user's request")
-                    recommendations = [item['product'] for item in limited_products]
-                    return recommendations
+            if top_scores[0] >= KEYWORD_MATCH_SCORE:
+                relevant = [i for i, score in zip(top_indices, top_scores) if score >= KEYWORD_MATCH_SCORE]
+                self.log(f"✅ Returning {len(relevant)} products matching user's request")
+                return [all_products[i] for i in relevant]
         
         # Otherwise, show top N by score
         self.log(f"📋 Showing top {num_to_return} products")
-        recommendations = [item['product'] for item in scored_products[:num_to_return]]
+        recommendations = [all_products[i] for i in top_indices]
         
         return recommendations
     
-    def _suggest_complementary_items(self, recommendations, all_products):
-        """Suggest items that go well with recommendations"""
-        complementary = []
-        
+    def _suggest_complementary_items(self, recommendations, all_products, catalog_version=None):
+        """
+        Suggest items that go well with the top recommendation: first what is
+        frequently bought together with it, then the nearest items from the
+        complementary categories
+        """
         if not recommendations:
-            return complementary
+            return []
         
         main_product = recommendations[0]
-        main_category = main_product['category']
-        
-        # Define complementary pairs
-        complementary_map = {
-            "Women's Ethnic": ["Accessories", "Footwear"],
-            "Women's Western": ["Accessories", "Footwear"],
-            "Men's Formal": ["Accessories", "Footwear"],
-            "Men's Casual": ["Accessories", "Footwear"],
-            "Men's Ethnic": ["Accessories", "Footwear"]
-        }
+        exclude = [p['sku'] for p in recommendations]
+        complementary = self.frequently_bought_together(
+            [main_product], all_products, catalog_version, limit=3, exclude=exclude
+        )
         
-        if main_category in complementary_map:
-            complementary_categories = complementary_map[main_category]
-            
-            for product in all_products:
-                if product['category'] in complementary_categories:
-                    complementary.append(product)
-                    if len(complementary) >= 3:
-                        break
+        complementary_categories = COMPLEMENTARY_CATEGORIES.get(main_product['category'])
+        if len(complementary) < 3 and complementary_categories:
+            index = get_similarity_index(all_products, catalog_version)
+            neighbours = index.similar(
+                main_product['sku'], k=3 - len(complementary),
+                categories=complementary_categories,
+                exclude=exclude + [p['sku'] for p in complementary]
+            )
+            complementary += [all_products[index.positions[sku]] for sku, _ in neighbours]
         
         return complementary
     
-    def _create_personalized_message(self, customer, recommendations):
+    def frequently_bought_together(self, anchors, all_products, catalog_version=None, limit=2, exclude=None):
+        """
+        Products of the types most often bought with the anchor products
+        (from the offline co-purchase table), each the closest match to its anchor.
+        """
+        copurchase = get_copurchase_index()
+        if not anchors or not copurchase.related_items:
+            return []
+        
+        type_by_sku, skus_by_type = get_product_keys(all_products, catalog_version)
+        index = get_similarity_index(all_products, catalog_version)
+        anchor_types = [type_by_sku.get(p['sku']) for p in anchors]
+        seen = set(exclude or []) | {p['sku'] for p in anchors}
+        
+        suggestions = []
+        for related_type, _, source_type in copurchase.related_to_many(anchor_types, k=limit):
+            anchor = anchors[anchor_types.index(source_type)]
+            candidates = [sku for sku in skus_by_type.get(related_type, []) if sku not in seen]
+            for sku, _ in index.similar(anchor['sku'], k=1, within=candidates):
+                suggestions.append(all_products[index.positions[sku]])
+                seen.add(sku)
+        
+        if suggestions:
+            self.log(f"🛍️ Frequently bought together: {[p['name'] for p in suggestions]}")
+        return suggestions
+    
+    def find_similar(self, sku: str, limit: int = 3, category: str = None) -> Dict[str, Any]:
+        """"More like this": nearest products to a SKU from the similarity index"""
+        params = {"limit": limit}
+        if category:
+            params["category"] = category
+        try:
+            response = data_client.get(f"{self.api_base_url}/api/products/{sku}/similar", params=params, timeout=5)
+            if response.status_code != 200:
+                return {"success": False, "error": response.json().get('error', 'Product not found')}
+            similar = response.json()
+        except Exception as e:
+            return {"success": False, "error": f"Failed to fetch similar products: {str(e)}"}
+        
+        self.log(f"🧭 {len(similar)} products similar to {sku}")
+        return {"success": True, "sku": sku, "similar_items": similar}
+    
+    def _create_personalized_message(self, customer, recommendations, use_gemini=True):
         """Create a personalized message for the customer"""
         name = customer.get('name', 'there').split()[0]
         
@@ -347,7 +532,7 @@ or if no specific product:
             return f"Hi {name}! Let me help you find something perfect for you."
         
         # Try Gemini for more natural messages
-        if GEMINI_ENABLED and gemini_assistant.is_available():
+        if use_gemini and GEMINI_ENABLED and gemini_assistant.is_available():
             try:
                 message = gemini_assistant.generate_recommendation_message(customer, recommendations)
                 if message:
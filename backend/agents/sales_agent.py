@@ -1,7 +1,7 @@
 """
 Sales Agent - Main orchestrator that manages conversation and coordinates worker agents
 """
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, List, Optional, Tuple, Iterator
 import json
 import sys
 import os
@@ -11,19 +11,53 @@ import requests
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from agents.recommendation_agent import RecommendationAgent
-from agents.inventory_agent import InventoryAgent
+from agents.inventory_agent import InventoryAgent, INVENTORY_CHECK_DEADLINE
 from agents.payment_agent import PaymentAgent
 from agents.loyalty_agent import LoyaltyAgent
 from agents.fulfillment_agent import FulfillmentAgent
 from agents.post_purchase_agent import PostPurchaseAgent
+from src.query_parser import get_query_parser, PRODUCT_MATCH_TERMS
+from src.intent_classifier import (
+    get_intent_classifier, intent_routing, log_labelled_turn,
+    CONFIDENCE_THRESHOLD as INTENT_CONFIDENCE_THRESHOLD
+)
+from src.metrics import metrics
+from src.concurrency import fan_out
+from src.conversation_context import ConversationContext, CONVERSATION_HISTORY_LIMIT
+from src.greeting_cache import greeting_cache, greeting_version
+from src import data_client
 
 try:
-    from src.gemini_helper import gemini_assistant
+    from src.gemini_helper import gemini_assistant, parse_json_response
     GEMINI_ENABLED = True
 except ImportError:
     GEMINI_ENABLED = False
     print("⚠️  Gemini helper not available. Using rule-based responses.")
 
+VALID_INTENTS = ["product_discovery", "add_to_cart", "checkout", "apply_offer", "post_purchase", "general"]
+
+# Seconds each fanned-out call may take before the turn goes on without it
+GREETING_DEADLINE = 4
+
+GREETING_SUFFIX = "\n\nI can help you:\n✨ Find the perfect products\n📦 Check availability\n🎁 Apply best offers\n🚚 Complete your purchase\n\nWhat are you looking for today?"
+
+
+def _positive_int(value) -> Optional[int]:
+    try:
+        number = int(float(str(value).replace(',', '').replace('₹', '')))
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def _is_turn_response(text: str) -> bool:
+    try:
+        parsed = parse_json_response(text)
+    except (ValueError, IndexError):
+        return False
+    return isinstance(parsed, dict) and str(parsed.get('intent', '')).strip().lower() in VALID_INTENTS
+
+
 class SalesAgent:
     def __init__(self, api_base_url: str = "http://localhost:8080"):
         self.api_base_url = api_base_url
@@ -39,7 +73,11 @@ class SalesAgent:
         
         # Session state
         self.current_session = {}
-        self.conversation_history = []
+        self.context = ConversationContext()
+        # Messages are appended to the session's conversation log, not kept in its state
+        self.turn_count = 0
+        self.new_turns = []
+        self.history_loader = None
     
     def start_session(self, customer_id: str, channel: str = "web"):
         """Start a new sales session"""
@@ -50,9 +88,22 @@ class SalesAgent:
             "stage": "greeting",
             "context": {}
         }
-        self.conversation_history = []
-        
-        greeting = self._generate_greeting(customer_id)
+        self.context = ConversationContext()
+        self.turn_count = 0
+        self.new_turns = []
+        
+        # Greeting and first-turn picks from the batch job are independent
+        results = self.fan_out({
+            "greeting": (lambda: self._generate_greeting(customer_id), GREETING_DEADLINE),
+            "picks": (lambda: self.recommendation_agent.precomputed(customer_id, limit=3, with_message=False), GREETING_DEADLINE)
+        })
+        greeting = results['greeting'] or self._fallback_greeting()
+        picks = results['picks']
+        if picks and picks['recommendations']:
+            self.current_session['recommendations'] = picks['recommendations']
+            names = ", ".join(f"**{p['name']}** (₹{p['price']})" for p in picks['recommendations'])
+            greeting['message'] += f"\n\n✨ Picked for you: {names}"
+            greeting['recommendations'] = picks['recommendations']
         self.log(f"Session started for {customer_id} on {channel}")
         
         return greeting
@@ -61,7 +112,7 @@ class SalesAgent:
         """Add a specific SKU to the agent-managed cart with basic stock check."""
         # Fetch product details from data API
         try:
-            resp = requests.get(f"{self.api_base_url}/api/products/{sku}", timeout=5)
+            resp = data_client.get(f"{self.api_base_url}/api/products/{sku}", timeout=5)
             if resp.status_code != 200:
                 return {"success": False, "message": "Product not found"}
             product = resp.json()
@@ -74,9 +125,16 @@ class SalesAgent:
         inv_task = {"sku": sku, "quantity": quantity}
         inv_result = self.inventory_agent.execute(inv_task)
         if not inv_result.get("success") or inv_result.get("availability", {}).get("status") != "available":
+            message = f"Sorry, {product.get('name', 'item')} is currently out of stock."
+            if inv_result.get("availability", {}).get("status") == "out_of_stock":
+                message += " " + self._register_back_in_stock(sku)
+            similar = self._similar_items(sku)
+            if similar:
+                message += "\n\nSimilar options: " + ", ".join(f"**{p['name']}** (₹{p['price']})" for p in similar)
             return {
                 "success": False,
-                "message": f"Sorry, {product.get('name', 'item')} is currently out of stock."
+                "message": message,
+                "similar_items": similar
             }
 
         # Append to session cart (store minimal necessary fields)
@@ -111,11 +169,15 @@ class SalesAgent:
         
         return {
             "message": message + "How can I help you?",
-            "session": self.current_session
+            "session": self.current_session,
+            "history": self.history()
         }
 
-    def load_state(self, state: Dict[str, Any]):
-        """Load session state"""
+    def load_state(self, state: Dict[str, Any], history_loader: Optional[Callable[[int], List[Dict[str, Any]]]] = None):
+        """
+        Load session state. `history_loader(limit)` returns the last saved
+        messages of the conversation log; it is only called if history() is.
+        """
         if isinstance(state, str):
             try:
                 self.current_session = json.loads(state)
@@ -124,22 +186,79 @@ class SalesAgent:
         else:
             self.current_session = state or {}
         
-        # Restore conversation history from session
-        self.conversation_history = self.current_session.get('conversation_history', [])
+        self.context = ConversationContext.from_dict(self.current_session.get('conversation_context'))
+        self.turn_count = self.current_session.get('turn_count', 0)
+        self.new_turns = []
+        self.history_loader = history_loader
+        
+        # Sessions saved before the conversation log carry their history in the state; move it to the log
+        for turn in self.current_session.pop('conversation_history', None) or []:
+            self._add_turn(turn.get('role'), turn.get('message'))
+    
+    def _add_turn(self, role: str, message: Optional[str]):
+        self.new_turns.append({"seq": self.turn_count, "role": role, "message": message})
+        self.turn_count += 1
+    
+    def take_turns(self) -> List[Dict[str, Any]]:
+        """Messages added since the state was loaded, for the session store to append (once)"""
+        turns, self.new_turns = self.new_turns, []
+        return turns
+    
+    def history(self, limit: int = CONVERSATION_HISTORY_LIMIT) -> List[Dict[str, Any]]:
+        """The last `limit` messages, oldest first: saved ones from the log, then unsaved ones"""
+        saved = self.history_loader(limit) if self.history_loader else []
+        unsaved = [turn for turn in self.new_turns if not saved or turn['seq'] > saved[-1]['seq']]
+        return (saved + unsaved)[-limit:]
     
     def handle_conversation(self, user_input: str) -> Dict[str, Any]:
         """Handle user conversation and orchestrate appropriate agents"""
-        self.conversation_history.append({"role": "user", "message": user_input})
+        self._add_turn("user", user_input)
+        self.context.add_user_message(user_input)
         
-        # Analyze intent
-        intent = self._analyze_intent(user_input)
+        # Local classifier first; only low-confidence messages cost a model call
+        intent, turn = self._route_turn(user_input)
         
-        response = {}
+        response = self._handle_intent(intent, user_input, turn)
         
+        self._add_turn("agent", response.get('message'))
+        
+        return response
+    
+    def handle_conversation_stream(self, user_input: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        The same turn as handle_conversation, as (event, data) pairs:
+        "intent" as soon as it is known, "result" with the structured response
+        (products, cart) before any text is generated, "token" chunks of the
+        reply as the model streams them, then "done" with the full response.
+        """
+        self._add_turn("user", user_input)
+        self.context.add_user_message(user_input)
+        
+        intent, turn = self._route_turn(user_input)
+        yield "intent", {"intent": intent}
+        
+        reply = None
         if intent == "product_discovery":
-            response = self._handle_product_discovery(user_input)
+            response, reply = self._prepare_product_discovery(user_input, turn)
+        else:
+            response = self._handle_intent(intent, user_input, turn)
+        yield "result", {key: value for key, value in response.items() if key != 'message'}
+        
+        chunks = self._reply_chunks(reply, stream=True) if reply else [response.get('message') or ""]
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield "token", {"text": chunk}
+        response['message'] = "".join(parts)
+        
+        self._add_turn("agent", response['message'])
+        yield "done", response
+    
+    def _handle_intent(self, intent: str, user_input: str, turn: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        if intent == "product_discovery":
+            response = self._handle_product_discovery(user_input, turn)
         elif intent == "add_to_cart":
-            response = self._handle_add_to_cart(user_input)
+            response = self._handle_add_to_cart(user_input, turn)
         elif intent == "checkout":
             response = self._handle_checkout()
         elif intent == "apply_offer":
@@ -148,40 +267,101 @@ class SalesAgent:
             response = self._handle_post_purchase(user_input)
         else:
             response = self._handle_general_query(user_input)
-        
-        self.conversation_history.append({"role": "agent", "message": response.get('message')})
-        
         return response
     
-    def _analyze_intent(self, user_input: str) -> str:
-        """Analyze user intent from input using Gemini or rules"""
-        
-        # 1. Try Gemini for advanced intent classification
-        if GEMINI_ENABLED and gemini_assistant.is_available():
-            try:
-                prompt = f"""Classify the user's intent into exactly one of these categories:
+    def fan_out(self, calls: Dict[str, Any], default: Any = None) -> Dict[str, Any]:
+        """
+        Run independent agent/LLM calls concurrently on the worker's pool:
+        {name: callable or (callable, deadline_seconds)} -> {name: result}.
+        Failed or late calls give `default`.
+        """
+        return fan_out(calls, default=default, log=self.log)
+    
+    def _check_stock(self, skus: List[str], customer_location: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """InventoryAgent results per SKU from one batch call (success False for SKUs that couldn't be checked)"""
+        return self.inventory_agent.check_many(skus, 1, customer_location, timeout=INVENTORY_CHECK_DEADLINE)
+    
+    def _route_turn(self, user_input: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        (intent, turn understanding). Confident local predictions are used as
+        is; the rest escalate to the structured Gemini call, and its label is
+        logged as training data. Without Gemini, the local guess (or the
+        keyword rules, if no model is trained) decides.
+        """
+        classifier = get_intent_classifier()
+        prediction = None
+        if classifier is not None:
+            with metrics.timer("intent.classify"):
+                prediction = classifier.predict(user_input)
+            if prediction[1] >= INTENT_CONFIDENCE_THRESHOLD:
+                intent_routing.record("local")
+                self.log(f"⚡ Local intent: {prediction[0]} ({prediction[1]:.2f})")
+                return prediction[0], None
+        
+        turn = self._understand_turn(user_input)
+        if turn:
+            intent_routing.record("escalated")
+            log_labelled_turn(user_input, turn['intent'])
+            return turn['intent'], turn
+        
+        intent_routing.record("fallback")
+        return (prediction[0] if prediction else self._analyze_intent(user_input)), None
+    
+    def _understand_turn(self, user_input: str) -> Optional[Dict[str, Any]]:
+        """
+        Intent and product request for this turn from a single Gemini call:
+        {"intent", "product_type", "quantity", "modifiers", "max_budget", "occasion"}.
+        None if Gemini is unavailable or the response is unusable.
+        """
+        if not (GEMINI_ENABLED and gemini_assistant.is_available()):
+            return None
+        
+        # Bounded context (recent messages and a summary), so the prompt does not grow with the conversation
+        prompt = f"""Analyze this message from a customer of a fashion store and return JSON.
+
+Earlier messages: "{self.context.earlier_messages()}"
+So far: "{self.context.summary()}"
+Latest message: "{self.context.recent[-1] if self.context.recent else user_input}"
+
+Extract:
+1. intent: the latest message's intent, exactly one of:
 - product_discovery: User wants to find, see, search, or buy products (e.g., "show me shirts", "I need a dress", "buy shoes", "do you have...").
 - add_to_cart: User wants to add a specific item to cart (e.g., "add this", "add to cart", "I'll take it", "buy this one").
 - checkout: User wants to pay or finish shopping (e.g., "checkout", "pay now", "bill please").
 - apply_offer: User wants to use a coupon or check offers (e.g., "apply SAVE10", "any discounts?", "use promo code").
 - post_purchase: User asks about past orders, returns, tracking, or shipping status (e.g., "where is my order?", "return this", "track package").
 - general: Greetings, small talk, or unclear requests.
+2. product_type: What product category they want (e.g., "shirt", "watch", "shoes"), using earlier messages for context - just the category name, or null
+3. quantity: How many products they want to see (e.g., "2 shirts" -> 2), or null
+4. modifiers: Any specific requirements (color, material, style), or []
+5. max_budget: Their maximum price in rupees (e.g., "under 2000" -> 2000), or null
+6. occasion: The occasion (e.g., "wedding", "office", "party"), or null
 
-User Input: "{user_input}"
-
-Return ONLY the category name."""
-                
-                response = gemini_assistant.model.generate_content(prompt)
-                intent = response.text.strip().lower()
-                
-                valid_intents = ["product_discovery", "add_to_cart", "checkout", "apply_offer", "post_purchase", "general"]
-                if intent in valid_intents:
-                    self.log(f"🧠 Gemini classified intent: {intent}")
-                    return intent
-            except Exception as e:
-                self.log(f"⚠️ Gemini intent classification failed: {e}")
-
-        # 2. Fallback to Rule-based (Improved)
+Return ONLY valid JSON like:
+{{"intent": "product_discovery", "product_type": "shirt", "quantity": 2, "modifiers": ["blue", "formal"], "max_budget": 2000, "occasion": "office"}}"""
+        
+        try:
+            parsed = parse_json_response(gemini_assistant.generate_text(prompt, "nlu", validate=_is_turn_response))
+            turn = {
+                "intent": str(parsed.get('intent', '')).strip().lower(),
+                "product_type": parsed.get('product_type') or None,
+                "quantity": _positive_int(parsed.get('quantity')),
+                "modifiers": [str(m) for m in parsed.get('modifiers') or []],
+                "max_budget": _positive_int(parsed.get('max_budget')),
+                "occasion": parsed.get('occasion') or None
+            }
+        except Exception as e:
+            self.log(f"⚠️ Gemini turn understanding failed: {e}")
+            return None
+        
+        if turn['intent'] not in VALID_INTENTS:
+            return None
+        self.log(f"🧠 Gemini understood turn: {turn}")
+        return turn
+    
+    def _analyze_intent(self, user_input: str) -> str:
+        """Rule-based intent classification (no trained model and no Gemini)"""
+        
         user_input_lower = user_input.lower()
         
         # Post-purchase (Specific keywords that shouldn't be confused with checkout)
@@ -207,59 +387,52 @@ Return ONLY the category name."""
             
         return "general"
     
-    def _handle_product_discovery(self, user_input: str) -> Dict[str, Any]:
+    def _handle_product_discovery(self, user_input: str, turn: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Handle product discovery and recommendations"""
+        response, reply = self._prepare_product_discovery(user_input, turn)
+        if reply:
+            response['message'] = "".join(self._reply_chunks(reply))
+        return response
+    
+    def _prepare_product_discovery(self, user_input: str, turn: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, str]]]:
+        """
+        Recommendations for the request, without the reply text: (response,
+        reply) where reply holds the Gemini prompt, the template fallback and
+        a suffix for _reply_chunks (None if the response already has its message)
+        """
         self.log("Initiating product discovery...")
         
-        # Extract context from user input AND previous conversation
-        # Include last few messages for context
-        context = user_input
-        if len(self.conversation_history) > 1:
-            # Get last 2-3 user messages for context
-            recent_messages = [msg['message'] for msg in self.conversation_history[-6:] if msg['role'] == 'user']
-            if recent_messages:
-                context = " ".join(recent_messages[-3:])  # Last 3 user messages
-                self.log(f"📝 Using conversation context: {context}")
+        # Earlier turns reach the RecommendationAgent as extracted slots, not raw messages
+        if self.context.slots:
+            self.log(f"📝 Using conversation context: {self.context.summary()}")
         
+        # Occasion and budget are extracted from the context by the RecommendationAgent's query parser
         occasion = ""
         budget = None
         
-        if "party" in user_input.lower() or "wedding" in user_input.lower():
-            occasion = "party"
-        elif "office" in user_input.lower() or "formal" in user_input.lower():
-            occasion = "formal"
-        
         # Call recommendation agent
         task = {
             "customer_id": self.current_session.get('customer_id'),
-            "context": context,
+            "context": self.context.recent[-1] if self.context.recent else user_input,
+            "conversation": self.context.slots,
             "occasion": occasion,
-            "budget": budget
+            "budget": budget,
+            "nlu": turn or {},
+            "with_message": False  # the reply below is written once, after stock filtering
         }
         
         recommendations = self.recommendation_agent.execute(task)
         
         if recommendations.get('success'):
-            # Filter out-of-stock items using InventoryAgent
-            available_recs = []
-            for prod in recommendations['recommendations']:
-                # Quick inventory check
-                inv_task = {"sku": prod['sku'], "quantity": 1}
-                inv_result = self.inventory_agent.execute(inv_task)
-                
-                # If available or check failed (assume available on fail to not block), keep it
-                if not inv_result.get('success') or inv_result.get('availability', {}).get('status') == 'available':
-                    available_recs.append(prod)
-                else:
-                    self.log(f"⚠️ Filtering out {prod['name']} (SKU: {prod['sku']}) due to inventory status: {inv_result.get('availability', {}).get('status')}")
-            
-            recommendations['recommendations'] = available_recs
+            # What the request resolved to (with the turn understanding, if any) carries into the next turn
+            self.context.remember({**recommendations.get('request', {}), **{k: v for k, v in (turn or {}).items() if v}})
             
-            if not available_recs:
+            # RecommendationAgent checked stock once for the whole result and kept only items in stock
+            if not recommendations['recommendations']:
                  return {
                     "success": False,
                     "message": "I found some items matching your request, but unfortunately they are all out of stock right now. Can I help you find something else?"
-                }
+                }, None
 
             self.current_session['stage'] = 'browsing'
             self.current_session['recommendations'] = recommendations['recommendations']
@@ -269,18 +442,14 @@ Return ONLY the category name."""
             for i, prod in enumerate(recommendations['recommendations'][:5], 1):
                 self.log(f"  {i}. {prod['name']}")
             
-            # Use Gemini to create natural response if available
-            message = ""
-            if GEMINI_ENABLED and gemini_assistant.is_available():
-                try:
-                    # Create context-aware prompt
-                    num_products = len(recommendations['recommendations'])
-                    product_list = "\n".join([
-                        f"{i+1}. {p['name']} - ₹{p['price']} (was ₹{p['mrp']}, {p['discount']}% off) - {p.get('description', '')[:80]}..."
-                        for i, p in enumerate(recommendations['recommendations'][:min(3, num_products)])
-                    ])
-                    
-                    gemini_prompt = f"""You are a friendly shopping assistant. The customer asked: "{user_input}"
+            # Create context-aware prompt
+            num_products = len(recommendations['recommendations'])
+            product_list = "\n".join([
+                f"{i+1}. {p['name']} - ₹{p['price']} (was ₹{p['mrp']}, {p['discount']}% off) - {p.get('description', '')[:80]}..."
+                for i, p in enumerate(recommendations['recommendations'][:min(3, num_products)])
+            ])
+            
+            gemini_prompt = f"""You are a friendly shopping assistant. The customer asked: "{user_input}"
 
 You found {num_products} products for them:
 {product_list}
@@ -301,44 +470,66 @@ Here are my top recommendations:
 [Repeat for each product]"
 
 Make it sound natural and helpful, not robotic!"""
-                    
-                    response = gemini_assistant.model.generate_content(gemini_prompt)
-                    message = response.text.strip()
-                    self.log(f"🤖 Using Gemini-generated response")
-                except Exception as e:
-                    self.log(f"⚠️ Gemini response generation failed: {e}")
             
-            # Fallback to template if Gemini unavailable or failed
-            if not message:
-                message = recommendations['personalized_message'] + "\n\n"
-                message += "Here are my top recommendations:\n\n"
-                
-                num_to_show = min(3, len(recommendations['recommendations']))
-                for i, product in enumerate(recommendations['recommendations'][:num_to_show], 1):
-                    message += f"{i}. **{product['name']}** - ₹{product['price']} (was ₹{product['mrp']}, {product['discount']}% off)\n"
-                    message += f"   {product['description']}\n"
+            # Template used if Gemini is unavailable or fails
+            fallback = recommendations['personalized_message'] + "\n\n"
+            fallback += "Here are my top recommendations:\n\n"
             
+            num_to_show = min(3, len(recommendations['recommendations']))
+            for i, product in enumerate(recommendations['recommendations'][:num_to_show], 1):
+                fallback += f"{i}. **{product['name']}** - ₹{product['price']} (was ₹{product['mrp']}, {product['discount']}% off)\n"
+                fallback += f"   {product['description']}\n"
+            
+            suffix = ""
             if recommendations.get('complementary_items'):
-                message += "\n💡 **You might also like:** "
+                suffix += "\n💡 **You might also like:** "
                 comp_names = [item['name'] for item in recommendations['complementary_items'][:2]]
-                message += ", ".join(comp_names)
+                suffix += ", ".join(comp_names)
             
             return {
                 "success": True,
-                "message": message,
                 "recommendations": recommendations['recommendations'],
+                "complementary_items": recommendations.get('complementary_items', []),
                 "action": "browse_products"
-            }
+            }, {"prompt": gemini_prompt, "fallback": fallback, "suffix": suffix}
+        elif recommendations.get('stock_unchecked'):
+            # A failed check is not "available": nothing unconfirmed is shown
+            return {
+                "success": False,
+                "message": "I found some items matching your request, but I couldn't confirm they're in stock right now. Please try again in a moment."
+            }, None
         else:
             return {
                 "success": False,
                 "message": "I'm having trouble finding recommendations. Could you tell me more about what you're looking for?"
-            }
+            }, None
     
-    def _handle_add_to_cart(self, user_input: str) -> Dict[str, Any]:
-        """Handle adding items to cart"""
-        user_input_lower = user_input.lower()
+    def _reply_chunks(self, reply: Dict[str, str], stream: bool = False) -> Iterator[str]:
+        """Reply text for prepared results: Gemini's (streamed or in one piece) or the template, then the suffix"""
+        written = False
+        if GEMINI_ENABLED and gemini_assistant.is_available():
+            try:
+                if stream:
+                    for chunk in gemini_assistant.stream_text(reply['prompt'], "discovery_response"):
+                        written = True
+                        yield chunk
+                else:
+                    text = gemini_assistant.generate_text(reply['prompt'], "discovery_response")
+                    if text:
+                        written = True
+                        yield text
+                if written:
+                    self.log(f"🤖 Using Gemini-generated response")
+            except Exception as e:
+                self.log(f"⚠️ Gemini response generation failed: {e}")
         
+        if not written:
+            yield reply['fallback']
+        if reply.get('suffix'):
+            yield reply['suffix']
+    
+    def _handle_add_to_cart(self, user_input: str, turn: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Handle adding items to cart"""
         # First, try to get recommendations based on user input if not already available
         if not self.current_session.get('recommendations'):
             # Get recommendations based on user input
@@ -346,7 +537,9 @@ Make it sound natural and helpful, not robotic!"""
                 "customer_id": self.current_session.get('customer_id'),
                 "context": user_input,
                 "occasion": "",
-                "budget": None
+                "budget": None,
+                "nlu": turn or {},
+                "with_message": False
             }
             rec_result = self.recommendation_agent.execute(rec_task)
             if rec_result.get('success'):
@@ -358,82 +551,38 @@ Make it sound natural and helpful, not robotic!"""
                 }
         
         # Search for matching product in recommendations based on keywords
-        product = None
         recommendations = self.current_session.get('recommendations', [])
         
-        # Extract keywords from user input with more context
-        keywords = []
-        product_type = None
-        
-        # Detect specific product types with better matching
-        if 'saree' in user_input_lower or 'sari' in user_input_lower:
-            keywords.append('saree')
-            product_type = 'saree'
-        if 'shirt' in user_input_lower and 't-shirt' not in user_input_lower:
-            keywords.append('shirt')
-            product_type = 'shirt'
-        if 't-shirt' in user_input_lower or 'tshirt' in user_input_lower or 'polo' in user_input_lower:
-            keywords.extend(['t-shirt', 'polo', 'tee'])
-            product_type = 't-shirt'
-        if 'anarkali' in user_input_lower:
-            keywords.append('anarkali')
-            product_type = 'anarkali'
-        if 'kurta' in user_input_lower:
-            keywords.append('kurta')
-            product_type = 'kurta'
-        if 'dress' in user_input_lower:
-            keywords.append('dress')
-            product_type = 'dress'
-        if 'jeans' in user_input_lower:
-            keywords.append('jeans')
-            product_type = 'jeans'
-        if 'lehenga' in user_input_lower:
-            keywords.append('lehenga')
-            product_type = 'lehenga'
-        if 'suit' in user_input_lower and 'anarkali' not in user_input_lower:
-            keywords.append('suit')
-            product_type = 'suit'
-        if 'blazer' in user_input_lower:
-            keywords.append('blazer')
-            product_type = 'blazer'
-        if 'trouser' in user_input_lower or 'pant' in user_input_lower:
-            keywords.extend(['trouser', 'pant', 'chino'])
-            product_type = 'trouser'
-        if 'watch' in user_input_lower:
-            keywords.append('watch')
-            product_type = 'watch'
-        if 'shoe' in user_input_lower or 'shoes' in user_input_lower:
-            keywords.extend(['shoe', 'shoes'])
-            product_type = 'shoe'
-        if 'bag' in user_input_lower or 'handbag' in user_input_lower:
-            keywords.extend(['bag', 'handbag'])
-            product_type = 'bag'
-        if 'accessory' in user_input_lower or 'accessories' in user_input_lower:
-            keywords.extend(['accessory', 'accessories'])
-            product_type = 'accessory'
-        
-        # Check for gender/age modifiers
-        is_girl = 'girl' in user_input_lower or 'girls' in user_input_lower
-        is_boy = 'boy' in user_input_lower or 'boys' in user_input_lower
-        is_kid = 'kid' in user_input_lower or 'kids' in user_input_lower or 'child' in user_input_lower
-        is_men = 'men' in user_input_lower or "men's" in user_input_lower or 'man' in user_input_lower
-        is_women = 'women' in user_input_lower or "women's" in user_input_lower or 'woman' in user_input_lower
-        
-        # Color keywords
-        colors = ['blue', 'red', 'green', 'black', 'white', 'pink', 'yellow', 'purple', 'orange', 'silk']
-        for color in colors:
-            if color in user_input_lower:
-                keywords.append(color)
-        
         # Strategy: Search recommendations first for better context awareness
         all_products = []
+        catalog_version = None
         try:
-            resp = requests.get(f"{self.api_base_url}/api/products", timeout=5)
+            resp = data_client.get(f"{self.api_base_url}/api/products", timeout=5)
             if resp.status_code == 200:
                 all_products = resp.json()
+                catalog_version = resp.headers.get('X-Catalog-Version')
         except Exception as e:
             self.log(f"Error fetching products: {e}")
         
+        # Extract product type, modifiers and audience in one pass
+        slots = get_query_parser(all_products, catalog_version).parse(user_input)
+        product_type = slots['product_type']
+        keywords = slots['keywords'] + slots['colors'] + slots['materials']
+        
+        # Check for gender/age modifiers
+        audience = slots['audience']
+        is_girl = 'girl' in audience
+        is_boy = 'boy' in audience
+        is_kid = 'kid' in audience
+        is_men = 'men' in audience
+        is_women = 'women' in audience
+        
+        def matches_product_type(p):
+            p_name_lower = p['name'].lower()
+            if product_type == 'shirt':
+                return 'shirt' in p_name_lower and 't-shirt' not in p_name_lower
+            return any(term in p_name_lower for term in PRODUCT_MATCH_TERMS.get(product_type, [product_type]))
+        
         # Search function with better logic
         def find_best_match(products_list):
             best_match = None
@@ -445,17 +594,8 @@ Make it sound natural and helpful, not robotic!"""
                 score = 0
                 
                 # Primary keyword matching (product type)
-                if product_type:
-                    if product_type == 'shirt' and 'shirt' in p_name_lower and 't-shirt' not in p_name_lower:
-                        score += 100
-                    elif product_type == 't-shirt' and ('t-shirt' in p_name_lower or 'polo' in p_name_lower):
-                        score += 100
-                    elif product_type == 'saree' and 'saree' in p_name_lower:
-                        score += 100
-                    elif product_type == 'dress' and 'dress' in p_name_lower:
-                        score += 100
-                    elif product_type in p_name_lower:
-                        score += 100
+                if product_type and matches_product_type(p):
+                    score += 100
                 
                 # Gender/category matching
                 if is_men and ("men's" in p_category_lower or 'men' in p_category_lower):
@@ -480,15 +620,21 @@ Make it sound natural and helpful, not robotic!"""
         
         products_to_add = []
         
-        # Check for plural intent ("add these", "add both", "watches")
-        is_plural = any(w in user_input_lower for w in ['all', 'both', 'these', 'watches', 'items', 'products'])
+        # Check for plural intent ("add these", "add both", "add the watches")
+        is_plural = slots['is_plural'] or slots['plural_product']
         
         # 1. Try recommendations first (Context aware)
         if recommendations:
             if is_plural:
-                # If user says "add these watches", add all recommended items
-                products_to_add = recommendations
-            else:
+                if product_type:
+                    # "add these watches" / "add 2 sarees": only the recommended items of that type
+                    products_to_add = [p for p in recommendations if matches_product_type(p)]
+                    if slots['quantity']:
+                        products_to_add = products_to_add[:slots['quantity']]
+                elif slots['is_plural']:
+                    # "add these" / "add both": everything that was recommended
+                    products_to_add = recommendations
+            if not products_to_add:
                 match = find_best_match(recommendations)
                 if match:
                     products_to_add = [match]
@@ -516,22 +662,29 @@ Make it sound natural and helpful, not robotic!"""
         # Process additions
         added_items = []
         failed_items = []
-        
+        unchecked_items = []
+        
+        # One batch stock check for every item, side by side with the upsell for the cart
+        # as it will be if they are all in stock (the usual case)
+        skus = [product['sku'] for product in products_to_add]
+        location = self.current_session.get('context', {}).get('location')
+        expected_cart = self.current_session['cart'] + products_to_add
+        results = self.fan_out({
+            "stock": lambda: self._check_stock(skus, location),
+            "upsell": lambda: self._upsell(expected_cart, all_products, catalog_version)
+        })
+        stock = results['stock'] or {sku: {"success": False, "sku": sku, "error": "Stock check failed"} for sku in skus}
         for product in products_to_add:
-            # Check inventory
-            inventory_task = {
-                "sku": product['sku'],
-                "quantity": 1,
-                "customer_location": self.current_session.get('context', {}).get('location')
-            }
-            
-            inventory_result = self.inventory_agent.execute(inventory_task)
+            inventory_result = stock[product['sku']]
             
-            if inventory_result['success'] and inventory_result['availability']['status'] == 'available':
+            if inventory_result.get('success') and inventory_result['availability']['status'] == 'available':
                 self.current_session['cart'].append(product)
                 added_items.append(product)
                 # Store last inventory result for options display
                 last_inventory_result = inventory_result
+            elif not inventory_result.get('success'):
+                # Stock couldn't be read: neither added nor reported as out of stock
+                unchecked_items.append(product)
             else:
                 failed_items.append(product)
         
@@ -553,6 +706,20 @@ Make it sound natural and helpful, not robotic!"""
             if failed_items:
                 failed_names = ", ".join([p['name'] for p in failed_items])
                 message += f"\n(Note: {failed_names} could not be added due to stock issues.)\n"
+                for p in failed_items:
+                    self._register_back_in_stock(p['sku'])
+            if unchecked_items:
+                unchecked_names = ", ".join([p['name'] for p in unchecked_items])
+                message += f"\n(Note: I couldn't check stock for {unchecked_names} right now, so it wasn't added. Please try again.)\n"
+            
+            # Cross-sell what is frequently bought with the cart (redone if some items weren't added)
+            if len(added_items) == len(products_to_add) and results['upsell'] is not None:
+                bought_together, upsell = results['upsell']
+            else:
+                bought_together, upsell = self._upsell(self.current_session['cart'], all_products, catalog_version)
+            if bought_together:
+                names = ", ".join(f"**{p['name']}** (₹{p['price']})" for p in bought_together)
+                message += f"\n💡 {upsell}\nFrequently bought together: {names}\n"
             
             message += f"\n**Cart Total:** ₹{sum(p['price'] for p in self.current_session['cart'])}\n"
             message += "\nWould you like to:\n1. Continue shopping\n2. Proceed to checkout\n3. Apply promo code"
@@ -561,12 +728,30 @@ Make it sound natural and helpful, not robotic!"""
                 "success": True,
                 "message": message,
                 "cart": self.current_session['cart'],
+                "frequently_bought_together": bought_together,
                 "inventory": last_inventory_result if 'last_inventory_result' in locals() else {}
             }
+        elif not failed_items:
+            names = ", ".join(f"**{p['name']}**" for p in unchecked_items)
+            return {
+                "success": False,
+                "message": f"I couldn't check stock for {names} right now, so nothing was added to your cart. Please try again in a moment."
+            }
         else:
+            for p in failed_items:
+                self._register_back_in_stock(p['sku'])
+            message = "Sorry, the requested items are currently out of stock. I'll notify you when they're back."
+            similar = self._similar_items(failed_items[0]['sku']) if failed_items else []
+            if similar:
+                message += "\n\nYou might like these similar products instead:\n"
+                for i, p in enumerate(similar, 1):
+                    message += f"{i}. **{p['name']}** - ₹{p['price']}\n"
+            else:
+                message += " Would you like to see similar products?"
             return {
                 "success": False,
-                "message": f"Sorry, the requested items are currently out of stock. Would you like to see similar products?"
+                "message": message,
+                "similar_items": similar
             }
     
     def _handle_checkout(self) -> Dict[str, Any]:
@@ -625,6 +810,10 @@ Make it sound natural and helpful, not robotic!"""
                     message += f"✨ You've earned {loyalty_result['points_to_earn']} loyalty points!\n\n"
                 
                 message += f"**Delivery:** {fulfillment_result['estimated_delivery']}\n"
+                allocation = fulfillment_result.get('allocation') or {}
+                if allocation.get('shipment_count', 0) > 1:
+                    origins = ", ".join(s['location'] for s in allocation['shipments'])
+                    message += f"**Shipping from:** {origins}\n"
                 message += f"**Tracking:** {fulfillment_result['tracking_number']}\n\n"
                 message += "Thank you for shopping with us! 🛍️"
                 
@@ -638,6 +827,22 @@ Make it sound natural and helpful, not robotic!"""
                     "order": fulfillment_result,
                     "payment": payment_result
                 }
+            
+            # No order was placed (nothing reserved), so the payment is returned
+            if fulfillment_result.get('on_hold'):
+                short_skus = {line['sku'] for line in fulfillment_result.get('unallocated', [])}
+                names = ", ".join(p['name'] for p in self.current_session['cart'] if p['sku'] in short_skus)
+                message = f"⚠️ I couldn't place your order: {names or 'some items'} just went out of stock.\n\n"
+            else:
+                message = f"⚠️ I couldn't place your order: {fulfillment_result.get('error')}.\n\n"
+            message += f"Your payment (Transaction ID: {payment_result['transaction_id']}) will be refunded. "
+            message += "Your cart is unchanged - would you like to remove those items or see similar products?"
+            return {
+                "success": False,
+                "message": message,
+                "order_error": fulfillment_result,
+                "payment": payment_result
+            }
         else:
             # Payment failed - handle retry
             message = f"⚠️ Payment failed: {payment_result.get('error')}\n\n"
@@ -726,51 +931,89 @@ Make it sound natural and helpful, not robotic!"""
             "message": "I'm here to help! You can:\n• Browse products\n• Get recommendations\n• Check out your cart\n• Apply promo codes\n• Track orders\n\nWhat would you like to do?"
         }
     
+    def _upsell(self, cart: List[Dict[str, Any]], all_products: List[Dict[str, Any]],
+                catalog_version: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """(frequently bought together with the cart, upsell line for them)"""
+        bought_together = self.recommendation_agent.frequently_bought_together(cart, all_products, catalog_version, limit=2)
+        if not bought_together:
+            return [], None
+        if GEMINI_ENABLED:
+            return bought_together, gemini_assistant.generate_upsell_message(cart, bought_together)
+        return bought_together, f"These {bought_together[0]['name']} would pair perfectly with your selection!"
+    
+    def _register_back_in_stock(self, sku: str) -> str:
+        """Subscribe the session's customer to a restock alert, returning a note for the reply"""
+        result = self.inventory_agent.notify_when_available(
+            sku,
+            self.current_session.get('customer_id'),
+            self.current_session.get('channel', 'web')
+        )
+        if result.get('success'):
+            self.current_session.setdefault('back_in_stock_alerts', [])
+            if sku not in self.current_session['back_in_stock_alerts']:
+                self.current_session['back_in_stock_alerts'].append(sku)
+            return result['message']
+        return "Would you like to see similar products?"
+    
+    def _similar_items(self, sku: str, limit: int = 3) -> List[Dict[str, Any]]:
+        """Nearest alternatives for a product (empty if the lookup fails)"""
+        result = self.recommendation_agent.find_similar(sku, limit=limit)
+        return result.get('similar_items', []) if result.get('success') else []
+    
     def _generate_greeting(self, customer_id: str) -> Dict[str, Any]:
-        """Generate personalized greeting"""
-        # Try to get customer data for personalized greeting
-        if GEMINI_ENABLED and gemini_assistant.is_available():
-            try:
-                # Use internal API call if possible, or skip if connection fails
-                try:
-                    response = requests.get(f"{self.api_base_url}/api/customers/{customer_id}", timeout=3)
-                    if response.status_code == 200:
-                        customer = response.json()
-                        
-                        # Also fetch loyalty info explicitly if not in customer object
-                        if 'loyalty_points' not in customer:
-                            try:
-                                loyalty_resp = requests.get(f"{self.api_base_url}/api/loyalty/{customer_id}", timeout=2)
-                                if loyalty_resp.status_code == 200:
-                                    loyalty_data = loyalty_resp.json()
-                                    customer['loyalty_points'] = loyalty_data.get('points', 0)
-                                    customer['loyalty_tier'] = loyalty_data.get('tier', 'Bronze')
-                            except:
-                                pass
-
-                        greeting_text = gemini_assistant.generate_personalized_greeting(
-                            customer, 
-                            self.current_session.get('channel', 'web')
-                        )
-                        return {
-                            "success": True,
-                            "message": greeting_text + "\n\nI can help you:\n✨ Find the perfect products\n📦 Check availability\n🎁 Apply best offers\n🚚 Complete your purchase\n\nWhat are you looking for today?"
-                        }
-                except (requests.exceptions.RequestException, requests.exceptions.Timeout):
-                    pass # Fallback silently
-            except Exception as e:
-                self.log(f"Could not fetch customer data: {str(e)}")
-        
-        # Fallback greeting
+        """
+        Personalized greeting from the greeting cache. On a miss (or once the
+        loyalty tier or points changed) the template greeting is served and
+        the Gemini greeting is generated in the background for next time.
+        """
+        customer = self._greeting_profile(customer_id)
+        if customer is None or not GEMINI_ENABLED:
+            return self._fallback_greeting()
+        
+        channel = self.current_session.get('channel', 'web')
+        greeting_text = greeting_cache.get(customer_id, channel, greeting_version(customer))
+        if greeting_text is None:
+            greeting_text = gemini_assistant.fallback_greeting(customer, channel)
+            if gemini_assistant.is_available():
+                greeting_cache.refresh_async(customer, channel, gemini_assistant.write_greeting)
+        return {
+            "success": True,
+            "message": greeting_text + GREETING_SUFFIX
+        }
+    
+    def _greeting_profile(self, customer_id: str) -> Optional[Dict[str, Any]]:
+        """Customer profile with loyalty tier and points (None if it cannot be fetched)"""
+        # Customer and loyalty lookups run side by side; loyalty fills gaps in the profile
+        fetched = self.fan_out({
+            "customer": (lambda: data_client.get(f"{self.api_base_url}/api/customers/{customer_id}", timeout=3), 3),
+            "loyalty": (lambda: data_client.get(f"{self.api_base_url}/api/loyalty/{customer_id}", timeout=2), 2)
+        })
+        response = fetched['customer']
+        if response is None or response.status_code != 200:
+            return None
+        try:
+            customer = response.json()
+            loyalty_resp = fetched['loyalty']
+            if 'loyalty_points' not in customer and loyalty_resp is not None and loyalty_resp.status_code == 200:
+                loyalty_data = loyalty_resp.json()
+                customer['loyalty_points'] = loyalty_data.get('points', 0)
+                customer['loyalty_tier'] = loyalty_data.get('tier', 'Bronze')
+        except ValueError as e:
+            self.log(f"Could not fetch customer data: {str(e)}")
+            return None
+        return customer
+    
+    def _fallback_greeting(self) -> Dict[str, Any]:
         return {
             "success": True,
-            "message": f"👋 Hello! Welcome to our store! I'm your personal shopping assistant.\n\nI can help you:\n✨ Find the perfect products\n📦 Check availability\n🎁 Apply best offers\n🚚 Complete your purchase\n\nWhat are you looking for today?"
+            "message": "👋 Hello! Welcome to our store! I'm your personal shopping assistant." + GREETING_SUFFIX
         }
     
     def get_state(self):
         """Return the current session state"""
-        # Include conversation history in the session state
-        self.current_session['conversation_history'] = self.conversation_history
+        # Compact state only: the rolling context and the log position (messages are saved via take_turns)
+        self.current_session['conversation_context'] = self.context.to_dict()
+        self.current_session['turn_count'] = self.turn_count
         return self.current_session
 
     def log(self, message: str):
@@ -0,0 +1,129 @@
+"""
+Inventory Events - Change feed delivered to SSE subscribers from the shared event log
+"""
+from typing import Dict, Any, Callable, List, Optional, Iterable
+import json
+import os
+import queue
+import threading
+import time
+
+# Seconds between reads of the shared event log while this worker has subscribers
+EVENT_POLL_SECONDS = float(os.getenv('INVENTORY_EVENT_POLL_SECONDS', 0.25))
+
+
+class InventorySubscription:
+    """A single change-feed consumer (one SSE connection)"""
+
+    def __init__(self, skus: Optional[Iterable[str]] = None, stores: Optional[Iterable[str]] = None,
+                 customer_id: Optional[str] = None, max_queue_size: int = 256):
+        self.skus = set(skus) if skus else None
+        self.stores = set(stores) if stores else None
+        self.customer_id = customer_id
+        self.overflowed = False
+        self._queue = queue.Queue(maxsize=max_queue_size)
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        """Check whether an event is relevant to this subscriber"""
+        if event['type'] == 'back_in_stock' and self.customer_id in event.get('customer_ids', []):
+            return True
+
+        # No filters means "everything"
+        if self.skus is None and self.stores is None:
+            return True
+        if self.skus is not None and event.get('sku') in self.skus:
+            return True
+        if self.stores is not None and event.get('location') in self.stores:
+            return True
+        return False
+
+    def put(self, event: Dict[str, Any]):
+        """Queue an event without ever blocking the publisher"""
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            # Slow consumer: drop the oldest event and tell the client to resync
+            self.overflowed = True
+            try:
+                self._queue.get_nowait()
+                self._queue.put_nowait(event)
+            except (queue.Empty, queue.Full):
+                pass
+
+    def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait up to `timeout` seconds for the next event"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class InventoryEventBus:
+    """
+    Fan-out of stock events to this worker's live subscribers.
+
+    Events are written to the shared store by whichever worker applies the
+    change; every worker tails the store's event log from a background
+    thread (only while it has subscribers) and delivers what it reads, so a
+    stream sees changes made on any worker.
+    """
+
+    def __init__(self, source: Callable[[int], List[Dict[str, Any]]], head: Callable[[], int],
+                 poll_interval: float = EVENT_POLL_SECONDS):
+        self._source = source
+        self._head = head
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._tailer = None
+        self.last_id = 0
+
+    def subscribe(self, skus=None, stores=None, customer_id=None) -> InventorySubscription:
+        subscription = InventorySubscription(skus, stores, customer_id)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._tailer is None:
+                # Start from the end of the log; older events are replayed per stream
+                self.last_id = self._head()
+                self._tailer = threading.Thread(target=self._tail, name="inventory-events", daemon=True)
+                self._tailer.start()
+        return subscription
+
+    def unsubscribe(self, subscription: InventorySubscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def _tail(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._tailer = None
+                    return
+            try:
+                events = self._source(self.last_id)
+            except Exception as e:
+                print(f"Inventory event log read failed: {e}")
+                events = []
+            for event in events:
+                self.deliver(event)
+                self.last_id = event['id']
+            if not events:
+                time.sleep(self.poll_interval)
+
+    def deliver(self, event: Dict[str, Any]):
+        """Queue an event for every matching subscriber"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            if subscription.matches(event):
+                subscription.put(event)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Serialize an event as a server-sent events frame"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
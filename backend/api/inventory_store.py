@@ -0,0 +1,238 @@
+"""
+Inventory Store - Stock records, versions and stock events shared by every worker process
+"""
+from typing import Dict, Any, Callable, List, Optional, Tuple
+from datetime import datetime
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+# One file per host; all gunicorn workers read and mutate the same stock through it
+INVENTORY_STORE_PATH = os.getenv('INVENTORY_STORE_PATH', os.path.join('data', 'inventory_state.db'))
+
+# Stock events kept for stream replay (Last-Event-ID) and for workers tailing the log
+INVENTORY_EVENT_RETENTION = int(os.getenv('INVENTORY_EVENT_RETENTION', 10000))
+
+
+class InsufficientStock(Exception):
+    """A reservation asked for more than a location holds; nothing was changed"""
+
+    def __init__(self, shortfalls: List[Dict[str, Any]]):
+        super().__init__(f"Insufficient stock for {len(shortfalls)} line(s)")
+        self.shortfalls = shortfalls
+
+
+class InventoryStore:
+    """
+    Inventory records in SQLite, so every worker sees the same stock and the
+    same versions.
+
+    Each record carries the version of its last change, drawn from one
+    counter; the records table is therefore a key-compacted change log, and
+    "changed since v" is a range query. The epoch names one seeding of the
+    store: it is regenerated whenever the store is reseeded from a different
+    inventory.json, and clients holding versions from another epoch resync.
+
+    Stock events are appended to an events table in the same transaction as
+    the change, with ids that are global across workers, and customers
+    waiting for a restock are kept here too, so whichever worker applies a
+    restock notifies everyone registered on any worker.
+    """
+
+    def __init__(self, path: str = INVENTORY_STORE_PATH, event_retention: int = INVENTORY_EVENT_RETENTION):
+        self.path = path
+        self.event_retention = event_retention
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "id INTEGER PRIMARY KEY CHECK (id = 1), epoch TEXT, version INTEGER, source TEXT)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS records (sku TEXT PRIMARY KEY, record TEXT, version INTEGER)")
+            conn.execute("CREATE INDEX IF NOT EXISTS records_version ON records (version)")
+            conn.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, event TEXT)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS waiting ("
+                "sku TEXT, customer_id TEXT, channel TEXT, requested_at TEXT, PRIMARY KEY (sku, customer_id))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def seed(self, records: Dict[str, Dict[str, Any]], source: str) -> bool:
+        """
+        Load `records` at version 1 under a new epoch, unless the store was
+        already seeded from the same `source` (content hash of the file), in
+        which case the stock changed since is kept. True if it reseeded.
+        """
+        def run(conn):
+            row = conn.execute("SELECT source FROM state WHERE id = 1").fetchone()
+            if row is not None and row[0] == source:
+                return False
+            conn.execute("DELETE FROM records")
+            conn.executemany(
+                "INSERT INTO records (sku, record, version) VALUES (?, ?, 1)",
+                [(sku, json.dumps({**record, "version": 1})) for sku, record in records.items()]
+            )
+            # The initially loaded data is version 1, so "since=0" always means "send everything"
+            conn.execute("INSERT OR REPLACE INTO state (id, epoch, version, source) VALUES (1, ?, 1, ?)",
+                         (uuid.uuid4().hex[:12], source))
+            return True
+
+        return self._transaction(run)
+
+    def head(self) -> Tuple[str, int]:
+        """(epoch, current version)"""
+        return tuple(self._connection().execute("SELECT epoch, version FROM state WHERE id = 1").fetchone())
+
+    def get(self, sku: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute("SELECT record FROM records WHERE sku = ?", (sku,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, skus: List[str]) -> Dict[str, Dict[str, Any]]:
+        found = {}
+        for start in range(0, len(skus), 500):
+            chunk = skus[start:start + 500]
+            for sku, record in self._connection().execute(
+                f"SELECT sku, record FROM records WHERE sku IN ({','.join('?' * len(chunk))})", chunk
+            ):
+                found[sku] = json.loads(record)
+        return {sku: found[sku] for sku in skus if sku in found}
+
+    def snapshot(self) -> Tuple[str, int, List[Dict[str, Any]]]:
+        """(epoch, version, every record), read consistently"""
+        def run(conn):
+            epoch, version = conn.execute("SELECT epoch, version FROM state WHERE id = 1").fetchone()
+            records = [json.loads(r) for (r,) in conn.execute("SELECT record FROM records ORDER BY sku")]
+            return epoch, version, records
+
+        return self._transaction(run)
+
+    def changed_since(self, since: int) -> Tuple[str, int, List[Dict[str, Any]]]:
+        """(epoch, version, records changed after `since`, oldest change first)"""
+        def run(conn):
+            epoch, version = conn.execute("SELECT epoch, version FROM state WHERE id = 1").fetchone()
+            records = [json.loads(r) for (r,) in conn.execute(
+                "SELECT record FROM records WHERE version > ? ORDER BY version", (since,)
+            )]
+            return epoch, version, records
+
+        return self._transaction(run)
+
+    def update(self, sku: str, change: Callable[[Dict[str, Any]], Optional[List[Dict[str, Any]]]]
+               ) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        """
+        Apply change(record) to one record atomically across workers and
+        give it the next version. `change` mutates the record and returns the
+        events describing it, or None to leave everything untouched.
+
+        Events are stamped with the record's new version, a timestamp and a
+        global id, and appended to the event log in the same transaction. A
+        "back_in_stock" event takes everyone waiting on the SKU (filling in
+        customer_ids and channels) and is dropped if nobody was. Returns
+        (record, events), or None if the SKU is unknown or nothing changed.
+        """
+        return self._transaction(lambda conn: self._apply(conn, sku, change))
+
+    def update_many(self, changes: List[Tuple[str, Callable[[Dict[str, Any]], Optional[List[Dict[str, Any]]]]]]
+                    ) -> List[Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]]:
+        """
+        update() for several SKUs in one transaction: all of the changes are
+        applied or none. A change raises InsufficientStock to refuse; the
+        shortfalls of every refusing change are collected and raised together
+        after the transaction is rolled back.
+        """
+        def run(conn):
+            results, shortfalls = [], []
+            for sku, change in changes:
+                try:
+                    results.append(self._apply(conn, sku, change))
+                except InsufficientStock as e:
+                    shortfalls.extend(e.shortfalls)
+            if shortfalls:
+                raise InsufficientStock(shortfalls)
+            return results
+
+        return self._transaction(run)
+
+    def _apply(self, conn: sqlite3.Connection, sku: str, change) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        row = conn.execute("SELECT record FROM records WHERE sku = ?", (sku,)).fetchone()
+        if row is None:
+            return None
+        record = json.loads(row[0])
+        events = change(record)
+        if events is None:
+            return None
+        version = conn.execute("UPDATE state SET version = version + 1 WHERE id = 1 RETURNING version").fetchall()[0][0]
+        record['version'] = version
+        conn.execute("UPDATE records SET record = ?, version = ? WHERE sku = ?", (json.dumps(record), version, sku))
+
+        published = []
+        for event in events:
+            if event['type'] == 'back_in_stock':
+                waiting = conn.execute(
+                    "DELETE FROM waiting WHERE sku = ? RETURNING customer_id, channel", (sku,)
+                ).fetchall()
+                if not waiting:
+                    continue
+                event['customer_ids'] = [customer_id for customer_id, _ in waiting]
+                event['channels'] = dict(waiting)
+            event['version'] = version
+            event['timestamp'] = datetime.now().isoformat()
+            # The row id is the event id; it is added back when the log is read
+            event['id'] = conn.execute("INSERT INTO events (event) VALUES (?)", (json.dumps(event),)).lastrowid
+            published.append(event)
+        if published:
+            conn.execute("DELETE FROM events WHERE id <= ?", (published[-1]['id'] - self.event_retention,))
+        return record, published
+
+    def last_event_id(self) -> int:
+        row = self._connection().execute("SELECT MAX(id) FROM events").fetchone()
+        return row[0] or 0
+
+    def events_after(self, after: int, limit: int = 500) -> List[Dict[str, Any]]:
+        """Logged events with an id above `after`, oldest first"""
+        return [{**json.loads(event), "id": event_id} for event_id, event in self._connection().execute(
+            "SELECT id, event FROM events WHERE id > ? ORDER BY id LIMIT ?", (after, limit)
+        )]
+
+    def add_waiting(self, sku: str, customer_id: str, channel: str = "web") -> bool:
+        """Register a customer for a back-in-stock event; False if they were already waiting"""
+        def run(conn):
+            exists = conn.execute(
+                "SELECT 1 FROM waiting WHERE sku = ? AND customer_id = ?", (sku, customer_id)
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO waiting (sku, customer_id, channel, requested_at) VALUES (?, ?, ?, ?)",
+                (sku, customer_id, channel, datetime.now().isoformat())
+            )
+            return exists is None
+
+        return self._transaction(run)
+
+    def waiting_for(self, customer_id: str) -> List[str]:
+        """SKUs a customer is waiting on"""
+        return [sku for (sku,) in self._connection().execute(
+            "SELECT sku FROM waiting WHERE customer_id = ? ORDER BY sku", (customer_id,)
+        )]
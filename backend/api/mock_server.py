@@ -1,9 +1,16 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, Response, stream_with_context
 import json
 import os
 import random
+import threading
+import time
 from datetime import datetime
 
+from api.inventory_events import InventoryEventBus, format_sse
+from api.inventory_store import InventoryStore, InsufficientStock
+from src.similarity_index import get_similarity_index
+from src.versioning import content_version
+
 api_bp = Blueprint('mock_api', __name__)
 
 # Load data
@@ -16,9 +23,150 @@ def load_json(filename):
 
 customers = load_json('customers.json') or []
 products = load_json('products.json') or []
-inventory = load_json('inventory.json') or {}
 promotions_data = load_json('promotions.json') or {}
 
+# Products are static for the life of the process; clients key caches on this
+CATALOG_VERSION = content_version(products)
+products_by_sku = {p['sku']: p for p in products}
+
+# Stock lives in a store shared by all workers (so stock and versions agree whichever
+# worker answers); it is reseeded only when inventory.json itself changes
+inventory_store = InventoryStore()
+_inventory_seed = load_json('inventory.json') or {}
+inventory_store.seed(_inventory_seed, content_version(_inventory_seed))
+del _inventory_seed
+
+# Per worker process: delivers events from the shared log to this worker's streams
+event_bus = InventoryEventBus(inventory_store.events_after, inventory_store.last_event_id)
+
+# Change feed tuning
+STREAM_HEARTBEAT_SECONDS = float(os.getenv('INVENTORY_STREAM_HEARTBEAT', 15))
+STREAM_MAX_SECONDS = float(os.getenv('INVENTORY_STREAM_MAX_SECONDS', 60))
+# Missed events replayed to a reconnecting stream before it is told to resync instead
+STREAM_REPLAY_LIMIT = int(os.getenv('INVENTORY_STREAM_REPLAY_LIMIT', 500))
+
+# Optional JSON-lines log of created orders (input for build_copurchase.py)
+ORDER_LOG_PATH = os.getenv('ORDER_LOG_PATH')
+order_log_lock = threading.Lock()
+
+def total_stock(inv):
+    """Units available anywhere (warehouses + stores)"""
+    return sum(inv['warehouse_stock'].values()) + sum(inv['store_stock'].values())
+
+def _set_stock(inv, sku, location, quantity):
+    """
+    Set one location's stock on an inventory record; returns the events
+    describing the change, or None if the location is unknown
+    """
+    if location in inv['warehouse_stock']:
+        stock, location_type = inv['warehouse_stock'], 'warehouse'
+    elif location in inv['store_stock']:
+        stock, location_type = inv['store_stock'], 'store'
+    else:
+        return None
+
+    total_before = total_stock(inv)
+    stock[location] = max(0, int(quantity))
+    total_after = total_stock(inv)
+
+    events = [{
+        "type": "stock_changed",
+        "sku": sku,
+        "name": inv.get('name'),
+        "location": location,
+        "location_type": location_type,
+        "quantity": stock[location],
+        "total_available": total_after
+    }]
+    # Replenished from zero: notify everyone who asked to be told
+    if total_before == 0 and total_after > 0:
+        events.append({
+            "type": "back_in_stock",
+            "sku": sku,
+            "name": inv.get('name'),
+            "location": location,
+            "total_available": total_after
+        })
+    return events
+
+def location_stock(inv, location):
+    """Units at one warehouse or store (None if the SKU isn't stocked there)"""
+    return inv['warehouse_stock'].get(location, inv['store_stock'].get(location))
+
+def apply_stock_change(sku, location, delta=None, quantity=None):
+    """
+    Mutate stock for one SKU at one location and log the change for every worker's streams.
+
+    Either `delta` (relative) or `quantity` (absolute) must be given.
+    Returns the published event, or None if the SKU/location is unknown.
+    """
+    def change(inv):
+        current = location_stock(inv, location)
+        if current is None:
+            return None
+        return _set_stock(inv, sku, location, quantity if quantity is not None else current + (delta or 0))
+
+    changed = inventory_store.update(sku, change)
+    if changed is None:
+        return None
+    _, events = changed
+    return events[0]
+
+def reserve_order_stock(order_data):
+    """
+    Decrement stock for the items of a newly created order, all lines in one
+    transaction. Raises InsufficientStock (and changes nothing) if any line
+    asks for more than its location holds now: stock is never clamped to
+    cover an order.
+    """
+    wanted = {}  # sku -> {location: quantity}
+    allocation = order_data.get('allocation')
+    if allocation and allocation.get('shipments'):
+        # FulfillmentAgent decided which location ships which line; checked against current stock below
+        for shipment in allocation['shipments']:
+            for item in shipment.get('items', []):
+                locations = wanted.setdefault(item['sku'], {})
+                locations[shipment['location']] = locations.get(shipment['location'], 0) + int(item['quantity'])
+    else:
+        store_location = order_data.get('store_location')
+        for item in order_data.get('items') or []:
+            sku = item.get('sku')
+            inv = inventory_store.get(sku)
+            if not inv:
+                continue
+            # In-store pickup/reservation takes from that store, shipping from the fullest warehouse
+            if store_location and store_location in inv['store_stock']:
+                location = store_location
+            else:
+                location = max(inv['warehouse_stock'], key=inv['warehouse_stock'].get)
+            locations = wanted.setdefault(sku, {})
+            locations[location] = locations.get(location, 0) + int(item.get('quantity', 1))
+
+    known = inventory_store.get_many(list(wanted))
+    unknown = [{"sku": sku, "location": location, "requested": quantity, "available": 0}
+               for sku, locations in wanted.items() if sku not in known
+               for location, quantity in locations.items()]
+    if unknown:
+        raise InsufficientStock(unknown)
+
+    def take(sku, locations):
+        def change(inv):
+            shortfalls = [
+                {"sku": sku, "location": location, "requested": quantity,
+                 "available": location_stock(inv, location) or 0}
+                for location, quantity in locations.items()
+                if (location_stock(inv, location) or 0) < quantity
+            ]
+            if shortfalls:
+                raise InsufficientStock(shortfalls)
+            events = []
+            for location, quantity in locations.items():
+                events += _set_stock(inv, sku, location, location_stock(inv, location) - quantity)
+            return events
+        return change
+
+    inventory_store.update_many([(sku, take(sku, locations)) for sku, locations in wanted.items()])
+
 # API Endpoints
 
 @api_bp.route('/api/health', methods=['GET'])
@@ -37,14 +185,34 @@ def get_customer(customer_id):
 def get_all_customers():
     return jsonify(customers)
 
+@api_bp.route('/api/versions', methods=['GET'])
+def get_data_versions():
+    """Current catalog, inventory and (optionally) customer profile versions, for cache validation"""
+    versions = {
+        "catalog": CATALOG_VERSION,
+        "inventory": "{}:{}".format(*inventory_store.head())
+    }
+    customer_id = request.args.get('customer_id')
+    if customer_id:
+        customer = next((c for c in customers if c['customer_id'] == customer_id), None)
+        if not customer:
+            return jsonify({"error": "Customer not found"}), 404
+        versions["customer"] = content_version(customer)
+    return jsonify(versions)
+
 # Product APIs
 @api_bp.route('/api/products', methods=['GET'])
 def get_products():
     category = request.args.get('category')
     search = request.args.get('search', '').lower()
+    skus = [s for s in request.args.get('skus', '').split(',') if s]
     
     filtered_products = products
     
+    if skus:
+        # Exact lookup in the requested order (unknown SKUs are skipped)
+        filtered_products = [products_by_sku[s] for s in skus if s in products_by_sku]
+    
     if category:
         filtered_products = [p for p in filtered_products if p['category'] == category]
     
@@ -52,7 +220,10 @@ def get_products():
         filtered_products = [p for p in filtered_products 
                            if search in p['name'].lower() or search in p['description'].lower()]
     
-    return jsonify(filtered_products)
+    response = jsonify(filtered_products)
+    if filtered_products is products:
+        response.headers['X-Catalog-Version'] = CATALOG_VERSION
+    return response
 
 @api_bp.route('/api/products/<sku>', methods=['GET'])
 def get_product(sku):
@@ -61,11 +232,68 @@ def get_product(sku):
         return jsonify(product)
     return jsonify({"error": "Product not found"}), 404
 
+@api_bp.route('/api/products/<sku>/similar', methods=['GET'])
+def get_similar_products(sku):
+    """Nearest products by category, material, color, occasion and price band"""
+    limit = min(max(request.args.get('limit', 5, type=int), 1), 50)
+    categories = request.args.getlist('category') or None
+    
+    index = get_similarity_index(products, CATALOG_VERSION)
+    if sku not in index.positions:
+        return jsonify({"error": "Product not found"}), 404
+    
+    similar = [
+        {**products[index.positions[similar_sku]], "similarity": score}
+        for similar_sku, score in index.similar(sku, k=limit, categories=categories)
+    ]
+    return jsonify(similar)
+
 # Inventory APIs
+@api_bp.route('/api/inventory/changes', methods=['GET'])
+def get_inventory_changes():
+    """
+    Delta sync for kiosks and mobile clients.
+
+    Clients pass the `version` (and `epoch`) from their previous sync and get back
+    only the records changed since then. A delta needs the epoch the version came
+    from; a full snapshot is returned for first syncs, a missing or different epoch
+    (the store was reseeded) and versions ahead of the store's.
+    """
+    since = request.args.get('since', type=int, default=0)
+    epoch = request.args.get('epoch')
+
+    mode = "snapshot"
+    if since > 0 and epoch:
+        # Epoch and head are read in the same transaction as the changes
+        current_epoch, version, records = inventory_store.changed_since(since)
+        if current_epoch == epoch and since <= version:
+            mode = "delta"
+    if mode == "snapshot":
+        current_epoch, version, records = inventory_store.snapshot()
+
+    return jsonify({
+        "mode": mode,
+        "epoch": current_epoch,
+        "since": since,
+        "version": version,
+        "count": len(records),
+        "changes": records
+    })
+
+@api_bp.route('/api/inventory/batch', methods=['GET', 'POST'])
+def get_inventory_batch():
+    """Inventory records for several SKUs in one call: POST {"skus": [...]} or GET ?skus=A,B"""
+    if request.method == 'GET':
+        skus = [s for s in request.args.get('skus', '').split(',') if s]
+    else:
+        skus = (request.json or {}).get('skus', [])
+    return jsonify(inventory_store.get_many(skus))
+
 @api_bp.route('/api/inventory/<sku>', methods=['GET'])
 def get_inventory(sku):
-    if sku in inventory:
-        return jsonify(inventory[sku])
+    inv = inventory_store.get(sku)
+    if inv:
+        return jsonify(inv)
     return jsonify({"error": "Inventory not found"}), 404
 
 @api_bp.route('/api/inventory/check', methods=['POST'])
@@ -75,11 +303,10 @@ def check_inventory():
     location = data.get('location')
     quantity = data.get('quantity', 1)
     
-    if sku not in inventory:
+    inv = inventory_store.get(sku)
+    if not inv:
         return jsonify({"available": False, "message": "Product not found"})
     
-    inv = inventory[sku]
-    
     # Check store stock
     if location and location in inv['store_stock']:
         available = inv['store_stock'][location] >= quantity
@@ -101,6 +328,104 @@ def check_inventory():
         "type": "warehouse"
     })
 
+@api_bp.route('/api/inventory/<sku>/adjust', methods=['POST'])
+def adjust_inventory(sku):
+    """Restock or correct stock at a location: {"location", "delta"} or {"location", "quantity"}"""
+    data = request.json or {}
+    location = data.get('location')
+    delta = data.get('delta')
+    quantity = data.get('quantity')
+
+    if not location or (delta is None and quantity is None):
+        return jsonify({"success": False, "error": "location and delta or quantity are required"}), 400
+
+    event = apply_stock_change(sku, location, delta=delta, quantity=quantity)
+    if not event:
+        return jsonify({"success": False, "error": "Unknown SKU or location"}), 404
+
+    return jsonify({"success": True, "event": event})
+
+@api_bp.route('/api/inventory/notify', methods=['POST'])
+def notify_back_in_stock():
+    """Register a customer for a back-in-stock notification"""
+    data = request.json or {}
+    sku = data.get('sku')
+    customer_id = data.get('customer_id')
+    channel = data.get('channel', 'web')
+
+    inv = inventory_store.get(sku) if sku else None
+    if not inv or not customer_id:
+        return jsonify({"success": False, "error": "Valid sku and customer_id are required"}), 400
+
+    is_new = inventory_store.add_waiting(sku, customer_id, channel)
+    return jsonify({
+        "success": True,
+        "sku": sku,
+        "customer_id": customer_id,
+        "already_subscribed": not is_new,
+        "in_stock": total_stock(inv) > 0
+    })
+
+@api_bp.route('/api/inventory/notify/<customer_id>', methods=['GET'])
+def get_back_in_stock_subscriptions(customer_id):
+    return jsonify({"customer_id": customer_id, "skus": inventory_store.waiting_for(customer_id)})
+
+@api_bp.route('/api/inventory/stream', methods=['GET'])
+def stream_inventory():
+    """
+    Server-sent events feed of stock changes.
+
+    Query params (all optional): skus=A,B  stores=X,Y  customer_id=C
+    A reconnecting client's Last-Event-ID is honoured: events it missed are
+    replayed from the shared log first. The stream closes after
+    INVENTORY_STREAM_MAX_SECONDS to free the worker thread; EventSource
+    clients reconnect automatically.
+    """
+    skus = [s for s in request.args.get('skus', '').split(',') if s]
+    stores = [s for s in request.args.get('stores', '').split(',') if s]
+    customer_id = request.args.get('customer_id')
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+
+    # Subscribe before reading the backlog so nothing falls between the two
+    subscription = event_bus.subscribe(skus, stores, customer_id)
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            sent = last_event_id or 0
+            if last_event_id is not None:
+                backlog = inventory_store.events_after(last_event_id, limit=STREAM_REPLAY_LIMIT + 1)
+                if len(backlog) > STREAM_REPLAY_LIMIT or (backlog and backlog[0]['id'] > last_event_id + 1):
+                    # Too far behind, or the missed events were pruned: refetch current stock instead
+                    yield "event: resync\ndata: {}\n\n"
+                    backlog = []
+                for event in backlog:
+                    if subscription.matches(event):
+                        yield format_sse(event)
+                    sent = event['id']
+            deadline = time.time() + STREAM_MAX_SECONDS
+            while time.time() < deadline:
+                event = subscription.get(timeout=min(STREAM_HEARTBEAT_SECONDS, max(0.0, deadline - time.time())))
+                if subscription.overflowed:
+                    # Events were dropped; the client should refetch current stock
+                    subscription.overflowed = False
+                    yield "event: resync\ndata: {}\n\n"
+                if event is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event['id'] <= sent:
+                    continue  # Already replayed from the backlog
+                sent = event['id']
+                yield format_sse(event)
+        finally:
+            event_bus.unsubscribe(subscription)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # Payment APIs
 @api_bp.route('/api/payment/process', methods=['POST'])
 def process_payment():
@@ -237,18 +562,60 @@ def redeem_points():
         "remaining_points": available_points - points
     })
 
+def log_order(order_id, order_data):
+    """Append one order per line; each line is a single write so workers don't interleave"""
+    if not ORDER_LOG_PATH:
+        return
+    record = {
+        "order_id": order_id,
+        "customer_id": order_data.get('customer_id'),
+        "items": [
+            {"sku": item.get('sku'), "quantity": item.get('quantity', 1)}
+            for item in order_data.get('items', []) if isinstance(item, dict)
+        ],
+        "created_at": datetime.now().isoformat()
+    }
+    try:
+        with order_log_lock, open(ORDER_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"⚠️  Could not write order log: {e}")
+
 # Order/Fulfillment APIs
 @api_bp.route('/api/orders/create', methods=['POST'])
 def create_order():
-    data = request.json
+    data = request.json or {}
+    
+    try:
+        reserve_order_stock(data)
+    except InsufficientStock as e:
+        # Nothing was reserved; the client must re-plan (or hold the order) rather than oversell
+        return jsonify({
+            "success": False,
+            "error": "Insufficient stock",
+            "shortfalls": e.shortfalls
+        }), 409
     
     order_id = f"ORD{random.randint(100000, 999999)}"
+    log_order(order_id, data)
+    
+    allocation = data.get('allocation') or {}
+    shipment_count = allocation.get('shipment_count', 1)
     
     return jsonify({
         "success": True,
         "order_id": order_id,
         "order_details": data,
-        "estimated_delivery": "3-5 business days",
+        "shipments": [
+            {
+                "shipment_id": f"{order_id}-{i}",
+                "location": shipment['location'],
+                "items": shipment['items'],
+                "tracking_number": f"TRK{random.randint(100000, 999999)}"
+            }
+            for i, shipment in enumerate(allocation.get('shipments', []), 1)
+        ],
+        "estimated_delivery": "3-5 business days" if shipment_count <= 1 else "3-5 business days (arrives in multiple packages)",
         "tracking_number": f"TRK{random.randint(100000, 999999)}"
     })
 
@@ -2,11 +2,12 @@
 Backend Main Server
 Combines Data API and Sales Agent API
 """
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from werkzeug.exceptions import HTTPException
 from flask_cors import CORS
 import sys
 import os
+import json
 import uuid
 from dotenv import load_dotenv
 
@@ -22,6 +23,8 @@ from api.mock_server import api_bp
 # Import Sales Agent routes
 from agents.sales_agent import SalesAgent
 from session_manager import SessionManager
+from src.session_cache import SessionCache
+from src.metrics import metrics
 
 app = Flask(__name__)
 # Enable CORS for all domains on all routes (Fixes Vercel/Render communication)
@@ -32,7 +35,12 @@ CORS(app, resources={r"/*": {"origins": "*"}})
 app.register_blueprint(api_bp)
 
 # Initialize Session Manager (Supports SQLite for local, Postgres for Render)
-session_manager = SessionManager()
+session_store = SessionManager()
+metrics.register_collector("session_store", session_store.snapshot)
+
+# Routes read and write sessions through a write-behind cache; the database is written in batches
+session_manager = SessionCache(session_store)
+metrics.register_collector("session_cache", session_manager.snapshot)
 
 @app.errorhandler(Exception)
 def handle_exception(e):
@@ -50,6 +58,11 @@ def handle_exception(e):
 def health():
     return jsonify({"status": "ok", "message": "Backend server is running"})
 
+# Per-worker counters, timings and cache hit rates
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify(metrics.snapshot())
+
 # Sales Agent Routes
 @app.route('/api/start_session', methods=['POST'])
 def start_session():
@@ -72,13 +85,15 @@ def start_session():
         session_id, 
         customer_id, 
         channel, 
-        sales_agent.get_state()
+        sales_agent.get_state(),
+        turns=sales_agent.take_turns()
     )
     
     return jsonify({
         "success": True,
         "session_id": session_id,
-        "message": greeting['message']
+        "message": greeting['message'],
+        "recommendations": greeting.get('recommendations', [])
     })
 
 @app.route('/api/chat', methods=['POST'])
@@ -116,11 +131,77 @@ def chat():
         session_id, 
         sales_agent.current_session.get('customer_id'), 
         sales_agent.current_session.get('channel'), 
-        sales_agent.get_state()
+        sales_agent.get_state(),
+        turns=sales_agent.take_turns()
     )
     
     return jsonify(response)
 
+@app.route('/api/chat/stream', methods=['GET', 'POST'])
+def chat_stream():
+    """
+    /api/chat as Server-Sent Events: `intent`, then `result` (products, cart)
+    as soon as they exist, `token` events with the reply text as it is
+    generated, and `done` with the full response. GET takes session_id and
+    message as query parameters for EventSource clients.
+    """
+    data = request.json if request.method == 'POST' else request.args
+    session_id = data.get('session_id')
+    user_message = data.get('message')
+    
+    # Load session state
+    state = session_manager.load_session(session_id)
+    if not state:
+        return jsonify({
+            "success": False,
+            "error": "Session not found"
+        }), 404
+    
+    # Rehydrate agent
+    port = os.environ.get('PORT', 5000)
+    host_url = f"http://127.0.0.1:{port}"
+    
+    sales_agent = SalesAgent(api_base_url=host_url)
+    sales_agent.load_state(state)
+    
+    def sse(event, payload):
+        return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+    
+    def save():
+        session_manager.save_session(
+            session_id,
+            sales_agent.current_session.get('customer_id'),
+            sales_agent.current_session.get('channel'),
+            sales_agent.get_state(),
+            turns=sales_agent.take_turns()
+        )
+    
+    def events():
+        saved = False
+        try:
+            for event, payload in sales_agent.handle_conversation_stream(user_message):
+                if event == "done":
+                    # Save before the last event, in case the client disconnects after reading it
+                    save()
+                    saved = True
+                yield sse(event, payload)
+        except Exception as e:
+            print(f"Error in handle_conversation_stream: {e}")
+            import traceback
+            traceback.print_exc()
+            yield sse("error", {"success": False, "error": str(e)})
+        finally:
+            # The client went away or the turn failed midway: keep what the turn did
+            # so far (its message, cart and conversation state)
+            if not saved:
+                save()
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route('/api/cart/add', methods=['POST'])
 def add_to_cart():
     data = request.json
@@ -148,7 +229,8 @@ def add_to_cart():
         session_id, 
         sales_agent.current_session.get('customer_id'), 
         sales_agent.current_session.get('channel'), 
-        sales_agent.get_state()
+        sales_agent.get_state(),
+        turns=sales_agent.take_turns()
     )
     
     return jsonify(result)
@@ -234,7 +316,8 @@ def apply_promo():
             session_id, 
             sales_agent.current_session.get('customer_id'), 
             sales_agent.current_session.get('channel'), 
-            sales_agent.get_state()
+            sales_agent.get_state(),
+            turns=sales_agent.take_turns()
         )
 
         return jsonify({
@@ -279,7 +362,8 @@ def redeem_points():
         session_id, 
         sales_agent.current_session.get('customer_id'), 
         sales_agent.current_session.get('channel'), 
-        sales_agent.get_state()
+        sales_agent.get_state(),
+        turns=sales_agent.take_turns()
     )
 
     # Return updated cart summary
@@ -327,7 +411,7 @@ def switch_channel():
     port = os.environ.get('PORT', 5000)
     host_url = f"http://127.0.0.1:{port}"
     sales_agent = SalesAgent(api_base_url=host_url)
-    sales_agent.load_state(state)
+    sales_agent.load_state(state, history_loader=lambda limit: session_manager.load_turns(session_id, limit))
     
     response = sales_agent.switch_channel(new_channel)
     
@@ -336,7 +420,8 @@ def switch_channel():
         session_id, 
         sales_agent.current_session.get('customer_id'), 
         sales_agent.current_session.get('channel'), 
-        sales_agent.get_state()
+        sales_agent.get_state(),
+        turns=sales_agent.take_turns()
     )
     
     return jsonify(response)
@@ -0,0 +1,97 @@
+"""
+Benchmark the order allocation engine on synthetic inventories
+
+Usage (from backend/):
+    python benchmarks/bench_allocation.py
+    python benchmarks/bench_allocation.py --skus 20000 --carts 2000 --scarcity 0.6
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.allocation import OrderAllocator, CITY_COORDINATES
+
+WAREHOUSES = ["Mumbai Warehouse", "Delhi Warehouse", "Bangalore Warehouse"]
+STORES = [
+    "Phoenix Mall Mumbai", "DLF Mall Delhi", "Brigade Road Bangalore",
+    "Phoenix Pune", "Alpha One Mall Ahmedabad", "Inorbit Mall Hyderabad",
+    "Express Avenue Chennai", "Lulu Mall Kochi", "World Trade Park Jaipur"
+]
+
+
+def synthetic_inventory(num_skus, scarcity, rng):
+    """Same shape as generate_inventory.py; `scarcity` is the chance a location is out of stock"""
+    inventory = {}
+    for i in range(num_skus):
+        sku = f"SKU{i:07d}"
+        inventory[sku] = {
+            "sku": sku,
+            "warehouse_stock": {w: 0 if rng.random() < scarcity else rng.randint(1, 500) for w in WAREHOUSES},
+            "store_stock": {s: 0 if rng.random() < scarcity else rng.randint(1, 50) for s in STORES}
+        }
+    return inventory
+
+
+def synthetic_carts(inventory, num_carts, cart_size, rng):
+    skus = list(inventory)
+    return [
+        [{"sku": rng.choice(skus), "quantity": rng.choice([1, 1, 1, 2, 3])} for _ in range(cart_size)]
+        for _ in range(num_carts)
+    ]
+
+
+def run(allocator, carts, inventory, destinations, strategy):
+    timings, shipments, distances, unallocated = [], [], [], 0
+    for i, cart in enumerate(carts):
+        start = time.perf_counter()
+        plan = allocator.allocate(cart, inventory, destinations[i % len(destinations)], strategy)
+        timings.append((time.perf_counter() - start) * 1000)
+        shipments.append(plan['shipment_count'])
+        distances.append(plan['total_distance_km'])
+        unallocated += len(plan['unallocated'])
+    timings.sort()
+    return {
+        "p50_ms": statistics.median(timings),
+        "p99_ms": timings[int(len(timings) * 0.99) - 1] if len(timings) >= 100 else timings[-1],
+        "per_sec": len(carts) / (sum(timings) / 1000) if sum(timings) else float('inf'),
+        "avg_shipments": statistics.mean(shipments),
+        "avg_distance_km": statistics.mean(distances),
+        "unallocated_lines": unallocated
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--skus', type=int, default=5000)
+    parser.add_argument('--carts', type=int, default=500)
+    parser.add_argument('--cart-sizes', default="1,3,8,25,60")
+    parser.add_argument('--scarcity', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    inventory = synthetic_inventory(args.skus, args.scarcity, rng)
+    destinations = [city.title() for city in CITY_COORDINATES]
+    allocator = OrderAllocator()
+
+    print(f"Inventory: {args.skus} SKUs, scarcity {args.scarcity}, {args.carts} carts per size\n")
+    header = f"{'lines':>5}  {'strategy':<8} {'p50 ms':>8} {'p99 ms':>8} {'carts/s':>9} {'shipments':>9} {'km':>8} {'unalloc':>7}"
+    print(header)
+    print("-" * len(header))
+
+    for cart_size in [int(n) for n in args.cart_sizes.split(',')]:
+        carts = synthetic_carts(inventory, args.carts, cart_size, rng)
+        strategies = ["exact", "greedy"] if cart_size <= 8 else ["greedy"]
+        for strategy in strategies:
+            r = run(allocator, carts, inventory, destinations, strategy)
+            print(f"{cart_size:>5}  {strategy:<8} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f} {r['per_sec']:>9.0f} "
+                  f"{r['avg_shipments']:>9.2f} {r['avg_distance_km']:>8.0f} {r['unallocated_lines']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Load test whole chat sessions against a running server
+
+Each simulated customer starts a session and plays a scripted
+conversation ("{first}" is the first product recommended so far); latency is reported per step (p50/p95/max) along with
+failures and the server's LLM counters. Run the server with the fake LLM
+backend so results are reproducible and cost no quota:
+
+    LLM_BACKEND=fake LLM_FAKE_PROFILE=realistic LLM_FAKE_SEED=1 python app.py
+
+Profiles: instant, fast, realistic, degraded, outage (see src/llm_backend.py),
+or a JSON file; LLM_FAKE_ERROR_RATE, LLM_FAKE_TIMEOUT_RATE and
+LLM_FAKE_LATENCY_SCALE override parts of a profile.
+
+Usage (from backend/):
+    python benchmarks/bench_chat.py --url http://127.0.0.1:5000
+    python benchmarks/bench_chat.py --sessions 60 --concurrency 12 --stream
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+CUSTOMERS = ["CUST001", "CUST002", "CUST003", "CUST004", "CUST005"]
+
+CONVERSATION = [
+    "hi",
+    "show me 2 blue shirts under 2000",
+    "add {first} to cart",
+    "any offers for me?",
+    "show me watches for office",
+    "checkout",
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def chat(http, url, session_id, message, stream):
+    payload = {"session_id": session_id, "message": message}
+    if not stream:
+        return http.post(f"{url}/api/chat", json=payload, timeout=60).json(), None
+
+    first_token = None
+    started = time.perf_counter()
+    result = {}
+    with http.post(f"{url}/api/chat/stream", json=payload, stream=True, timeout=60) as response:
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line.split(":", 1)[1].strip()
+            elif line.startswith("data:") and event in ("token", "done") and first_token is None:
+                first_token = (time.perf_counter() - started) * 1000
+            if event == "done" and line.startswith("data:"):
+                result = json.loads(line[5:])
+    return result, first_token
+
+
+def run_session(url, index, stream):
+    """[(step, latency_ms, ok, first_token_ms)] for one customer"""
+    http = requests.Session()
+    results = []
+    started = time.perf_counter()
+    try:
+        response = http.post(f"{url}/api/start_session",
+                             json={"customer_id": CUSTOMERS[index % len(CUSTOMERS)], "channel": "web"}, timeout=60).json()
+        session_id = response.get('session_id')
+        results.append(("start_session", (time.perf_counter() - started) * 1000, bool(session_id), None))
+    except (requests.RequestException, ValueError):
+        results.append(("start_session", (time.perf_counter() - started) * 1000, False, None))
+        return results
+
+    first = "it"
+    for message in CONVERSATION:
+        started = time.perf_counter()
+        try:
+            result, first_token = chat(http, url, session_id, message.format(first=first), stream)
+        except (requests.RequestException, ValueError):
+            result, first_token = {}, None
+        results.append((message, (time.perf_counter() - started) * 1000, bool(result.get('success')), first_token))
+        if first == "it" and result.get('recommendations'):
+            first = result['recommendations'][0]['name']
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=os.getenv('BENCH_URL', 'http://127.0.0.1:5000'))
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=6)
+    parser.add_argument('--stream', action='store_true', help="use /api/chat/stream and report time to first token")
+    args = parser.parse_args()
+
+    print(f"{args.sessions} sessions x {len(CONVERSATION) + 1} steps, concurrency {args.concurrency} -> {args.url}\n")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        sessions = list(pool.map(lambda i: run_session(args.url, i, args.stream), range(args.sessions)))
+    wall = time.perf_counter() - started
+
+    steps = ["start_session"] + CONVERSATION
+    header = f"{'step':<36} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'failed':>7}" + (f" {'ttft p50':>9}" if args.stream else "")
+    print(header)
+    print("-" * len(header))
+    total = failed = 0
+    for step in steps:
+        rows = [row for session in sessions for row in session if row[0] == step]
+        if not rows:
+            continue
+        latencies = [row[1] for row in rows]
+        step_failed = sum(1 for row in rows if not row[2])
+        total += len(rows)
+        failed += step_failed
+        line = (f"{step[:36]:<36} {statistics.median(latencies):>8.0f} {percentile(latencies, 0.95):>8.0f} "
+                f"{max(latencies):>8.0f} {step_failed:>7}")
+        if args.stream:
+            first_tokens = [row[3] for row in rows if row[3] is not None]
+            line += f" {statistics.median(first_tokens):>9.0f}" if first_tokens else f" {'-':>9}"
+        print(line)
+
+    print(f"\n{total} requests in {wall:.1f}s ({total / wall:.1f} req/s), {failed} failed")
+
+    try:
+        snapshot = requests.get(f"{args.url}/api/metrics", timeout=10).json()
+    except (requests.RequestException, ValueError):
+        return
+    # One worker's view; with several gunicorn workers this is a sample
+    counters = {name: value for name, value in snapshot.get('counters', {}).items() if name.startswith('llm.')}
+    print(f"Server LLM counters (one worker): {counters}")
+    breaker = snapshot.get('llm_circuit_breaker')
+    if breaker:
+        print(f"Circuit breaker: {breaker.get('state')} (opened {breaker.get('opened')}x, rejected {breaker.get('rejected')})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Benchmark recommendation latency and ranking stability on synthetic catalogs
+
+Catalogs are built from the generate_products.py templates (re-sampled prices,
+colors and occasions), customers from the customers.json profile shapes.
+Gemini is disabled so only the local ranking pipeline is timed.
+
+Rankings are compared with a stored baseline (recall@k), so a speedup that
+changes results shows up as recall < 1.0.
+
+Usage (from backend/):
+    python benchmarks/bench_recommendations.py
+    python benchmarks/bench_recommendations.py --sizes 1000,10000,100000,1000000 --customers 20
+    python benchmarks/bench_recommendations.py --save-baseline   # after an intentional ranking change
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agents.recommendation_agent as recommendation_module
+from agents.recommendation_agent import RecommendationAgent
+from generate_products import generate_products
+from src.recommendation_engine import recommendation_engine
+from src.query_parser import get_query_parser
+from src.bm25_index import get_bm25_index
+from src.similarity_index import get_similarity_index
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'recommendations.json')
+
+# Requests covering the main ranking paths
+QUERIES = [
+    "",
+    "show me something",
+    "blue shirts",
+    "2 watches under 5000",
+    "silk saree for wedding",
+    "men's formal shoes",
+    "cotton kurta set in white",
+]
+
+COLORS = ["Red", "Blue", "Green", "Black", "White", "Pink", "Yellow", "Purple", "Orange", "Brown", "Grey", "Navy"]
+OCCASIONS = ["Casual", "Formal", "Party", "Festive", "Wedding", "Office"]
+BUDGET_RANGES = ["500-2000", "1000-3000", "2000-5000", "3000-8000", "5000-15000"]
+
+
+def synthetic_catalog(size, seed):
+    """`size` products cycling through the generate_products templates"""
+    random.seed(seed)  # generate_products uses the module-level RNG
+    templates = generate_products()
+    rng = random.Random(seed)
+
+    products = []
+    for i in range(size):
+        template = templates[i % len(templates)]
+        price = max(100, int(template['price'] * rng.uniform(0.6, 1.4)) // 100 * 100)
+        mrp = int(price * rng.uniform(1.3, 1.8))
+        product = dict(template)
+        product.update({
+            "sku": f"SKU{i + 1:07d}",
+            "price": price,
+            "mrp": mrp,
+            "discount": int((mrp - price) / mrp * 100),
+            "rating": round(rng.uniform(3.8, 4.9), 1),
+            "attributes": {
+                **template['attributes'],
+                "color": rng.sample(COLORS, rng.randint(2, 4)),
+                "occasion": rng.choice(OCCASIONS)
+            }
+        })
+        products.append(product)
+    return products
+
+
+def synthetic_customers(products, count, seed):
+    rng = random.Random(seed + 1)
+    categories = sorted({p['category'] for p in products})
+    subcategories = sorted({p['subcategory'] for p in products})
+    customers = []
+    for i in range(count):
+        customers.append({
+            "customer_id": f"BENCH{i:05d}",
+            "name": f"Bench Customer{i}",
+            "purchase_history": [
+                {"category": rng.choice(categories), "items": []} for _ in range(rng.randint(0, 3))
+            ],
+            "browsing_history": rng.sample(subcategories + categories, rng.randint(1, 3)),
+            "preferences": {
+                "favorite_colors": rng.sample(COLORS, 3),
+                "budget_range": rng.choice(BUDGET_RANGES)
+            }
+        })
+    return customers
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+
+def recall_at_k(result, baseline, k):
+    expected = baseline[:k]
+    if not expected:
+        return 1.0 if not result[:k] else 0.0
+    return len(set(result[:k]) & set(expected)) / len(expected)
+
+
+def bench_size(agent, size, num_customers, seed, k):
+    products = synthetic_catalog(size, seed)
+    customers = synthetic_customers(products, num_customers, seed)
+    version = f"bench-{size}-{seed}"
+
+    # Index builds (once per catalog version in production)
+    builds = {}
+    for name, build in [
+        ("catalog", lambda: recommendation_engine.catalog(products, version)),
+        ("parser", lambda: get_query_parser(products, version)),
+        ("bm25", lambda: get_bm25_index(products, version)),
+        ("similarity", lambda: get_similarity_index(products, version, path=None)),
+    ]:
+        start = time.perf_counter()
+        build()
+        builds[name] = (time.perf_counter() - start) * 1000
+
+    rank_ms, complementary_ms, rankings = [], [], {}
+    for customer in customers:
+        for query in QUERIES:
+            start = time.perf_counter()
+            recommendations = agent._generate_recommendations(customer, products, query, "", None, version)
+            rank_ms.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            complementary = agent._suggest_complementary_items(recommendations, products, version)
+            complementary_ms.append((time.perf_counter() - start) * 1000)
+
+            rankings[f"{customer['customer_id']}|{query}"] = {
+                "recommendations": [p['sku'] for p in recommendations][:k],
+                "complementary": [p['sku'] for p in complementary][:k]
+            }
+
+    return {
+        "builds_ms": builds,
+        "rank_p50_ms": statistics.median(rank_ms),
+        "rank_p95_ms": percentile(rank_ms, 0.95),
+        "complementary_p50_ms": statistics.median(complementary_ms),
+        "complementary_p95_ms": percentile(complementary_ms, 0.95),
+        "rankings": rankings
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default="1000,10000,100000")
+    parser.add_argument('--customers', type=int, default=20)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="overwrite the baseline with this run's rankings")
+    args = parser.parse_args()
+
+    # Stub out Gemini: only the local pipeline is measured and results stay deterministic
+    recommendation_module.GEMINI_ENABLED = False
+    agent = RecommendationAgent()
+    agent.log = lambda message: None
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print(f"{args.customers} customers x {len(QUERIES)} queries per catalog, recall@{args.k} vs {args.baseline}\n")
+    header = (f"{'SKUs':>8}  {'build ms (catalog/parser/bm25/sim)':<36} {'rank p50':>9} {'p95':>8} "
+              f"{'compl p50':>9} {'p95':>8} {'recall':>7} {'compl rec':>9}")
+    print(header)
+    print("-" * len(header))
+
+    new_baseline = dict(baseline)
+    for size in [int(n) for n in args.sizes.split(',')]:
+        r = bench_size(agent, size, args.customers, args.seed, args.k)
+        builds = "/".join(f"{r['builds_ms'][name]:.0f}" for name in ("catalog", "parser", "bm25", "similarity"))
+
+        stored = baseline.get(str(size), {})
+        if stored:
+            keys = [key for key in r['rankings'] if key in stored]
+            recall = statistics.mean(
+                recall_at_k(r['rankings'][key]['recommendations'], stored[key]['recommendations'], args.k) for key in keys
+            ) if keys else float('nan')
+            compl_recall = statistics.mean(
+                recall_at_k(r['rankings'][key]['complementary'], stored[key]['complementary'], args.k) for key in keys
+            ) if keys else float('nan')
+            recall_text, compl_text = f"{recall:>7.3f}", f"{compl_recall:>9.3f}"
+        else:
+            recall_text, compl_text = f"{'-':>7}", f"{'-':>9}"
+
+        print(f"{size:>8}  {builds:<36} {r['rank_p50_ms']:>9.2f} {r['rank_p95_ms']:>8.2f} "
+              f"{r['complementary_p50_ms']:>9.2f} {r['complementary_p95_ms']:>8.2f} {recall_text} {compl_text}")
+        new_baseline[str(size)] = r['rankings']
+
+    if args.save_baseline or not baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(new_baseline, f, separators=(',', ':'), sort_keys=True)
+        print(f"\n💾 Baseline saved to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
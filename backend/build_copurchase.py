@@ -0,0 +1,112 @@
+"""
+Build the "frequently bought together" table offline
+
+Reads every customer's purchase_history and, optionally, order logs (JSON lines,
+one order per line, as written by the API when ORDER_LOG_PATH is set). Orders
+are streamed, so memory stays bounded however large the logs are.
+
+Usage (from backend/):
+    python build_copurchase.py
+    python build_copurchase.py --orders data/orders.jsonl --epsilon 1e-6
+    zcat orders-*.jsonl.gz | python build_copurchase.py --orders -
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+
+from src.copurchase import (
+    CoPurchaseCounter, CoPurchaseIndex, item_key, build_meta,
+    COPURCHASE_PATH, DEFAULT_EPSILON, DEFAULT_TOP_K
+)
+from src.query_parser import QueryParser
+
+
+def load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def history_baskets(customers, resolve):
+    """Each purchase_history entry is one basket of item names"""
+    for customer in customers:
+        for purchase in customer.get('purchase_history', []):
+            yield [resolve(name) for name in purchase.get('items', [])]
+
+
+def order_baskets(stream, resolve, names_by_sku):
+    """One basket per JSON line; items may be SKUs, product dicts or item names"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            order = json.loads(line)
+        except ValueError:
+            continue
+        keys = []
+        for item in order.get('items', []):
+            if isinstance(item, dict):
+                name = names_by_sku.get(item.get('sku')) or item.get('name', '')
+            else:
+                name = names_by_sku.get(item) or item
+            keys.append(resolve(name))
+        yield keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', default=os.path.join('data', 'products.json'))
+    parser.add_argument('--customers', default=os.path.join('data', 'customers.json'))
+    parser.add_argument('--orders', action='append', default=[],
+                        help="order log in JSON lines ('-' for stdin); may be repeated")
+    parser.add_argument('--output', default=COPURCHASE_PATH)
+    parser.add_argument('--epsilon', type=float, default=DEFAULT_EPSILON)
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K)
+    parser.add_argument('--min-count', type=int, default=1)
+    args = parser.parse_args()
+
+    products = load_json(args.products)
+    query_parser = QueryParser.from_catalog(products)
+    names_by_sku = {p['sku']: p['name'] for p in products}
+    # The same few thousand names repeat across millions of orders
+    resolve = functools.lru_cache(maxsize=100000)(functools.partial(item_key, query_parser))
+
+    order_logs = list(args.orders)
+    default_log = os.getenv('ORDER_LOG_PATH')
+    if not order_logs and default_log and os.path.exists(default_log):
+        order_logs.append(default_log)
+
+    start = time.perf_counter()
+    counter = CoPurchaseCounter(epsilon=args.epsilon)
+
+    if args.customers and os.path.exists(args.customers):
+        for basket in history_baskets(load_json(args.customers), resolve):
+            counter.add_basket(basket)
+
+    for path in order_logs:
+        if path == '-':
+            for basket in order_baskets(sys.stdin, resolve, names_by_sku):
+                counter.add_basket(basket)
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                for basket in order_baskets(f, resolve, names_by_sku):
+                    counter.add_basket(basket)
+
+    sources = ([args.customers] if args.customers else []) + order_logs
+    index = CoPurchaseIndex(counter.related(args.top_k, args.min_count), build_meta(counter, sources))
+    index.save(args.output)
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {counter.baskets} baskets -> {len(index.related_items)} product types, "
+          f"{len(counter.pairs)} pairs in {elapsed:.2f}s -> {args.output}")
+    print(f"   Peak pairs in memory: {counter.stats['peak_pairs']}, pruned: {counter.stats['pruned_pairs']}, "
+          f"skipped baskets: {counter.stats['skipped_baskets']}")
+    for key, related in list(index.related_items.items())[:5]:
+        print(f"   {key}: " + ", ".join(f"{other} ({count})" for other, count, _ in related[:3]))
+
+
+if __name__ == "__main__":
+    main()
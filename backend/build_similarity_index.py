@@ -0,0 +1,43 @@
+"""
+Build the product similarity index offline
+
+Usage (from backend/):
+    python build_similarity_index.py
+    python build_similarity_index.py --dimensions 512 --output data/similarity_index.npz
+"""
+import argparse
+import json
+import os
+import time
+
+from src.similarity_index import SimilarityIndex, SIMILARITY_INDEX_PATH, DEFAULT_DIMENSIONS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', default=os.path.join('data', 'products.json'))
+    parser.add_argument('--output', default=SIMILARITY_INDEX_PATH)
+    parser.add_argument('--dimensions', type=int, default=DEFAULT_DIMENSIONS)
+    args = parser.parse_args()
+
+    with open(args.products, 'r', encoding='utf-8') as f:
+        products = json.load(f)
+    if not products:
+        print("No products found!")
+        return
+
+    start = time.perf_counter()
+    index = SimilarityIndex.build(products, args.dimensions)
+    build_seconds = time.perf_counter() - start
+    index.save(args.output)
+
+    print(f"✅ Indexed {index.size} products ({args.dimensions} dims) in {build_seconds:.2f}s -> {args.output}")
+    sample = products[0]
+    print(f"\nMost similar to {sample['name']}:")
+    by_sku = {p['sku']: p for p in products}
+    for sku, score in index.similar(sample['sku'], k=5):
+        print(f"  {score:.3f}  {by_sku[sku]['name']}")
+
+
+if __name__ == "__main__":
+    main()
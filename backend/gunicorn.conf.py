@@ -1,5 +1,7 @@
 workers = 6
-worker_class = 'sync'
+# Threaded workers: an open inventory stream holds a thread, not a whole worker process
+worker_class = 'gthread'
+threads = 8
 timeout = 180
 graceful_timeout = 30
 keepalive = 5
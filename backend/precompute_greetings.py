@@ -0,0 +1,71 @@
+"""
+Pre-generate every customer's personalized greeting for each channel
+
+Greetings are written to the greeting cache (data/greetings.db, shared by the
+server workers), so /api/start_session can answer without a Gemini call.
+Only greetings that are missing, expired, or written for an older loyalty
+tier/points are generated; pass --full to regenerate everything.
+
+Needs Gemini (GEMINI_API_KEY) or LLM_BACKEND=fake.
+
+Usage (from backend/):
+    python precompute_greetings.py
+    python precompute_greetings.py --channels web,mobile --workers 8 --full
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.gemini_helper import gemini_assistant
+from src.greeting_cache import GreetingCache, GREETING_CACHE_PATH, GREETING_CHANNELS, greeting_version
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--customers', default=os.path.join('data', 'customers.json'))
+    parser.add_argument('--store', default=GREETING_CACHE_PATH)
+    parser.add_argument('--channels', default=",".join(GREETING_CHANNELS))
+    parser.add_argument('--workers', type=int, default=4, help="concurrent Gemini calls")
+    parser.add_argument('--full', action='store_true', help="regenerate every greeting")
+    args = parser.parse_args()
+
+    if not gemini_assistant.is_available():
+        print("Gemini is not configured (set GEMINI_API_KEY, or LLM_BACKEND=fake); nothing to generate")
+        return
+
+    with open(args.customers, 'r', encoding='utf-8') as f:
+        customers = json.load(f)
+    channels = [channel.strip() for channel in args.channels.split(',') if channel.strip()]
+    cache = GreetingCache(args.store)
+
+    pending = [
+        (customer, channel)
+        for customer in customers for channel in channels
+        if args.full or cache.get(customer['customer_id'], channel, greeting_version(customer)) is None
+    ]
+    total = len(customers) * len(channels)
+    print(f"{len(customers)} customers x {len(channels)} channels: {len(pending)} to generate, "
+          f"{total - len(pending)} current")
+    if not pending:
+        return
+
+    def generate(item):
+        customer, channel = item
+        try:
+            cache.generate(customer, channel, gemini_assistant.write_greeting)
+            return True
+        except Exception as e:
+            print(f"⚠️  {customer['customer_id']}/{channel}: {e}")
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        generated = sum(pool.map(generate, pending))
+    elapsed = time.perf_counter() - start
+    print(f"✅ Generated {generated} greetings in {elapsed:.2f}s ({len(pending) - generated} failed) -> {args.store}")
+
+
+if __name__ == "__main__":
+    main()
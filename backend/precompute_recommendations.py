@@ -0,0 +1,103 @@
+"""
+Precompute every customer's top-N recommendations and complementary items
+
+Only customers whose profile (or the catalog) changed since the last run are
+recomputed; pass --full to rebuild everything.
+
+Usage (from backend/):
+    python precompute_recommendations.py
+    python precompute_recommendations.py --workers 8 --top-n 10 --full
+"""
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+
+from agents.recommendation_agent import RecommendationAgent
+from src.precomputed_store import PrecomputedStore, PRECOMPUTED_STORE_PATH
+from src.versioning import content_version
+
+# Per-process state set up once by the pool initializer
+_worker = {}
+
+
+def load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _init_worker(products, catalog_version, top_n):
+    agent = RecommendationAgent()
+    agent.log = lambda message: None  # thousands of customers would flood stdout
+    _worker.update(agent=agent, products=products, catalog_version=catalog_version, top_n=top_n)
+
+
+def _compute(customer):
+    """Same ranking as a request with no query (no Gemini involved)"""
+    agent, products = _worker['agent'], _worker['products']
+    catalog_version = _worker['catalog_version']
+
+    recommendations = agent._generate_recommendations(
+        customer, products, "", "", None, catalog_version, limit=_worker['top_n']
+    )
+    complementary = agent._suggest_complementary_items(recommendations, products, catalog_version)
+    return {
+        "customer_id": customer['customer_id'],
+        "profile_version": content_version(customer),
+        "catalog_version": catalog_version,
+        "payload": {
+            "recommendations": [p['sku'] for p in recommendations],
+            "complementary_items": [p['sku'] for p in complementary]
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', default=os.path.join('data', 'products.json'))
+    parser.add_argument('--customers', default=os.path.join('data', 'customers.json'))
+    parser.add_argument('--store', default=PRECOMPUTED_STORE_PATH)
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--batch-size', type=int, default=500, help="rows per store write")
+    parser.add_argument('--full', action='store_true', help="recompute every customer")
+    args = parser.parse_args()
+
+    products = load_json(args.products)
+    customers = load_json(args.customers)
+    catalog_version = content_version(products)
+    store = PrecomputedStore(args.store)
+
+    stored = {} if args.full else store.stored_versions()
+    pending = [
+        c for c in customers
+        if stored.get(c['customer_id']) != (content_version(c), catalog_version)
+    ]
+    removed = store.delete_except([c['customer_id'] for c in customers])
+    print(f"{len(customers)} customers: {len(pending)} to compute, "
+          f"{len(customers) - len(pending)} unchanged, {removed} removed")
+    if not pending:
+        return
+
+    start = time.perf_counter()
+    written, batch = 0, []
+    workers = max(1, min(args.workers, len(pending)))
+    chunksize = max(1, len(pending) // (workers * 8))
+    with Pool(workers, initializer=_init_worker, initargs=(products, catalog_version, args.top_n)) as pool:
+        for row in pool.imap_unordered(_compute, pending, chunksize=chunksize):
+            batch.append(row)
+            if len(batch) >= args.batch_size:
+                store.put_many(batch)
+                written += len(batch)
+                batch = []
+    if batch:
+        store.put_many(batch)
+        written += len(batch)
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Stored {written} customers in {elapsed:.2f}s with {workers} workers -> {args.store}")
+
+
+if __name__ == "__main__":
+    main()
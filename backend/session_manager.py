@@ -1,13 +1,28 @@
-from sqlalchemy import create_engine, Column, String, Text, DateTime
+from sqlalchemy import create_engine, event, select, func, Column, Integer, String, Text, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.pool import NullPool
 from datetime import datetime
 import json
 import os
+import threading
 import time
 
+from src.metrics import metrics
+from src.conversation_context import CONVERSATION_HISTORY_LIMIT, number_turns
+
 Base = declarative_base()
 
+# INSERT ... ON CONFLICT DO UPDATE by dialect; other databases keep the read-then-write path
+UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+# Connections kept per worker process (6 gunicorn workers x (size + overflow) must fit max_connections)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 5))
+# Seconds to wait for a free connection, and the age after which one is replaced
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+
 class Session(Base):
     __tablename__ = 'sessions'
     session_id = Column(String, primary_key=True)
@@ -16,83 +31,204 @@ class Session(Base):
     state = Column(Text)
     updated_at = Column(DateTime, default=datetime.utcnow)
 
+class ConversationTurn(Base):
+    # Append-only: one row per message, never rewritten
+    __tablename__ = 'conversation_turns'
+    session_id = Column(String, primary_key=True)
+    seq = Column(Integer, primary_key=True)
+    role = Column(String)
+    message = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class SessionManager:
-    def __init__(self):
+    def __init__(self, db_url=None, pooled=True, upsert=True):
         # Check for DATABASE_URL env var (Render provides this for Postgres)
-        db_url = os.getenv('DATABASE_URL')
-        
-        if db_url:
+        db_url = db_url or os.getenv('DATABASE_URL')
+
+        if db_url and not db_url.startswith("sqlite"):
             # Fix for Render's postgres:// which SQLAlchemy deprecated in favor of postgresql://
             if db_url.startswith("postgres://"):
                 db_url = db_url.replace("postgres://", "postgresql://", 1)
-            
-            # Configure engine with connection pooling and SSL settings for Render PostgreSQL
+
+            # A bounded pool per worker: a chat turn (load + save) reuses open
+            # connections instead of paying a new TLS handshake for each.
+            # pre_ping replaces connections the server dropped while idle,
+            # recycle retires them before Render's idle timeout, and TCP
+            # keepalives notice dead peers between requests.
+            pool_args = {
+                "pool_size": DB_POOL_SIZE,
+                "max_overflow": DB_MAX_OVERFLOW,
+                "pool_timeout": DB_POOL_TIMEOUT,
+                "pool_recycle": DB_POOL_RECYCLE
+            } if pooled else {"poolclass": NullPool}
             self.engine = create_engine(
                 db_url,
-                poolclass=NullPool,  # Use NullPool to avoid stale connections
                 connect_args={
                     "connect_timeout": 10,
-                    "options": "-c statement_timeout=30000"
+                    "options": "-c statement_timeout=30000",
+                    "keepalives": 1,
+                    "keepalives_idle": 30
                 },
                 pool_pre_ping=True,  # Verify connections before using them
-                echo=False
+                echo=False,
+                **pool_args
             )
         else:
             # Fallback to local SQLite
-            db_path = os.path.join(os.path.dirname(__file__), "sessions.db")
-            self.engine = create_engine(f"sqlite:///{db_path}")
-        
+            if not db_url:
+                db_path = os.path.join(os.path.dirname(__file__), "sessions.db")
+                db_url = f"sqlite:///{db_path}"
+            self.engine = create_engine(db_url, **({} if pooled else {"poolclass": NullPool}))
+
         Base.metadata.create_all(self.engine)
         self.Session = sessionmaker(bind=self.engine)
+        self._insert = UPSERT_DIALECTS.get(self.engine.dialect.name) if upsert else None
+
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+        event.listen(self.engine, "connect", self._on_connect)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connections_opened += 1
 
-    def save_session(self, session_id, customer_id, channel, state):
-        """Save session with retry logic for connection issues"""
+    def save_session(self, session_id, customer_id, channel, state, turns=None):
+        """
+        Save session with retry logic for connection issues. `turns` are the
+        messages added since the last save ({"seq", "role", "message"}); they
+        are appended to conversation_turns in the same transaction.
+        """
         max_retries = 3
         retry_delay = 0.5
-        
+
         for attempt in range(max_retries):
-            session = self.Session()
             try:
-                state_json = json.dumps(state)
-                # Check if exists
-                existing = session.query(Session).filter_by(session_id=session_id).first()
-                if existing:
-                    existing.state = state_json
-                    existing.updated_at = datetime.now()
-                else:
-                    new_session = Session(
-                        session_id=session_id,
-                        customer_id=customer_id,
-                        channel=channel,
-                        state=state_json,
-                        updated_at=datetime.now()
-                    )
-                    session.add(new_session)
-                session.commit()
+                with metrics.timer("session.save"):
+                    if self._insert is not None:
+                        self._upsert(session_id, customer_id, channel, state, turns)
+                    else:
+                        with self.engine.connect() as conn:
+                            numbered, saved_state = number_turns(turns or [], self._last_seq(conn, session_id), state)
+                        now = datetime.now()
+                        self._read_then_write(session_id, customer_id, channel, json.dumps(saved_state),
+                                              [{"session_id": session_id, "created_at": now, **turn} for turn in numbered])
                 return  # Success
             except Exception as e:
                 print(f"Error saving session (attempt {attempt + 1}/{max_retries}): {e}")
-                session.rollback()
                 if attempt < max_retries - 1:
                     time.sleep(retry_delay)
                     retry_delay *= 2  # Exponential backoff
                 else:
                     print(f"Failed to save session after {max_retries} attempts")
-            finally:
-                session.close()
+
+    def _upsert(self, session_id, customer_id, channel, state, turns=None):
+        """
+        One INSERT ... ON CONFLICT statement; an existing row keeps its customer and channel.
+        Turns are numbered after the session's last logged message in the same transaction;
+        if a concurrent save takes the same seq first, the insert fails and save_session retries.
+        """
+        now = datetime.now()
+        with self.engine.begin() as conn:
+            turns, state = number_turns(turns or [], self._last_seq(conn, session_id) if turns else None, state)
+            stmt = self._insert(Session).values(
+                session_id=session_id,
+                customer_id=customer_id,
+                channel=channel,
+                state=json.dumps(state),
+                updated_at=now
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Session.session_id],
+                set_={"state": stmt.excluded.state, "updated_at": stmt.excluded.updated_at}
+            )
+            conn.execute(stmt)
+            if turns:
+                conn.execute(self._insert(ConversationTurn),
+                             [{"session_id": session_id, "created_at": now, **turn} for turn in turns])
+
+    def _last_seq(self, conn, session_id):
+        return conn.execute(
+            select(func.max(ConversationTurn.seq)).where(ConversationTurn.session_id == session_id)
+        ).scalar()
+
+    def _append_turns(self, conn, turn_rows):
+        """Insert flushed turns; a (session_id, seq) already stored is left as it is (flushes may overlap)"""
+        if turn_rows:
+            conn.execute(self._insert(ConversationTurn).on_conflict_do_nothing(), turn_rows)
+
+    def save_many(self, rows, turn_rows=None):
+        """
+        Write a batch of (session_id, customer_id, channel, state_json, updated_at)
+        and conversation turn rows in one transaction. A row only replaces a
+        stored one with an older updated_at, so batches flushed out of order
+        never move a session back.
+        """
+        if not rows and not turn_rows:
+            return
+        with metrics.timer("session.save_many"):
+            if self._insert is None:
+                for session_id, customer_id, channel, state_json, _ in rows:
+                    self._read_then_write(session_id, customer_id, channel, state_json)
+                if turn_rows:
+                    self._read_then_write(None, None, None, None, turn_rows)
+                return
+            stmt = self._insert(Session)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Session.session_id],
+                set_={"state": stmt.excluded.state, "updated_at": stmt.excluded.updated_at},
+                where=(Session.updated_at.is_(None)) | (Session.updated_at < stmt.excluded.updated_at)
+            )
+            with self.engine.begin() as conn:
+                if rows:
+                    conn.execute(stmt, [
+                        {"session_id": session_id, "customer_id": customer_id, "channel": channel,
+                         "state": state_json, "updated_at": updated_at}
+                        for session_id, customer_id, channel, state_json, updated_at in rows
+                    ])
+                self._append_turns(conn, turn_rows)
+
+    def _read_then_write(self, session_id, customer_id, channel, state_json, turn_rows=None):
+        session = self.Session()
+        try:
+            for row in turn_rows or []:
+                session.merge(ConversationTurn(**row))
+            if session_id is None:
+                session.commit()
+                return
+            # Check if exists
+            existing = session.query(Session).filter_by(session_id=session_id).first()
+            if existing:
+                existing.state = state_json
+                existing.updated_at = datetime.now()
+            else:
+                new_session = Session(
+                    session_id=session_id,
+                    customer_id=customer_id,
+                    channel=channel,
+                    state=state_json,
+                    updated_at=datetime.now()
+                )
+                session.add(new_session)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
 
     def load_session(self, session_id):
         """Load session with retry logic for connection issues"""
         max_retries = 3
         retry_delay = 0.5
-        
+
         for attempt in range(max_retries):
-            session = self.Session()
             try:
-                result = session.query(Session).filter_by(session_id=session_id).first()
-                if result:
-                    return json.loads(result.state)
-                return None
+                with metrics.timer("session.load"):
+                    with self.engine.connect() as conn:
+                        state_json = conn.execute(
+                            select(Session.state).where(Session.session_id == session_id)
+                        ).scalar()
+                return json.loads(state_json) if state_json else None
             except Exception as e:
                 print(f"Error loading session (attempt {attempt + 1}/{max_retries}): {e}")
                 if attempt < max_retries - 1:
@@ -101,5 +237,33 @@ class SessionManager:
                 else:
                     print(f"Failed to load session after {max_retries} attempts")
                     return None
-            finally:
-                session.close()
+
+    def load_turns(self, session_id, limit=CONVERSATION_HISTORY_LIMIT, before=None):
+        """The last `limit` messages of a session (with seq below `before`), oldest first"""
+        query = select(ConversationTurn.seq, ConversationTurn.role, ConversationTurn.message).where(
+            ConversationTurn.session_id == session_id
+        )
+        if before is not None:
+            query = query.where(ConversationTurn.seq < before)
+        try:
+            with metrics.timer("session.load_turns"):
+                with self.engine.connect() as conn:
+                    rows = conn.execute(query.order_by(ConversationTurn.seq.desc()).limit(limit)).all()
+        except Exception as e:
+            print(f"Error loading conversation turns: {e}")
+            return []
+        return [{"seq": seq, "role": role, "message": message} for seq, role, message in reversed(rows)]
+
+    def snapshot(self):
+        """Pool occupancy and how many database connections this worker has opened"""
+        pool = self.engine.pool
+        stats = {
+            "dialect": self.engine.dialect.name,
+            "upsert": self._insert is not None,
+            "pool": type(pool).__name__,
+            "connections_opened": self.connections_opened
+        }
+        for name in ("size", "checkedout", "checkedin", "overflow"):
+            if hasattr(pool, name):
+                stats[name] = getattr(pool, name)()
+        return stats
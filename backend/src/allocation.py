@@ -0,0 +1,202 @@
+"""
+Order Allocation - Decides which warehouse/store ships which cart line
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from itertools import combinations
+import math
+
+# Approximate city coordinates (lat, lon) for every stocking location we know about
+CITY_COORDINATES = {
+    "mumbai": (19.076, 72.878),
+    "delhi": (28.614, 77.209),
+    "bangalore": (12.972, 77.595),
+    "pune": (18.520, 73.857),
+    "ahmedabad": (23.023, 72.571),
+    "hyderabad": (17.385, 78.487),
+    "chennai": (13.083, 80.271),
+    "kochi": (9.931, 76.267),
+    "jaipur": (26.912, 75.787),
+}
+
+# One extra shipment is "worth" this many kilometres of extra distance
+SHIPMENT_PENALTY_KM = 500
+
+# Above these sizes the exhaustive search is replaced by the greedy heuristic
+EXACT_MAX_LINES = 8
+EXACT_MAX_LOCATIONS = 16
+EXACT_MAX_SHIPMENTS = 3
+
+
+def city_of(location: Optional[str]) -> Optional[str]:
+    """Resolve a location/address string to a known city key"""
+    if not location:
+        return None
+    location_lower = location.lower()
+    for city in CITY_COORDINATES:
+        if city in location_lower:
+            return city
+    return None
+
+
+def distance_km(origin: Optional[str], destination: Optional[str]) -> float:
+    """Great-circle distance between two locations (0 if either is unknown)"""
+    a = CITY_COORDINATES.get(city_of(origin))
+    b = CITY_COORDINATES.get(city_of(destination))
+    if not a or not b:
+        return 0.0
+
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return round(2 * 6371 * math.asin(math.sqrt(h)), 1)
+
+
+class OrderAllocator:
+    """
+    Assigns cart lines to stocking locations.
+
+    The objective is to minimize the number of shipments first and travel
+    distance second (combined as SHIPMENT_PENALTY_KM per shipment + km).
+    Small carts are solved exactly by searching location subsets; large carts
+    (or peak-hour calls) use a greedy set-cover heuristic.
+    """
+
+    def __init__(self, include_stores: bool = True, shipment_penalty_km: float = SHIPMENT_PENALTY_KM):
+        self.include_stores = include_stores
+        self.shipment_penalty_km = shipment_penalty_km
+
+    def allocate(self, lines: List[Dict[str, Any]], inventory: Dict[str, Dict[str, Any]],
+                 destination: Optional[str] = None, strategy: str = "auto") -> Dict[str, Any]:
+        """
+        Args:
+            lines: [{"sku": str, "quantity": int}, ...] (duplicate SKUs are merged)
+            inventory: {sku: {"warehouse_stock": {...}, "store_stock": {...}}}
+            destination: customer city/address used for distances
+            strategy: "auto", "exact" or "greedy"
+        """
+        demand = self._merge_lines(lines)
+        stock, location_types = self._stock_by_location(demand, inventory)
+        distances = {loc: distance_km(loc, destination) for loc in stock}
+
+        if strategy == "auto":
+            strategy = "exact" if (len(demand) <= EXACT_MAX_LINES and len(stock) <= EXACT_MAX_LOCATIONS) else "greedy"
+
+        chosen = None
+        if strategy == "exact":
+            chosen = self._exact_locations(demand, stock, distances)
+        if chosen is None:
+            # Either greedy was requested or nothing fits within EXACT_MAX_SHIPMENTS
+            strategy = "greedy"
+            chosen = self._greedy_locations(demand, stock, distances)
+
+        return self._build_plan(demand, stock, location_types, distances, chosen, strategy)
+
+    def _merge_lines(self, lines) -> Dict[str, int]:
+        demand = {}
+        for line in lines:
+            sku = line.get('sku')
+            if not sku:
+                continue
+            demand[sku] = demand.get(sku, 0) + max(1, int(line.get('quantity', 1)))
+        return demand
+
+    def _stock_by_location(self, demand, inventory) -> Tuple[Dict[str, Dict[str, int]], Dict[str, str]]:
+        """location -> {sku: units} restricted to demanded SKUs with stock"""
+        stock, location_types = {}, {}
+        for sku in demand:
+            record = inventory.get(sku) or {}
+            sources = [("warehouse", record.get('warehouse_stock', {}))]
+            if self.include_stores:
+                sources.append(("store", record.get('store_stock', {})))
+            for location_type, by_location in sources:
+                for location, units in by_location.items():
+                    if units > 0:
+                        stock.setdefault(location, {})[sku] = units
+                        location_types[location] = location_type
+        return stock, location_types
+
+    def _cost(self, locations, distances) -> float:
+        return len(locations) * self.shipment_penalty_km + sum(distances[loc] for loc in locations)
+
+    def _exact_locations(self, demand, stock, distances) -> Optional[List[str]]:
+        """Cheapest feasible set of up to EXACT_MAX_SHIPMENTS locations"""
+        locations = sorted(stock, key=lambda loc: distances[loc])
+        best, best_cost = None, float('inf')
+
+        for size in range(1, min(EXACT_MAX_SHIPMENTS, len(locations)) + 1):
+            # A larger set can never beat a feasible smaller one by more than the penalty allows
+            if best is not None and size * self.shipment_penalty_km >= best_cost:
+                break
+            for subset in combinations(locations, size):
+                cost = self._cost(subset, distances)
+                if cost >= best_cost:
+                    continue
+                if all(sum(stock[loc].get(sku, 0) for loc in subset) >= qty for sku, qty in demand.items()):
+                    best, best_cost = list(subset), cost
+        return best
+
+    def _greedy_locations(self, demand, stock, distances) -> List[str]:
+        """Greedy set cover: repeatedly take the location covering the most units per unit cost"""
+        remaining = dict(demand)
+        chosen = []
+        candidates = set(stock)
+
+        while remaining and candidates:
+            best, best_ratio = None, 0.0
+            for loc in candidates:
+                covered = sum(min(units, stock[loc].get(sku, 0)) for sku, units in remaining.items())
+                if covered == 0:
+                    continue
+                ratio = covered / (self.shipment_penalty_km + distances[loc])
+                if ratio > best_ratio:
+                    best, best_ratio = loc, ratio
+            if best is None:
+                break  # remaining units are not stocked anywhere
+
+            chosen.append(best)
+            candidates.discard(best)
+            for sku in list(remaining):
+                remaining[sku] -= min(remaining[sku], stock[best].get(sku, 0))
+                if remaining[sku] == 0:
+                    del remaining[sku]
+        return chosen
+
+    def _build_plan(self, demand, stock, location_types, distances, chosen, strategy) -> Dict[str, Any]:
+        """Fill each line from the chosen locations, nearest first"""
+        shipments = {}
+        unallocated = []
+        ordered = sorted(chosen, key=lambda loc: distances[loc])
+
+        for sku, qty in demand.items():
+            remaining = qty
+            # Prefer a single location that can ship the whole line
+            whole = next((loc for loc in ordered if stock[loc].get(sku, 0) >= qty), None)
+            sources = [whole] if whole else ordered
+            for loc in sources:
+                take = min(remaining, stock[loc].get(sku, 0))
+                if take <= 0:
+                    continue
+                shipments.setdefault(loc, []).append({"sku": sku, "quantity": take})
+                remaining -= take
+                if remaining == 0:
+                    break
+            if remaining > 0:
+                unallocated.append({"sku": sku, "quantity": remaining})
+
+        shipment_list = [
+            {
+                "location": loc,
+                "location_type": location_types[loc],
+                "distance_km": distances[loc],
+                "items": items
+            }
+            for loc, items in sorted(shipments.items(), key=lambda entry: distances[entry[0]])
+        ]
+
+        return {
+            "strategy": strategy,
+            "shipments": shipment_list,
+            "shipment_count": len(shipment_list),
+            "total_distance_km": round(sum(s['distance_km'] for s in shipment_list), 1),
+            "unallocated": unallocated,
+            "fully_allocated": not unallocated
+        }
@@ -0,0 +1,168 @@
+"""
+BM25 Index - Ranked keyword retrieval over the product catalog
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+import math
+import re
+import threading
+
+import numpy as np
+
+from src.query_parser import singularize
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+# Name matches matter most, free-text description least
+FIELD_WEIGHTS = {
+    "name": 3.0,
+    "subcategory": 2.0,
+    "category": 1.0,
+    "attributes": 1.0,
+    "description": 0.5,
+}
+
+
+def tokenize(text: str, split_compounds: bool = True) -> List[str]:
+    """Lowercase word tokens, singularized; "t-shirt" also yields "t" and "shirt" when indexing"""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(singularize(token))
+        if split_compounds and '-' in token:
+            tokens.extend(singularize(part) for part in token.split('-') if part)
+    return tokens
+
+
+def product_fields(product: Dict[str, Any]) -> Dict[str, str]:
+    attributes = product.get('attributes', {})
+    return {
+        "name": product.get('name', ''),
+        "subcategory": product.get('subcategory', ''),
+        "category": product.get('category', ''),
+        "attributes": " ".join([
+            " ".join(attributes.get('color', [])),
+            attributes.get('material', '').replace('/', ' '),
+            attributes.get('occasion', ''),
+        ]),
+        "description": product.get('description', ''),
+    }
+
+
+class BM25Index:
+    """
+    Field-weighted BM25 over name, subcategory, category, attributes and description.
+
+    Postings are stored twice per term: sorted by document (for score lookups)
+    and sorted by impact (for early termination). A query only touches the top
+    `depth` postings of each term, so latency depends on `depth`, not catalog size.
+    """
+
+    def __init__(self, products: List[Dict[str, Any]], k1: float = 1.2, b: float = 0.75):
+        self.size = len(products)
+        self.k1 = k1
+        self.b = b
+
+        postings = {}  # term -> ([doc ids], [weighted tf])
+        doc_lengths = np.zeros(self.size, dtype=np.float32)
+
+        for doc_id, product in enumerate(products):
+            term_freqs = {}
+            for field, text in product_fields(product).items():
+                weight = FIELD_WEIGHTS[field]
+                for token in tokenize(text):
+                    term_freqs[token] = term_freqs.get(token, 0.0) + weight
+            doc_lengths[doc_id] = sum(term_freqs.values())
+            for term, tf in term_freqs.items():
+                entry = postings.get(term)
+                if entry is None:
+                    entry = postings[term] = ([], [])
+                entry[0].append(doc_id)
+                entry[1].append(tf)
+
+        avg_length = float(doc_lengths.mean()) if self.size else 1.0
+        norms = k1 * (1 - b + b * doc_lengths / max(avg_length, 1e-9))
+
+        self.by_doc = {}
+        self.by_impact = {}
+        for term, (docs, tfs) in postings.items():
+            docs = np.array(docs, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+            df = len(docs)
+            idf = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            impacts = (idf * tfs * (k1 + 1) / (tfs + norms[docs])).astype(np.float32)
+            self.by_doc[term] = (docs, impacts)
+            order = np.argsort(-impacts, kind='stable')
+            self.by_impact[term] = (docs[order], impacts[order])
+
+    def _normalize(self, terms: List[str]) -> List[str]:
+        normalized = []
+        for term in terms or []:
+            for token in tokenize(term, split_compounds=False):
+                if token in self.by_doc and token not in normalized:
+                    normalized.append(token)
+        return normalized
+
+    def _lookup(self, term: str, candidates: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(hit mask, impacts) of a term for the given doc ids"""
+        docs, impacts = self.by_doc[term]
+        positions = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+        hits = docs[positions] == candidates
+        return hits, np.where(hits, impacts[positions], 0.0)
+
+    def search(self, required_terms: List[str], boost_terms: Optional[List[str]] = None,
+               top_n: int = 100, depth: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-N documents matching at least one required term (e.g. the product type),
+        ranked by BM25 over required + boost terms (e.g. colors, materials).
+
+        Returns (doc ids in catalog order, scores), both numpy arrays.
+        """
+        required = self._normalize(required_terms)
+        boosts = [t for t in self._normalize(boost_terms) if t not in required]
+        empty = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+        if not required or top_n <= 0:
+            return empty
+
+        depth = depth or max(top_n * 10, 1000)
+
+        # Candidates: best postings of each required term, plus the best postings of
+        # each boost term that also contain a required term
+        pools = [self.by_impact[term][0][:depth] for term in required]
+        for term in boosts:
+            boosted = self.by_impact[term][0][:depth]
+            matches_required = np.zeros(len(boosted), dtype=bool)
+            for req in required:
+                matches_required |= self._lookup(req, boosted)[0]
+            pools.append(boosted[matches_required])
+        candidates = np.unique(np.concatenate(pools))
+
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for term in required + boosts:
+            scores += self._lookup(term, candidates)[1]
+
+        if len(candidates) > top_n:
+            # Best scores first, earlier catalog position on ties; returned in catalog order
+            keep = np.sort(np.lexsort((candidates, -scores))[:top_n])
+            candidates, scores = candidates[keep], scores[keep]
+        return candidates, scores
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_bm25_index(products: List[Dict[str, Any]], catalog_version: Optional[str] = None) -> BM25Index:
+    """Index for a catalog, built once per catalog version"""
+    key = catalog_version or (len(products), products[0].get('sku') if products else None,
+                              products[-1].get('sku') if products else None)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            return index
+
+    index = BM25Index(products)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > 2:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,141 @@
+"""
+Circuit Breaker - Stops calling a failing or slow dependency until a probe succeeds
+"""
+from typing import Dict, Any, Optional
+from collections import deque
+import os
+import threading
+import time
+
+from src.metrics import metrics
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the dependency while the breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Rolling-window breaker, kept per worker process.
+
+    The last `window` calls are remembered. Once there are at least
+    `min_calls`, the breaker opens when the failure rate reaches
+    `failure_rate` or the share of calls slower than `slow_call_ms` reaches
+    `slow_rate` (timeouts count as failures). While open, callers get
+    CircuitOpenError and use their fallback. After `reset_seconds` one
+    probe call is let through (half-open): success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5,
+                 slow_call_ms: float = 5000, slow_rate: float = 0.5, reset_seconds: float = 30):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_ms = slow_call_ms
+        self.slow_rate = slow_rate
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._calls = deque(maxlen=window)  # (ok, latency_ms)
+        self.state = CLOSED
+        self.opened_at = None
+        self.last_reason = None
+        self._probe_in_flight = False
+        self.stats = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected (no probe is due yet); does not claim the probe"""
+        with self._lock:
+            if self.state == OPEN:
+                return time.time() - self.opened_at < self.reset_seconds
+            return self.state == HALF_OPEN and self._probe_in_flight
+
+    def allow(self) -> bool:
+        """Claim permission for one call; False means use the fallback"""
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.reset_seconds:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+                print(f"🔌 {self.name} breaker half-open, probing")
+
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.stats['rejected'] += 1
+        metrics.increment(f"{self.name}.short_circuited")
+        return False
+
+    def release(self):
+        """Give back a claimed call that ended without an outcome (abandoned by its caller, or never sent)"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record_success(self, latency_ms: float):
+        self._record(True, latency_ms)
+
+    def record_failure(self, latency_ms: float, reason: Optional[str] = None):
+        self._record(False, latency_ms, reason)
+
+    def _record(self, ok: bool, latency_ms: float, reason: Optional[str] = None):
+        with self._lock:
+            self.stats['successes' if ok else 'failures'] += 1
+            if not ok:
+                self.last_reason = reason
+
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok and latency_ms < self.slow_call_ms:
+                    self.state = CLOSED
+                    self._calls.clear()
+                    print(f"✅ {self.name} breaker closed")
+                else:
+                    self._open("probe failed" if not ok else "probe slow")
+                return
+
+            self._calls.append((ok, latency_ms))
+            if self.state != CLOSED or len(self._calls) < self.min_calls:
+                return
+            total = len(self._calls)
+            failures = sum(1 for call_ok, _ in self._calls if not call_ok)
+            slow = sum(1 for _, latency in self._calls if latency >= self.slow_call_ms)
+            if failures / total >= self.failure_rate:
+                self._open(f"{failures}/{total} calls failed")
+            elif slow / total >= self.slow_rate:
+                self._open(f"{slow}/{total} calls slower than {self.slow_call_ms:g}ms")
+
+    def _open(self, reason: str):
+        self.state = OPEN
+        self.opened_at = time.time()
+        self.last_reason = reason
+        self.stats['opened'] += 1
+        print(f"⚠️  {self.name} breaker open: {reason}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "probe_due": self.state == OPEN and time.time() - self.opened_at >= self.reset_seconds,
+                "opened_at": self.opened_at,
+                "reason": self.last_reason,
+                "window_calls": len(self._calls),
+                "window_failures": sum(1 for ok, _ in self._calls if not ok),
+                **self.stats
+            }
+
+
+# Global instance (per worker process) guarding every Gemini call
+llm_breaker = CircuitBreaker(
+    "llm",
+    window=int(os.getenv('LLM_BREAKER_WINDOW', 20)),
+    min_calls=int(os.getenv('LLM_BREAKER_MIN_CALLS', 5)),
+    failure_rate=float(os.getenv('LLM_BREAKER_FAILURE_RATE', 0.5)),
+    slow_call_ms=float(os.getenv('LLM_BREAKER_SLOW_CALL_MS', 5000)),
+    slow_rate=float(os.getenv('LLM_BREAKER_SLOW_RATE', 0.5)),
+    reset_seconds=float(os.getenv('LLM_BREAKER_RESET_SECONDS', 30))
+)
+metrics.register_collector("llm_circuit_breaker", llm_breaker.snapshot)
@@ -0,0 +1,82 @@
+"""
+Concurrency - Bounded per-worker thread pool for fanning out independent agent and LLM calls
+"""
+from typing import Dict, Any, Callable, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import os
+import threading
+import time
+
+from src.metrics import metrics
+
+# Threads per worker process shared by all requests it serves
+AGENT_POOL_SIZE = int(os.getenv('AGENT_POOL_SIZE', 8))
+
+# Seconds a fanned-out call may take unless the caller gives its own deadline
+DEFAULT_CALL_DEADLINE = float(os.getenv('AGENT_CALL_DEADLINE', 5))
+
+_pool_thread = threading.local()
+
+
+def _mark_pool_thread():
+    _pool_thread.active = True
+
+
+_executor = ThreadPoolExecutor(
+    max_workers=AGENT_POOL_SIZE, thread_name_prefix="agent-call", initializer=_mark_pool_thread
+)
+
+Call = Union[Callable[[], Any], Tuple[Callable[[], Any], float]]
+
+
+def fan_out(calls: Dict[str, Call], default: Any = None,
+            log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """
+    Run independent calls concurrently and wait for all of them.
+
+    `calls` maps a name to a zero-argument callable, or to (callable,
+    deadline in seconds). Deadlines count from the start of the fan-out, so
+    the wait is bounded by the slowest deadline rather than the sum. A call
+    that raises or misses its deadline yields `default`; a late call keeps
+    running in the pool, but its result is dropped.
+
+    A single call, or a fan-out from a pool thread (a fanned-out call
+    fanning out again), runs inline without a deadline, so nested fan-outs
+    cannot starve the pool.
+    """
+    normalized = {
+        name: call if isinstance(call, tuple) else (call, DEFAULT_CALL_DEADLINE)
+        for name, call in calls.items()
+    }
+    results = {}
+
+    if getattr(_pool_thread, 'active', False) or len(normalized) == 1:
+        for name, (fn, _) in normalized.items():
+            try:
+                results[name] = fn()
+            except Exception as e:
+                metrics.increment("fanout.errors")
+                log(f"⚠️ {name} failed: {e}")
+                results[name] = default
+        return results
+
+    started = time.perf_counter()
+    futures = {name: (_executor.submit(fn), deadline) for name, (fn, deadline) in normalized.items()}
+    metrics.increment("fanout.calls", len(futures))
+
+    for name, (future, deadline) in sorted(futures.items(), key=lambda item: item[1][1]):
+        remaining = deadline - (time.perf_counter() - started)
+        try:
+            results[name] = future.result(timeout=max(0.0, remaining))
+        except FutureTimeoutError:
+            future.cancel()
+            metrics.increment("fanout.timeouts")
+            log(f"⏱️ {name} missed its {deadline:g}s deadline")
+            results[name] = default
+        except Exception as e:
+            metrics.increment("fanout.errors")
+            log(f"⚠️ {name} failed: {e}")
+            results[name] = default
+
+    metrics.observe("fanout.wait", (time.perf_counter() - started) * 1000)
+    return {name: results[name] for name in calls}
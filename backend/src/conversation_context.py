@@ -0,0 +1,123 @@
+"""
+Conversation Context - Bounded rolling state of a chat: recent requests plus the slots extracted so far
+"""
+from typing import Dict, Any, List, Optional, Tuple
+import os
+
+# User messages kept verbatim (each truncated) for prompts
+CONTEXT_RECENT_MESSAGES = int(os.getenv('CONTEXT_RECENT_MESSAGES', 2))
+CONTEXT_MESSAGE_CHARS = int(os.getenv('CONTEXT_MESSAGE_CHARS', 200))
+
+# Messages (user and agent) read back from the conversation log when history is needed
+CONVERSATION_HISTORY_LIMIT = int(os.getenv('CONVERSATION_HISTORY_LIMIT', 20))
+
+# Slots carried from one request to the next (query parser slots, plus turn understanding modifiers)
+CARRIED_SLOTS = ("product_type", "colors", "materials", "modifiers", "audience", "occasion", "max_budget")
+MODIFIER_SLOTS = ("colors", "materials", "modifiers")
+
+
+def _truncate(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+def render_request(slots: Dict[str, Any]) -> str:
+    """
+    Slots as a short request the query parser reads back to the same slots,
+    e.g. "blue cotton shirt men office under 2000"
+    """
+    words = []
+    for key in MODIFIER_SLOTS:
+        words += [str(word).lower() for word in slots.get(key) or [] if str(word).lower() not in words]
+    if slots.get('product_type'):
+        words.append(slots['product_type'])
+    words += list(slots.get('audience') or [])
+    if slots.get('occasion'):
+        words.append(slots['occasion'])
+    if slots.get('max_budget'):
+        words.append(f"under {slots['max_budget']}")
+    return " ".join(words)
+
+
+def number_turns(turns: List[Dict[str, Any]], last_seq: Optional[int],
+                 state: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    (turns, state) with the turns renumbered to follow `last_seq`, the
+    session's last logged message. Two turns saved from the same loaded
+    state would otherwise share seqs and one would be dropped; the state's
+    turn_count moves past the renumbered turns.
+    """
+    if not turns or last_seq is None or turns[0]['seq'] > last_seq:
+        return turns, state
+    start = last_seq + 1
+    turns = [{**turn, "seq": start + i} for i, turn in enumerate(turns)]
+    if 'turn_count' in state:
+        state = {**state, "turn_count": start + len(turns)}
+    return turns, state
+
+
+def carry_over(latest: Dict[str, Any], carried: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    What to add from earlier requests to the latest one's parsed slots.
+    A new product type starts a new topic and only the audience carries
+    over; otherwise ("in blue", "under 1000", "show me more") missing slots
+    are filled from the earlier request.
+    """
+    if not carried:
+        return {}
+    if latest.get('product_types') or latest.get('product_type'):
+        keep = ["audience"]
+    else:
+        keep = list(CARRIED_SLOTS)
+    # A color, material or other modifier in the latest request replaces all earlier ones
+    if any(latest.get(key) for key in MODIFIER_SLOTS):
+        keep = [key for key in keep if key not in MODIFIER_SLOTS]
+    return {key: carried[key] for key in keep if carried.get(key) and not latest.get(key)}
+
+
+class ConversationContext:
+    """
+    Replaces the raw message history in prompts and keyword matching.
+    Only the last few user messages are kept (each truncated), and what
+    earlier turns established lives in a handful of slots, so the context
+    for a turn stays the same size however long the conversation gets.
+    Stored in the session as a plain dict.
+    """
+
+    def __init__(self, recent: Optional[List[str]] = None, slots: Optional[Dict[str, Any]] = None, turns: int = 0):
+        self.recent = list(recent or [])
+        self.slots = dict(slots or {})
+        self.turns = turns
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> "ConversationContext":
+        data = data or {}
+        return cls(data.get('recent'), data.get('slots'), data.get('turns', 0))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"recent": self.recent, "slots": self.slots, "turns": self.turns}
+
+    def add_user_message(self, text: str):
+        self.recent.append(_truncate(text, CONTEXT_MESSAGE_CHARS))
+        del self.recent[:-CONTEXT_RECENT_MESSAGES]
+        self.turns += 1
+
+    def remember(self, slots: Dict[str, Any]):
+        """
+        Slots of the request just served: the query parser's slots, or a turn
+        understanding result (product_type, modifiers, max_budget, occasion)
+        """
+        if not slots:
+            return
+        remembered = {key: slots[key] for key in CARRIED_SLOTS if slots.get(key)}
+        if remembered:
+            self.slots = remembered
+
+    def earlier_messages(self) -> str:
+        """User messages before the latest one"""
+        return " | ".join(self.recent[:-1])
+
+    def summary(self) -> str:
+        """One line for prompts: what the customer is looking for so far"""
+        request = render_request(self.slots)
+        return f"looking for: {request}" if request else ""
@@ -0,0 +1,199 @@
+"""
+Co-Purchase Index - "Frequently bought together" counts between product types
+"""
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+from collections import OrderedDict
+from datetime import datetime
+from itertools import combinations
+import json
+import math
+import os
+import threading
+
+from src.query_parser import get_query_parser
+
+# Where build_copurchase.py writes the lookup table (relative to backend/, like data/*.json)
+COPURCHASE_PATH = os.getenv('COPURCHASE_PATH', os.path.join('data', 'copurchase.json'))
+
+# Lossy counting error bound: pairs seen in fewer than epsilon * baskets may be dropped
+DEFAULT_EPSILON = 1e-5
+
+# Baskets bigger than this are bulk/wholesale orders and only add noise (and n^2 pairs)
+MAX_BASKET_ITEMS = 50
+
+# Related types kept per product type in the lookup table
+DEFAULT_TOP_K = 10
+
+
+def item_key(parser, text: str) -> Optional[str]:
+    """Product type for an item name ("Formal Shoes" -> "shoe"), shared by purchase history and SKUs"""
+    return parser.parse(text)['product_type'] if text else None
+
+
+class CoPurchaseCounter:
+    """
+    Streaming item-item co-occurrence counts with bounded memory.
+
+    Pair counts use lossy counting: baskets are processed in buckets of
+    ceil(1/epsilon), and at each bucket boundary pairs whose count cannot
+    reach epsilon * baskets are dropped. Memory stays O(1/epsilon * log(epsilon * N))
+    pairs however many orders are streamed; every reported count is low by at
+    most epsilon * N. Item counts are exact (one entry per product type).
+    """
+
+    def __init__(self, epsilon: float = DEFAULT_EPSILON, max_basket_items: int = MAX_BASKET_ITEMS):
+        self.bucket_width = max(1, math.ceil(1 / epsilon))
+        self.max_basket_items = max_basket_items
+        self.item_counts = {}
+        self.pairs = {}  # (a, b) with a < b -> [count, max undercount]
+        self.baskets = 0
+        self.stats = {"baskets": 0, "skipped_baskets": 0, "pruned_pairs": 0, "peak_pairs": 0}
+
+    def add_basket(self, keys: Iterable[Optional[str]]):
+        basket = sorted({key for key in keys if key})
+        if not basket or len(basket) > self.max_basket_items:
+            self.stats['skipped_baskets'] += 1
+            return
+
+        self.baskets += 1
+        self.stats['baskets'] = self.baskets
+        bucket = (self.baskets - 1) // self.bucket_width + 1
+
+        for key in basket:
+            self.item_counts[key] = self.item_counts.get(key, 0) + 1
+        for pair in combinations(basket, 2):
+            entry = self.pairs.get(pair)
+            if entry is None:
+                self.pairs[pair] = [1, bucket - 1]
+            else:
+                entry[0] += 1
+
+        self.stats['peak_pairs'] = max(self.stats['peak_pairs'], len(self.pairs))
+        if self.baskets % self.bucket_width == 0:
+            self._prune(bucket)
+
+    def _prune(self, bucket: int):
+        stale = [pair for pair, (count, delta) in self.pairs.items() if count + delta <= bucket]
+        for pair in stale:
+            del self.pairs[pair]
+        self.stats['pruned_pairs'] += len(stale)
+
+    def related(self, top_k: int = DEFAULT_TOP_K, min_count: int = 1) -> Dict[str, List[List[Any]]]:
+        """key -> [[related key, pair count, confidence], ...], most co-purchased first"""
+        related = {}
+        for (a, b), (count, _) in self.pairs.items():
+            if count < min_count:
+                continue
+            related.setdefault(a, []).append([b, count, round(count / self.item_counts[a], 4)])
+            related.setdefault(b, []).append([a, count, round(count / self.item_counts[b], 4)])
+
+        for key, entries in related.items():
+            entries.sort(key=lambda entry: (-entry[1], -entry[2], entry[0]))
+            related[key] = entries[:top_k]
+        return dict(sorted(related.items()))
+
+
+class CoPurchaseIndex:
+    """Read-only lookup of the types most often bought with a product type"""
+
+    def __init__(self, related: Optional[Dict[str, List[List[Any]]]] = None, meta: Optional[Dict[str, Any]] = None):
+        self.related_items = related or {}
+        self.meta = meta or {}
+
+    @classmethod
+    def load(cls, path: str = COPURCHASE_PATH) -> "CoPurchaseIndex":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data.get('related', {}), data.get('meta', {}))
+
+    def save(self, path: str = COPURCHASE_PATH):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"meta": self.meta, "related": self.related_items}, f, separators=(',', ':'))
+
+    def related(self, key: Optional[str], k: int = 3) -> List[Tuple[str, int, float]]:
+        """[(related key, pair count, confidence), ...] for one product type"""
+        return [tuple(entry) for entry in self.related_items.get(key, [])[:k]]
+
+    def related_to_many(self, keys: List[Optional[str]], k: int = 3) -> List[Tuple[str, float, str]]:
+        """
+        Related types for a whole basket as (related key, summed confidence, key that
+        contributed most), excluding the basket's own types
+        """
+        scores, sources = {}, {}
+        for key in keys:
+            for related_key, _, confidence in self.related_items.get(key, []):
+                scores[related_key] = scores.get(related_key, 0.0) + confidence
+                if confidence > sources.get(related_key, (None, 0.0))[1]:
+                    sources[related_key] = (key, confidence)
+        for key in keys:
+            scores.pop(key, None)
+        ranked = sorted(scores.items(), key=lambda entry: (-entry[1], entry[0]))[:k]
+        return [(related_key, round(score, 4), sources[related_key][0]) for related_key, score in ranked]
+
+
+def build_meta(counter: CoPurchaseCounter, sources: List[str]) -> Dict[str, Any]:
+    return {
+        "built_at": datetime.now().isoformat(timespec='seconds'),
+        "key": "product_type",
+        "sources": sources,
+        "item_types": len(counter.item_counts),
+        "pairs": len(counter.pairs),
+        **counter.stats
+    }
+
+
+_index = None
+_index_mtime = None
+_index_lock = threading.Lock()
+
+
+def get_copurchase_index(path: str = COPURCHASE_PATH) -> CoPurchaseIndex:
+    """Lookup table from disk, reloaded when the file changes; empty if it has not been built"""
+    global _index, _index_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+
+    with _index_lock:
+        if _index is not None and mtime == _index_mtime:
+            return _index
+
+    index = CoPurchaseIndex()
+    if mtime is not None:
+        try:
+            index = CoPurchaseIndex.load(path)
+        except Exception as e:
+            print(f"⚠️  Could not load {path}: {e}")
+
+    with _index_lock:
+        _index, _index_mtime = index, mtime
+    return index
+
+
+_product_keys = OrderedDict()
+_product_keys_lock = threading.Lock()
+
+
+def get_product_keys(products: List[Dict[str, Any]], catalog_version: Optional[str] = None) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+    """(sku -> product type, product type -> [skus]) for a catalog, once per catalog version"""
+    key = catalog_version or (len(products), products[0].get('sku') if products else None,
+                              products[-1].get('sku') if products else None)
+    with _product_keys_lock:
+        cached = _product_keys.get(key)
+        if cached is not None:
+            return cached
+
+    parser = get_query_parser(products, catalog_version)
+    by_sku, by_key = {}, {}
+    for product in products:
+        product_key = item_key(parser, product.get('name', ''))
+        if product_key:
+            by_sku[product['sku']] = product_key
+            by_key.setdefault(product_key, []).append(product['sku'])
+
+    with _product_keys_lock:
+        _product_keys[key] = (by_sku, by_key)
+        while len(_product_keys) > 2:
+            _product_keys.popitem(last=False)
+    return by_sku, by_key
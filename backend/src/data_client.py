@@ -0,0 +1,27 @@
+"""
+Data Client - Coalesced GETs from the agents to the data API
+"""
+from typing import Dict, Any, Optional
+import requests
+
+from src.singleflight import SingleFlight
+
+# Identical reads in flight at the same time (e.g. /api/products during a burst) share one request
+_reads = SingleFlight("data_api")
+
+
+def get(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 5) -> requests.Response:
+    """
+    requests.get, except that concurrent calls for the same URL and params
+    within this worker share one request and its response. The body is read
+    before it is shared, and .json() parses it afresh for every caller, so
+    callers may modify what they get. Errors are raised to every caller.
+    """
+    key = (url, tuple(sorted((params or {}).items())))
+
+    def fetch() -> requests.Response:
+        response = requests.get(url, params=params, timeout=timeout)
+        response.content  # read the body once, before other threads see the response
+        return response
+
+    return _reads.do(key, fetch)
@@ -1,8 +1,22 @@
 """
 Gemini AI Integration for Enhanced Conversational Responses
 """
+import json
 import os
-from typing import Dict, Any, Optional
+import queue
+import threading
+import time
+from typing import Dict, Any, Optional, Callable, Iterator
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from src.llm_cache import llm_cache
+from src.metrics import metrics
+from src.circuit_breaker import llm_breaker, CircuitOpenError
+from src.llm_backend import create_backend
+from src.llm_usage import llm_usage
+from src.singleflight import SingleFlight
+from src.llm_scheduler import llm_scheduler, is_quota_error, LLMOverloadedError
 
 # Load environment variables from .env file manually
 def load_env_file():
@@ -18,31 +32,223 @@ def load_env_file():
 
 load_env_file()
 
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    print("⚠️  Google Generative AI not installed. Install with: pip install google-generativeai")
+# Seconds each call type may take before its caller falls back to rules/templates.
+# Override with LLM_DEADLINE_<CALL_TYPE> (e.g. LLM_DEADLINE_NLU=2); LLM_DEADLINE for the rest.
+DEFAULT_DEADLINES = {
+    "nlu": 3,
+    "intent": 2,
+    "query_parse": 3,
+    "greeting": 3,
+    "upsell": 3,
+    "recommendation_message": 4,
+    "product_description": 4,
+    "customer_query": 6,
+    "discovery_response": 8,
+}
+LLM_DEFAULT_DEADLINE = float(os.getenv('LLM_DEADLINE', 6))
+
+
+def _deadlines_from_env() -> Dict[str, float]:
+    deadlines = {call_type: float(seconds) for call_type, seconds in DEFAULT_DEADLINES.items()}
+    prefix = 'LLM_DEADLINE_'
+    for name, value in os.environ.items():
+        if name.startswith(prefix):
+            try:
+                deadlines[name[len(prefix):].lower()] = float(value)
+            except ValueError:
+                pass
+    return deadlines
+
+
+# Model calls run here so a hung request can be abandoned at its deadline (the
+# client gets the same timeout, so the thread itself is freed soon after)
+_llm_executor = ThreadPoolExecutor(max_workers=int(os.getenv('LLM_POOL_SIZE', 4)), thread_name_prefix="llm-call")
+
+_llm_calls = SingleFlight("llm")
+
+_STREAM_END = object()
+
+
+def parse_json_response(text: str) -> Dict[str, Any]:
+    """JSON object from a model response (handles markdown code blocks)"""
+    if '```json' in text:
+        text = text.split('```json')[1].split('```')[0].strip()
+    elif '```' in text:
+        text = text.split('```')[1].split('```')[0].strip()
+    return json.loads(text)
 
 class GeminiAssistant:
     def __init__(self):
         self.api_key = os.getenv('GEMINI_API_KEY')
-        self.model = None
+        self.model_name = 'gemini-2.5-flash-lite'
+        self.deadlines = _deadlines_from_env()
         
-        if GEMINI_AVAILABLE and self.api_key:
-            try:
-                genai.configure(api_key=self.api_key)
-                self.model = genai.GenerativeModel('gemini-2.5-flash-lite')
-                print("✅ Gemini AI initialized successfully")
-            except Exception as e:
-                print(f"⚠️  Gemini initialization failed: {str(e)}")
-        else:
-            print("ℹ️  Gemini AI not configured. Using rule-based responses.")
+        # Gemini, or the fake backend with LLM_BACKEND=fake (see src/llm_backend.py)
+        self.model = create_backend(self.model_name, self.api_key)
+        if self.model is not None:
+            # Keeps fake responses out of the cache entries for the real model
+            self.model_name = self.model.model_name
     
     def is_available(self) -> bool:
-        """Check if Gemini is available and configured"""
-        return self.model is not None
+        """Check if Gemini is configured and its circuit breaker is not open"""
+        return self.model is not None and not llm_breaker.is_open()
+    
+    def deadline_for(self, call_type: str) -> float:
+        return self.deadlines.get(call_type, LLM_DEFAULT_DEADLINE)
+    
+    def _admit(self, call_type: str):
+        """
+        Claim the circuit breaker, then wait for the shared rate limit
+        (LLMOverloadedError if the call is shed). Only calls the breaker lets
+        through queue or spend a token; a claimed probe that is then shed is
+        given back.
+        """
+        if self.model is None:
+            raise RuntimeError("Gemini is not configured")
+        if not llm_breaker.allow():
+            raise CircuitOpenError("Gemini circuit breaker is open")
+        try:
+            llm_scheduler.acquire(call_type)
+        except LLMOverloadedError:
+            llm_breaker.release()
+            raise
+    
+    def generate_text(self, prompt: str, call_type: str = "general",
+                      validate: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Every Gemini request goes through here. Deterministic call types
+        (see llm_cache.DEFAULT_TTLS) are answered from the cache when the
+        normalized prompt was seen before, and run at temperature 0 otherwise;
+        a response is only cached if `validate` accepts it.
+
+        Calls are bounded by the call type's deadline (TimeoutError), refused
+        while the circuit breaker is open (CircuitOpenError) and shed when the
+        rate limit queue is full or too slow for the call's priority
+        (LLMOverloadedError); callers treat all three like any other failure
+        and use their fallback. Concurrent identical calls share one request
+        and its result or error.
+        """
+        cacheable = llm_cache.is_cacheable(call_type)
+        if cacheable:
+            cached = llm_cache.get(call_type, prompt, self.model_name)
+            if cached is not None:
+                return cached
+        
+        # Identical prompts already in flight in this worker wait for that call instead of repeating it
+        key = llm_cache.make_key(call_type, prompt, self.model_name) if cacheable else (call_type, prompt)
+        return _llm_calls.do(key, lambda: self._call_model(prompt, call_type, cacheable, validate))
+    
+    def _call_model(self, prompt: str, call_type: str, cacheable: bool,
+                    validate: Optional[Callable[[str], bool]] = None) -> str:
+        self._admit(call_type)
+        
+        deadline = self.deadline_for(call_type)
+        kwargs = {"request_options": {"timeout": deadline}}
+        if cacheable:
+            kwargs["generation_config"] = {"temperature": 0}
+        
+        started = time.perf_counter()
+        future = _llm_executor.submit(lambda: self.model.generate_content(prompt, call_type=call_type, **kwargs))
+        try:
+            response = future.result(timeout=deadline)
+            text = response.text.strip()
+        except FutureTimeoutError:
+            future.cancel()
+            llm_breaker.record_failure((time.perf_counter() - started) * 1000, f"{call_type} timed out")
+            metrics.increment("llm.timeouts")
+            raise TimeoutError(f"Gemini {call_type} call exceeded {deadline:g}s")
+        except Exception as e:
+            llm_breaker.record_failure((time.perf_counter() - started) * 1000, f"{call_type}: {e}")
+            metrics.increment("llm.errors")
+            if is_quota_error(e):
+                llm_scheduler.report_quota_error()
+            raise
+        
+        elapsed = (time.perf_counter() - started) * 1000
+        llm_breaker.record_success(elapsed)
+        metrics.observe(f"llm.{call_type}", elapsed)
+        metrics.increment("llm.requests")
+        llm_usage.record(call_type, prompt, text, getattr(response, 'usage_metadata', None))
+        
+        if cacheable and (validate is None or validate(text)):
+            llm_cache.put(call_type, prompt, text, self.model_name)
+        return text
+    
+    def stream_text(self, prompt: str, call_type: str = "general") -> Iterator[str]:
+        """
+        Like generate_text, but yields the response in chunks as the model
+        produces them (never cached). The deadline covers the whole stream:
+        chunks are read on their own thread, so a stream that stalls is
+        abandoned at the deadline rather than whenever the next chunk comes.
+        """
+        self._admit(call_type)
+        
+        deadline = self.deadline_for(call_type)
+        started = time.perf_counter()
+        chunks = queue.Queue()
+        stop = threading.Event()
+        
+        def read():
+            try:
+                for chunk in self.model.generate_content(prompt, call_type=call_type, stream=True,
+                                                        request_options={"timeout": deadline}):
+                    if stop.is_set():
+                        return
+                    chunks.put((chunk, None))
+                chunks.put((_STREAM_END, None))
+            except Exception as e:
+                chunks.put((None, e))
+        
+        threading.Thread(target=read, name="llm-stream", daemon=True).start()
+        
+        first_chunk = True
+        failure = None
+        abandoned = False
+        parts = []
+        usage_metadata = None
+        try:
+            while True:
+                remaining = deadline - (time.perf_counter() - started)
+                try:
+                    if remaining <= 0:
+                        raise queue.Empty
+                    chunk, error = chunks.get(timeout=remaining)
+                except queue.Empty:
+                    metrics.increment("llm.timeouts")
+                    raise TimeoutError(f"Gemini {call_type} stream exceeded {deadline:g}s")
+                if error is not None:
+                    raise error
+                if chunk is _STREAM_END:
+                    break
+                usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+                text = getattr(chunk, 'text', '')
+                if not text:
+                    continue
+                parts.append(text)
+                if first_chunk:
+                    metrics.observe(f"llm.{call_type}.first_chunk", (time.perf_counter() - started) * 1000)
+                    first_chunk = False
+                yield text
+        except GeneratorExit:
+            abandoned = True  # the consumer stopped reading; says nothing about the model
+            raise
+        except Exception as e:
+            failure = f"{call_type}: {e}"
+            if is_quota_error(e):
+                llm_scheduler.report_quota_error()
+            raise
+        finally:
+            stop.set()
+            elapsed = (time.perf_counter() - started) * 1000
+            if abandoned:
+                llm_breaker.release()
+            elif failure:
+                llm_breaker.record_failure(elapsed, failure)
+            else:
+                llm_breaker.record_success(elapsed)
+                metrics.observe(f"llm.{call_type}", elapsed)
+            metrics.increment("llm.requests")
+            llm_usage.record(call_type, prompt, "".join(parts), usage_metadata)
     
     def enhance_product_description(self, product: Dict[str, Any]) -> str:
         """Generate engaging product description using Gemini"""
@@ -60,8 +266,7 @@ Occasion: {product.get('attributes', {}).get('occasion', 'N/A')}
 
 Make it appealing and highlight key selling points."""
 
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
+            return self.generate_text(prompt, "product_description")
         except Exception as e:
             print(f"⚠️  Gemini API error: {str(e)}")
             return product.get('description', '')
@@ -69,10 +274,17 @@ Make it appealing and highlight key selling points."""
     def generate_personalized_greeting(self, customer: Dict[str, Any], channel: str) -> str:
         """Generate personalized greeting based on customer profile"""
         if not self.is_available():
-            return self._fallback_greeting(customer, channel)
+            return self.fallback_greeting(customer, channel)
         
         try:
-            prompt = f"""You are a friendly AI sales assistant. Create a warm, personalized greeting (1-2 sentences) for:
+            return self.write_greeting(customer, channel)
+        except Exception as e:
+            print(f"⚠️  Gemini API error: {str(e)}")
+            return self.fallback_greeting(customer, channel)
+    
+    def write_greeting(self, customer: Dict[str, Any], channel: str) -> str:
+        """Gemini greeting, raising on failure instead of falling back (for the greeting cache)"""
+        prompt = f"""You are a friendly AI sales assistant. Create a warm, personalized greeting (1-2 sentences) for:
 
 Customer: {customer.get('name', 'Customer')}
 Loyalty Tier: {customer.get('loyalty_tier', 'Bronze')}
@@ -82,11 +294,7 @@ Recent Purchases: {', '.join([p['category'] for p in customer.get('purchase_hist
 
 Be friendly, acknowledge their loyalty tier, and make them feel valued. Keep it conversational and not too salesy."""
 
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
-        except Exception as e:
-            print(f"⚠️  Gemini API error: {str(e)}")
-            return self._fallback_greeting(customer, channel)
+        return self.generate_text(prompt, "greeting")
     
     def generate_recommendation_message(self, customer: Dict[str, Any], products: list) -> str:
         """Generate natural recommendation message"""
@@ -110,8 +318,7 @@ Recommended products (in priority order):
 
 Make it sound natural and friendly, but ALWAYS lead with the first product."""
 
-            response = self.model.generate_content(prompt)
-            result = response.text.strip()
+            result = self.generate_text(prompt, "recommendation_message")
             print(f"🤖 Gemini generated message: {result[:150]}...")
             print(f"🎯 Products sent to Gemini: {product_names}")
             return result
@@ -134,8 +341,7 @@ Context:
 
 Provide a helpful, friendly response (2-3 sentences). If it's a product question, suggest they can get recommendations. If it's about orders, mention tracking. Keep it concise and actionable."""
 
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
+            return self.generate_text(prompt, "customer_query")
         except Exception as e:
             print(f"⚠️  Gemini API error: {str(e)}")
             return None
@@ -155,14 +361,13 @@ Suggest these complementary items naturally: {', '.join(comp_products)}
 
 Create a friendly suggestion (1-2 sentences) that sounds like styling advice, not a sales pitch. Use phrases like "would pair well with" or "to complete the look"."""
 
-            response = self.model.generate_content(prompt)
-            return response.text.strip()
+            return self.generate_text(prompt, "upsell")
         except Exception as e:
             print(f"⚠️  Gemini API error: {str(e)}")
             return self._fallback_upsell(complementary_items)
     
-    def _fallback_greeting(self, customer: Dict[str, Any], channel: str) -> str:
-        """Fallback greeting when Gemini is not available"""
+    def fallback_greeting(self, customer: Dict[str, Any], channel: str) -> str:
+        """Template greeting, used when Gemini is not available or no greeting is cached yet"""
         name = customer.get('name', 'there').split()[0]
         tier = customer.get('loyalty_tier', 'valued')
         return f"Welcome back, {name}! As our {tier} member, you have {customer.get('loyalty_points', 0)} points. How can I help you today?"
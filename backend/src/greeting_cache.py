@@ -0,0 +1,164 @@
+"""
+Greeting Cache - Pre-generated personalized greetings per customer and channel
+"""
+from typing import Dict, Any, Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sqlite3
+import threading
+import time
+
+from src.metrics import metrics, hit_rate
+from src.versioning import content_version
+
+# Shared by every gunicorn worker on the host; set to "" to keep greetings in memory only
+GREETING_CACHE_PATH = os.getenv('GREETING_CACHE_PATH', os.path.join('data', 'greetings.db'))
+
+# Seconds a generated greeting may be served
+GREETING_TTL = float(os.getenv('GREETING_TTL', 24 * 3600))
+
+# Background threads per worker process generating greetings after a miss
+GREETING_WORKERS = int(os.getenv('GREETING_WORKERS', 2))
+
+# Channels the batch job (precompute_greetings.py) generates for
+GREETING_CHANNELS = ["web", "mobile", "kiosk", "telegram"]
+
+
+def greeting_version(customer: Dict[str, Any]) -> str:
+    """Hash of what the greeting mentions: name, loyalty tier and points, recent purchases"""
+    return content_version({
+        "name": customer.get('name'),
+        "loyalty_tier": customer.get('loyalty_tier'),
+        "loyalty_points": customer.get('loyalty_points'),
+        "recent": [p.get('category') for p in customer.get('purchase_history', [])[:2]]
+    })
+
+
+class GreetingCache:
+    """
+    One greeting per (customer, channel), stored with the greeting version
+    it was written for and an expiry. A row whose version no longer matches
+    (the tier or points changed) or that has expired is a miss.
+
+    Misses are filled off the request path: `refresh_async` queues the
+    generation on a small background pool (at most once per key at a time),
+    and the request is answered with the template greeting.
+    """
+
+    def __init__(self, path: Optional[str] = GREETING_CACHE_PATH, ttl: float = GREETING_TTL,
+                 workers: int = GREETING_WORKERS):
+        self.path = path or None
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._memory = {}  # (customer_id, channel) -> (version, expires_at, message) when there is no file
+        self._pending = set()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="greeting")
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "generated": 0, "errors": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=0.5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS greetings ("
+                "customer_id TEXT, channel TEXT, version TEXT, message TEXT, created_at REAL, expires_at REAL, "
+                "PRIMARY KEY (customer_id, channel))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _read(self, customer_id: str, channel: str):
+        if not self.path:
+            with self._lock:
+                return self._memory.get((customer_id, channel))
+        return self._connection().execute(
+            "SELECT version, expires_at, message FROM greetings WHERE customer_id = ? AND channel = ?",
+            (customer_id, channel)
+        ).fetchone()
+
+    def get(self, customer_id: str, channel: str, version: str) -> Optional[str]:
+        try:
+            row = self._read(customer_id, channel)
+        except sqlite3.Error:
+            self._count('errors')
+            row = None
+        if row is None:
+            self._count('misses')
+            return None
+        stored_version, expires_at, message = row
+        if stored_version != version or expires_at <= time.time():
+            self._count('stale')
+            return None
+        self._count('hits')
+        return message
+
+    def put(self, customer_id: str, channel: str, version: str, message: str):
+        now = time.time()
+        if not self.path:
+            with self._lock:
+                self._memory[(customer_id, channel)] = (version, now + self.ttl, message)
+            return
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO greetings (customer_id, channel, version, message, created_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (customer_id, channel, version, message, now, now + self.ttl)
+            )
+        except sqlite3.Error:
+            self._count('errors')
+
+    def generate(self, customer: Dict[str, Any], channel: str, generator: Callable[[Dict[str, Any], str], str]) -> str:
+        """Run `generator(customer, channel)` now and store its greeting (exceptions propagate)"""
+        message = generator(customer, channel)
+        self.put(customer['customer_id'], channel, greeting_version(customer), message)
+        self._count('generated')
+        return message
+
+    def refresh_async(self, customer: Dict[str, Any], channel: str,
+                      generator: Callable[[Dict[str, Any], str], str]) -> bool:
+        """Queue generation for this customer and channel; False if it is already queued"""
+        key = (customer['customer_id'], channel)
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+
+        def run():
+            try:
+                self.generate(customer, channel, generator)
+            except Exception as e:
+                self._count('errors')
+                print(f"⚠️  Greeting generation failed for {key[0]}/{channel}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        self._executor.submit(run)
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            pending = len(self._pending)
+        return {
+            **stats,
+            "pending": pending,
+            "hit_rate": hit_rate(stats['hits'], stats['misses'] + stats['stale']),
+            "ttl_seconds": self.ttl,
+            "path": self.path
+        }
+
+
+# Global instance (per worker process; the SQLite table is shared)
+greeting_cache = GreetingCache()
+metrics.register_collector("greeting_cache", greeting_cache.snapshot)
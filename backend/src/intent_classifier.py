@@ -0,0 +1,221 @@
+"""
+Intent Classifier - Local linear model over n-gram features for chat intents
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime
+import json
+import math
+import os
+import re
+import threading
+
+import numpy as np
+
+from src.metrics import metrics
+
+INTENT_MODEL_PATH = os.getenv('INTENT_MODEL_PATH', os.path.join('data', 'intent_model.json'))
+
+# Turns Gemini labelled are appended here (JSON lines) to retrain on real traffic
+INTENT_LOG_PATH = os.getenv('INTENT_LOG_PATH')
+
+# Below this probability the message is sent to Gemini instead
+CONFIDENCE_THRESHOLD = float(os.getenv('INTENT_CONFIDENCE_THRESHOLD', 0.85))
+
+_TOKEN = re.compile(r"[a-z0-9₹']+")
+
+
+def tokens(text: str) -> List[str]:
+    """Lowercased words; amounts become <num> and promo codes (SAVE10) <code>"""
+    result = []
+    for token in _TOKEN.findall(text.lower()):
+        token = token.strip("'")
+        if not token:
+            continue
+        if token.startswith('₹') or token.isdigit():
+            result.append("<num>")
+        elif any(c.isdigit() for c in token):
+            result.append("<code>")
+        else:
+            result.append(token)
+    return result
+
+
+def features(text: str) -> List[str]:
+    """Unigrams plus bigrams (with start/end markers), each counted once"""
+    words = tokens(text)
+    padded = ["<s>"] + words + ["</s>"]
+    return list(dict.fromkeys(words + [f"{a} {b}" for a, b in zip(padded, padded[1:])]))
+
+
+class IntentClassifier:
+    """
+    Multinomial logistic regression: a weight row per feature, summed over
+    the features present and softmaxed. Prediction is a handful of dict
+    lookups in pure Python, so it costs microseconds.
+    """
+
+    def __init__(self, intents: List[str], bias: List[float], weights: Dict[str, List[float]],
+                 meta: Optional[Dict[str, Any]] = None):
+        self.intents = intents
+        self.bias = bias
+        self.weights = weights
+        self.meta = meta or {}
+
+    def probabilities(self, text: str) -> Dict[str, float]:
+        scores = list(self.bias)
+        for feature in features(text):
+            row = self.weights.get(feature)
+            if row is not None:
+                for i, weight in enumerate(row):
+                    scores[i] += weight
+        top = max(scores)
+        exps = [math.exp(score - top) for score in scores]
+        total = sum(exps)
+        return {intent: e / total for intent, e in zip(self.intents, exps)}
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """(intent, probability)"""
+        probabilities = self.probabilities(text)
+        intent = max(probabilities, key=probabilities.get)
+        return intent, probabilities[intent]
+
+    @classmethod
+    def train(cls, examples: List[Tuple[str, str]], epochs: int = 200, learning_rate: float = 0.05,
+              l2: float = 1e-4, min_count: int = 1, batch_size: int = 512, seed: int = 0) -> "IntentClassifier":
+        """Fit on (text, intent) pairs with mini-batch Adam; features seen fewer than min_count times are dropped"""
+        intents = sorted({intent for _, intent in examples})
+        intent_index = {intent: i for i, intent in enumerate(intents)}
+
+        counts = {}
+        rows = []
+        for text, _ in examples:
+            row = features(text)
+            rows.append(row)
+            for feature in row:
+                counts[feature] = counts.get(feature, 0) + 1
+        vocab = {feature: i for i, feature in enumerate(f for f, c in counts.items() if c >= min_count)}
+        indices = [[vocab[f] for f in row if f in vocab] for row in rows]
+        labels = np.array([intent_index[intent] for _, intent in examples])
+
+        rng = np.random.default_rng(seed)
+        W = np.zeros((len(vocab), len(intents)), dtype=np.float64)
+        b = np.zeros(len(intents), dtype=np.float64)
+        m_W, v_W = np.zeros_like(W), np.zeros_like(W)
+        m_b, v_b = np.zeros_like(b), np.zeros_like(b)
+        beta1, beta2, eps, step = 0.9, 0.999, 1e-8, 0
+
+        for _ in range(epochs):
+            order = rng.permutation(len(examples))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                X = np.zeros((len(batch), len(vocab)), dtype=np.float64)
+                for row, example in enumerate(batch):
+                    X[row, indices[example]] = 1.0
+
+                logits = X @ W + b
+                logits -= logits.max(axis=1, keepdims=True)
+                probs = np.exp(logits)
+                probs /= probs.sum(axis=1, keepdims=True)
+                probs[np.arange(len(batch)), labels[batch]] -= 1.0
+                probs /= len(batch)
+
+                step += 1
+                for param, grad, m, v in ((W, X.T @ probs + l2 * W, m_W, v_W), (b, probs.sum(axis=0), m_b, v_b)):
+                    m *= beta1
+                    m += (1 - beta1) * grad
+                    v *= beta2
+                    v += (1 - beta2) * grad * grad
+                    param -= learning_rate * (m / (1 - beta1 ** step)) / (np.sqrt(v / (1 - beta2 ** step)) + eps)
+
+        weights = {
+            feature: [round(float(w), 4) for w in W[i]]
+            for feature, i in vocab.items() if np.abs(W[i]).max() >= 1e-3
+        }
+        meta = {
+            "examples": len(examples),
+            "features": len(weights),
+            "trained_at": datetime.now().isoformat(timespec='seconds')
+        }
+        return cls(intents, [round(float(x), 4) for x in b], weights, meta)
+
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"intents": self.intents, "bias": self.bias, "weights": self.weights, "meta": self.meta},
+                      f, separators=(',', ':'), ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['intents'], data['bias'], data['weights'], data.get('meta'))
+
+
+class IntentRoutingStats:
+    """How turns were classified: locally, by Gemini (escalated), or by the low-confidence fallback"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"local": 0, "escalated": 0, "fallback": 0}
+
+    def record(self, route: str):
+        with self._lock:
+            self.counts[route] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        classifier = get_intent_classifier()
+        return {
+            **counts,
+            # Share of turns below the threshold, whether or not Gemini could take them
+            "escalation_rate": round((counts['escalated'] + counts['fallback']) / total, 4) if total else 0.0,
+            "threshold": CONFIDENCE_THRESHOLD,
+            "model": classifier.meta if classifier else None
+        }
+
+
+_classifier = None
+_classifier_mtime = None
+_classifier_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+def get_intent_classifier(path: str = INTENT_MODEL_PATH) -> Optional[IntentClassifier]:
+    """Model from disk, reloaded when the file changes; None if it has not been trained"""
+    global _classifier, _classifier_mtime
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _classifier_lock:
+        if _classifier is not None and mtime == _classifier_mtime:
+            return _classifier
+
+    try:
+        classifier = IntentClassifier.load(path)
+    except Exception as e:
+        print(f"⚠️  Could not load {path}: {e}")
+        return None
+
+    with _classifier_lock:
+        _classifier, _classifier_mtime = classifier, mtime
+    return classifier
+
+
+def log_labelled_turn(text: str, intent: str, source: str = "gemini"):
+    """Append one labelled message per line for train_intent_classifier.py --traffic"""
+    if not INTENT_LOG_PATH:
+        return
+    record = {"text": text, "intent": intent, "source": source, "created_at": datetime.now().isoformat()}
+    try:
+        with _log_lock, open(INTENT_LOG_PATH, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"⚠️  Could not write intent log: {e}")
+
+
+# Global instance (per worker process)
+intent_routing = IntentRoutingStats()
+metrics.register_collector("intent_classifier", intent_routing.snapshot)
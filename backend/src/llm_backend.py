@@ -0,0 +1,345 @@
+"""
+LLM Backend - Model backends behind GeminiAssistant: Gemini, or a local fake for offline load tests
+"""
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from src.metrics import metrics
+
+try:
+    import google.generativeai as genai
+    GEMINI_AVAILABLE = True
+except ImportError:
+    GEMINI_AVAILABLE = False
+
+# Fake backend profiles. latency_ms maps a call type ("default" for the rest)
+# to [median, p95] of a log-normal distribution; error_rate is the share of
+# calls that fail at once, timeout_rate the share that hang until the
+# caller's timeout. A stream yields chunk_words words per chunk, the first
+# after first_chunk of the call's latency.
+FAKE_PROFILES = {
+    "instant": {
+        "latency_ms": {"default": [0, 0]},
+        "error_rate": 0.0, "timeout_rate": 0.0
+    },
+    "fast": {
+        "latency_ms": {"default": [40, 120]},
+        "error_rate": 0.0, "timeout_rate": 0.0
+    },
+    # Roughly what gemini-2.5-flash-lite takes for these prompts
+    "realistic": {
+        "latency_ms": {
+            "nlu": [450, 1200], "query_parse": [400, 1000], "intent": [350, 900],
+            "greeting": [700, 1600], "upsell": [650, 1500], "product_description": [800, 1800],
+            "recommendation_message": [900, 2000], "customer_query": [1000, 2500],
+            "discovery_response": [1600, 3800], "default": [800, 2000]
+        },
+        "error_rate": 0.01, "timeout_rate": 0.005
+    },
+    "degraded": {
+        "latency_ms": {
+            "nlu": [1500, 4500], "query_parse": [1400, 4000], "greeting": [2200, 6000],
+            "discovery_response": [4000, 9000], "default": [2500, 7000]
+        },
+        "error_rate": 0.1, "timeout_rate": 0.05
+    },
+    "outage": {
+        "latency_ms": {"default": [200, 600]},
+        "error_rate": 1.0, "timeout_rate": 0.0
+    },
+}
+
+_DEFAULT_PROFILE_SETTINGS = {"first_chunk": 0.3, "chunk_words": 4, "hang_seconds": 30.0}
+
+
+class FakeBackendError(RuntimeError):
+    """A failure injected by the fake backend"""
+
+
+class FakeResponse:
+    """Shaped like a google.generativeai response (and stream chunk)"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class GeminiBackend:
+    """google.generativeai model; the call type only matters to the fake"""
+
+    def __init__(self, model_name: str, api_key: str):
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate_content(self, prompt: str, call_type: str = "general",
+                         request_options: Optional[Dict[str, Any]] = None, **kwargs):
+        # The timeout bounds each attempt; the client's default retries would run on
+        # past the caller's deadline (holding its thread), so one attempt only
+        if request_options and 'timeout' in request_options:
+            request_options = {"retry": None, **request_options}
+        return self.model.generate_content(prompt, request_options=request_options, **kwargs)
+
+
+def _quoted(prompt: str, label: str) -> str:
+    """Text in double quotes after `label` (the prompts quote user input this way)"""
+    match = re.search(re.escape(label) + r'\s*"(.*?)"', prompt, re.DOTALL)
+    return match.group(1).strip() if match else ""
+
+
+def _field(prompt: str, label: str) -> str:
+    """Rest of the line after `label`"""
+    match = re.search(r'^' + re.escape(label) + r'\s*(.*)$', prompt, re.MULTILINE)
+    return match.group(1).strip() if match else ""
+
+
+class FakeBackend:
+    """
+    Deterministic stand-in for Gemini, so the whole backend can be load
+    tested and benchmarked offline without spending quota.
+
+    Responses depend only on the prompt: JSON call types are answered from
+    the local intent classifier and query parser, text call types from
+    templates filled with the names in the prompt. Latency, failures and
+    hangs are drawn from a seeded RNG following the profile, so a run with
+    the same seed and request order sees the same delays and errors.
+    """
+
+    model_name = "fake-gemini"
+
+    def __init__(self, profile: Dict[str, Any], seed: int = 0, latency_scale: float = 1.0, name: str = "custom"):
+        self.profile = {**_DEFAULT_PROFILE_SETTINGS, **profile}
+        self.profile_name = name
+        self.latency_scale = latency_scale
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {}  # call_type -> counters
+        self._parser = None
+
+    @classmethod
+    def from_env(cls) -> "FakeBackend":
+        """LLM_FAKE_PROFILE is a profile name or a JSON file; LLM_FAKE_* override parts of it"""
+        name = os.getenv('LLM_FAKE_PROFILE', 'fast')
+        if name in FAKE_PROFILES:
+            profile = dict(FAKE_PROFILES[name])
+        else:
+            with open(name, 'r', encoding='utf-8') as f:
+                profile = json.load(f)
+        for key in ('error_rate', 'timeout_rate'):
+            value = os.getenv(f'LLM_FAKE_{key.upper()}')
+            if value is not None:
+                profile[key] = float(value)
+        return cls(
+            profile,
+            seed=int(os.getenv('LLM_FAKE_SEED', 0)),
+            latency_scale=float(os.getenv('LLM_FAKE_LATENCY_SCALE', 1.0)),
+            name=name
+        )
+
+    def _count(self, call_type: str, name: str):
+        with self._stats_lock:
+            counters = self.stats.setdefault(call_type, {"calls": 0, "errors": 0, "timeouts": 0, "streams": 0})
+            counters[name] += 1
+
+    def _sample(self, call_type: str) -> Tuple[float, str]:
+        """(latency in seconds, outcome) where outcome is "ok", "error" or "timeout" """
+        latencies = self.profile['latency_ms']
+        median, p95 = latencies.get(call_type, latencies.get('default', [0, 0]))
+        with self._rng_lock:
+            draw = self._rng.random()
+            z = self._rng.gauss(0.0, 1.0)
+        if median <= 0:
+            latency_ms = 0.0
+        else:
+            # p95 sits 1.645 standard deviations above the median in log space
+            sigma = math.log(max(p95, median) / median) / 1.645
+            latency_ms = median * math.exp(sigma * z)
+
+        if draw < self.profile['error_rate']:
+            outcome = "error"
+        elif draw < self.profile['error_rate'] + self.profile['timeout_rate']:
+            outcome = "timeout"
+        else:
+            outcome = "ok"
+        return latency_ms * self.latency_scale / 1000, outcome
+
+    def _fail(self, call_type: str, outcome: str, latency: float, request_options: Optional[Dict[str, Any]]):
+        if outcome == "timeout":
+            self._count(call_type, 'timeouts')
+            timeout = (request_options or {}).get('timeout')
+            time.sleep(timeout if timeout is not None else self.profile['hang_seconds'])
+            raise FakeBackendError(f"504 Deadline exceeded ({call_type})")
+        self._count(call_type, 'errors')
+        time.sleep(min(latency, 0.2))
+        raise FakeBackendError(f"500 Internal error ({call_type})")
+
+    def generate_content(self, prompt: str, call_type: str = "general", stream: bool = False,
+                         request_options: Optional[Dict[str, Any]] = None, **kwargs):
+        self._count(call_type, 'calls')
+        latency, outcome = self._sample(call_type)
+        if stream:
+            self._count(call_type, 'streams')
+            return self._stream(prompt, call_type, latency, outcome, request_options)
+        if outcome != "ok":
+            self._fail(call_type, outcome, latency, request_options)
+        time.sleep(latency)
+        return FakeResponse(self.respond(prompt, call_type))
+
+    def _stream(self, prompt: str, call_type: str, latency: float, outcome: str,
+                request_options: Optional[Dict[str, Any]]) -> Iterator[FakeResponse]:
+        if outcome != "ok":
+            self._fail(call_type, outcome, latency, request_options)
+        words = self.respond(prompt, call_type).split(" ")
+        size = max(1, int(self.profile['chunk_words']))
+        chunks = [" ".join(words[i:i + size]) + " " for i in range(0, len(words), size)]
+        chunks[-1] = chunks[-1].rstrip()
+
+        time.sleep(latency * self.profile['first_chunk'])
+        gap = latency * (1 - self.profile['first_chunk']) / max(1, len(chunks) - 1)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(gap)
+            yield FakeResponse(chunk)
+
+    def _variant(self, prompt: str, options: List[str]) -> str:
+        """Pick one phrasing by prompt hash, so the same prompt always gets the same text"""
+        digest = int(hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8], 16)
+        return options[digest % len(options)]
+
+    def _query_parser(self):
+        if self._parser is None:
+            from src.query_parser import QueryParser
+            path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'products.json')
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    products = json.load(f)
+            except (OSError, ValueError):
+                products = []
+            self._parser = QueryParser.from_catalog(products)
+        return self._parser
+
+    def _slots(self, text: str, earlier: str = "") -> Dict[str, Any]:
+        parser = self._query_parser()
+        slots = parser.parse(text)
+        if not slots['product_type'] and earlier:
+            slots['product_type'] = parser.parse(earlier)['product_type']
+        return slots
+
+    def respond(self, prompt: str, call_type: str) -> str:
+        """The response text for a prompt of this call type"""
+        if call_type in ("nlu", "intent"):
+            message = _quoted(prompt, "Latest message:") or _quoted(prompt, "message:")
+            from src.intent_classifier import get_intent_classifier
+            classifier = get_intent_classifier()
+            intent = classifier.predict(message)[0] if classifier and message else "general"
+            if call_type == "intent":
+                return intent
+            slots = self._slots(message, _quoted(prompt, "Earlier messages:"))
+            return json.dumps({
+                "intent": intent,
+                "product_type": slots['product_type'],
+                "quantity": slots['quantity'],
+                "modifiers": slots['colors'] + slots['materials'],
+                "max_budget": slots['max_budget'],
+                "occasion": slots['occasion']
+            })
+
+        if call_type == "query_parse":
+            slots = self._slots(_quoted(prompt, "JSON format:"))
+            return "```json\n" + json.dumps({
+                "product_type": slots['product_type'],
+                "quantity_requested": slots['quantity'],
+                "modifiers": slots['colors'] + slots['materials'] + ([slots['occasion']] if slots['occasion'] else [])
+            }) + "\n```"
+
+        if call_type == "greeting":
+            name = (_field(prompt, "Customer:") or "there").split()[0]
+            tier = _field(prompt, "Loyalty Tier:") or "valued"
+            return self._variant(prompt, [
+                f"Hi {name}! Lovely to see you again - as one of our {tier} members, you're always first in line for our best picks.",
+                f"Welcome back, {name}! Our {tier} members get the good stuff first, so let's find you something great today.",
+                f"Hello {name}, great to have you here! Thanks for being a {tier} member - what are we shopping for today?"
+            ])
+
+        if call_type == "recommendation_message":
+            product = _quoted(prompt, "The FIRST product") or "this pick"
+            return self._variant(prompt, [
+                f"I'd start with the {product} - it's exactly what you asked for. I've added a couple of alternatives too in case you want options.",
+                f"The {product} is my top pick for you! Have a look at the other suggestions as well - they go well with your style."
+            ])
+
+        if call_type == "upsell":
+            items = _field(prompt, "Suggest these complementary items naturally:") or "a few accessories"
+            return f"To complete the look, {items} would pair well with what's in your cart."
+
+        if call_type == "product_description":
+            name = _field(prompt, "Product:") or "This piece"
+            material = _field(prompt, "Material:")
+            made_of = f" in {material.lower()}" if material and material != "N/A" else ""
+            return f"{name} is crafted{made_of} for comfort and style. Easy to dress up or down, it's a versatile addition to your wardrobe."
+
+        if call_type == "customer_query":
+            return self._variant(prompt, [
+                "Happy to help! I can recommend products, check stock, track your orders or help with returns - just tell me what you need.",
+                "Sure thing! Ask me for recommendations, or share your order ID and I'll check its status for you."
+            ])
+
+        if call_type == "discovery_response":
+            request = _quoted(prompt, "The customer asked:") or "that"
+            items = re.findall(r'^(\d+)\. (.+?) - ₹(\S+) \(was ₹(\S+), (\S+)% off\) - (.*?)(?:\.\.\.)?$', prompt, re.MULTILINE)
+            lines = [f"Great choice! Here's what I found for \"{request}\".", "", "Here are my top recommendations:", ""]
+            for number, name, price, mrp, discount, description in items:
+                lines.append(f"{number}. **{name}** - ₹{price} (was ₹{mrp}, {discount}% off)")
+                lines.append(f"   {description.strip()}")
+                lines.append("")
+            return "\n".join(lines).strip()
+
+        return "Sure - how can I help you further?"
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = {call_type: dict(counters) for call_type, counters in self.stats.items()}
+        return {
+            "profile": self.profile_name,
+            "latency_scale": self.latency_scale,
+            "error_rate": self.profile['error_rate'],
+            "timeout_rate": self.profile['timeout_rate'],
+            "call_types": stats
+        }
+
+
+def create_backend(model_name: str, api_key: Optional[str], name: Optional[str] = None):
+    """
+    Backend chosen by LLM_BACKEND ("gemini", the default, or "fake");
+    None when Gemini is selected but not installed or configured.
+    """
+    name = (name or os.getenv('LLM_BACKEND', 'gemini')).lower()
+    if name == "fake":
+        backend = FakeBackend.from_env()
+        metrics.register_collector("llm_fake_backend", backend.snapshot)
+        print(f"🧪 Using fake LLM backend (profile: {backend.profile_name})")
+        return backend
+
+    if name != "gemini":
+        print(f"⚠️  Unknown LLM_BACKEND '{name}'. Using rule-based responses.")
+        return None
+    if not GEMINI_AVAILABLE:
+        print("⚠️  Google Generative AI not installed. Install with: pip install google-generativeai")
+        return None
+    if not api_key:
+        print("ℹ️  Gemini AI not configured. Using rule-based responses.")
+        return None
+    try:
+        backend = GeminiBackend(model_name, api_key)
+        print("✅ Gemini AI initialized successfully")
+        return backend
+    except Exception as e:
+        print(f"⚠️  Gemini initialization failed: {str(e)}")
+        return None
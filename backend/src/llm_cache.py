@@ -0,0 +1,199 @@
+"""
+LLM Cache - Normalized-prompt cache for deterministic Gemini calls
+"""
+from typing import Dict, Any, Optional
+from collections import OrderedDict
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from src.metrics import metrics, hit_rate
+
+# Shared by every gunicorn worker on the host; set to "" to keep the cache in memory only
+LLM_CACHE_PATH = os.getenv('LLM_CACHE_PATH', os.path.join('data', 'llm_cache.db'))
+
+# Seconds a response stays valid, per call type. Call types not listed here
+# (greetings, recommendation copy, free-form answers) are never cached.
+# Override with LLM_CACHE_TTL_<CALL_TYPE>, e.g. LLM_CACHE_TTL_INTENT=3600 (0 disables).
+DEFAULT_TTLS = {
+    "nlu": 7 * 24 * 3600,
+    "intent": 7 * 24 * 3600,
+    "query_parse": 7 * 24 * 3600,
+}
+
+_THOUSANDS_SEPARATOR = re.compile(r"(?<=\d),(?=\d)")
+_PUNCTUATION = re.compile(r"[^\w\s₹]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Case, punctuation and spacing are dropped, so "Show me SHIRTS!" and
+    "show me shirts" share an entry ("₹5,000" and "₹5000" too)
+    """
+    text = _THOUSANDS_SEPARATOR.sub("", prompt.lower())
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _ttls_from_env() -> Dict[str, float]:
+    ttls = dict(DEFAULT_TTLS)
+    prefix = 'LLM_CACHE_TTL_'
+    for name, value in os.environ.items():
+        if name.startswith(prefix):
+            try:
+                ttls[name[len(prefix):].lower()] = float(value)
+            except ValueError:
+                pass
+    return ttls
+
+
+class LLMCache:
+    """
+    Two tiers: a per-process LRU in front of a SQLite table that all workers
+    share, so a phrasing answered by one worker is a hit for the others.
+
+    Entries are keyed by model, call type and normalized prompt. The
+    persistent tier is best effort: if the file is locked or unwritable the
+    lookup counts as a miss and the request goes to the model as before.
+    """
+
+    def __init__(self, path: Optional[str] = LLM_CACHE_PATH, max_entries: int = 4096,
+                 ttls: Optional[Dict[str, float]] = None):
+        self.path = path or None
+        self.max_entries = max_entries
+        self.ttls = ttls if ttls is not None else _ttls_from_env()
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, text)
+        self._local = threading.local()
+        self.stats = {}  # call_type -> counters
+
+    def ttl_for(self, call_type: str) -> float:
+        return self.ttls.get(call_type, 0)
+
+    def is_cacheable(self, call_type: str) -> bool:
+        return self.ttl_for(call_type) > 0
+
+    @staticmethod
+    def make_key(call_type: str, prompt: str, model_name: str = "") -> str:
+        normalized = normalize_prompt(prompt)
+        return hashlib.sha1(f"{model_name}|{call_type}|{normalized}".encode('utf-8')).hexdigest()
+
+    def _count(self, call_type: str, name: str):
+        with self._lock:
+            counters = self.stats.setdefault(call_type, {
+                "memory_hits": 0, "persistent_hits": 0, "misses": 0, "stores": 0, "errors": 0
+            })
+            counters[name] += 1
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=0.5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, call_type TEXT, response TEXT, created_at REAL, expires_at REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key: str, expires_at: float, text: str):
+        with self._lock:
+            self._entries[key] = (expires_at, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, call_type: str, prompt: str, model_name: str = "") -> Optional[str]:
+        if not self.is_cacheable(call_type):
+            return None
+        key = self.make_key(call_type, prompt, model_name)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                else:
+                    del self._entries[key]
+                    entry = None
+        if entry is not None:
+            self._count(call_type, 'memory_hits')
+            return entry[1]
+
+        if self.path:
+            try:
+                row = self._connection().execute(
+                    "SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+            except sqlite3.Error:
+                self._count(call_type, 'errors')
+                row = None
+            if row is not None:
+                self._remember(key, row[1], row[0])
+                self._count(call_type, 'persistent_hits')
+                return row[0]
+
+        self._count(call_type, 'misses')
+        return None
+
+    def put(self, call_type: str, prompt: str, text: str, model_name: str = ""):
+        ttl = self.ttl_for(call_type)
+        if ttl <= 0:
+            return
+        key = self.make_key(call_type, prompt, model_name)
+        now = time.time()
+        self._remember(key, now + ttl, text)
+        self._count(call_type, 'stores')
+
+        if self.path:
+            try:
+                self._connection().execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, call_type, response, created_at, expires_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, call_type, text, now, now + ttl)
+                )
+            except sqlite3.Error:
+                self._count(call_type, 'errors')
+
+    def purge_expired(self) -> int:
+        """Delete expired rows from the persistent tier"""
+        if not self.path:
+            return 0
+        cursor = self._connection().execute("DELETE FROM llm_cache WHERE expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.path:
+            self._connection().execute("DELETE FROM llm_cache")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {call_type: dict(counters) for call_type, counters in self.stats.items()}
+            size = len(self._entries)
+        for counters in stats.values():
+            hits = counters['memory_hits'] + counters['persistent_hits']
+            counters['hit_rate'] = hit_rate(hits, counters['misses'])
+        return {
+            "memory_size": size,
+            "max_entries": self.max_entries,
+            "path": self.path,
+            "ttl_seconds": self.ttls,
+            "call_types": stats
+        }
+
+
+# Global instance (per worker process; the SQLite tier is shared)
+llm_cache = LLMCache(LLM_CACHE_PATH, int(os.getenv('LLM_CACHE_SIZE', 4096)))
+metrics.register_collector("llm_cache", llm_cache.snapshot)
@@ -0,0 +1,304 @@
+"""
+LLM Scheduler - Shared rate limit, priority queue and load shedding for Gemini calls
+"""
+from typing import Dict, Any, Optional, Tuple
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+from src.metrics import metrics
+
+# One bucket shared by every gunicorn worker on the host; "" keeps a bucket per process
+LLM_RATE_LIMIT_PATH = os.getenv('LLM_RATE_LIMIT_PATH', os.path.join('data', 'llm_rate_limit.db'))
+
+# Calls per second across all workers (0 disables the limit) and how many may burst at once
+LLM_RATE_LIMIT = float(os.getenv('LLM_RATE_LIMIT', 10))
+LLM_RATE_BURST = float(os.getenv('LLM_RATE_BURST', 20))
+
+# Calls a worker lets wait for a token; beyond this the lowest priority call is shed
+LLM_QUEUE_SIZE = int(os.getenv('LLM_QUEUE_SIZE', 16))
+
+# Seconds to back off everywhere after the provider reports a quota error without a retry hint
+LLM_QUOTA_BACKOFF = float(os.getenv('LLM_QUOTA_BACKOFF', 5))
+
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+# Understanding the turn comes first; copy that has a template fallback comes last.
+# Override with LLM_PRIORITY_<CALL_TYPE>=high|normal|low.
+DEFAULT_PRIORITIES = {
+    "nlu": HIGH,
+    "intent": HIGH,
+    "query_parse": HIGH,
+    "checkout": HIGH,
+    "discovery_response": NORMAL,
+    "customer_query": NORMAL,
+    "recommendation_message": NORMAL,
+    "greeting": LOW,
+    "upsell": LOW,
+    "product_description": LOW,
+}
+
+# Seconds a call may wait in the queue, per priority (LLM_QUEUE_TIMEOUT_HIGH etc.)
+DEFAULT_QUEUE_TIMEOUTS = {HIGH: 1.5, NORMAL: 1.0, LOW: 0.3}
+
+
+class LLMOverloadedError(RuntimeError):
+    """Raised instead of calling the model when the call was shed; the caller uses its fallback"""
+
+
+def _priorities_from_env() -> Dict[str, int]:
+    priorities = dict(DEFAULT_PRIORITIES)
+    by_name = {name: level for level, name in PRIORITY_NAMES.items()}
+    prefix = 'LLM_PRIORITY_'
+    for name, value in os.environ.items():
+        if name.startswith(prefix) and value.lower() in by_name:
+            priorities[name[len(prefix):].lower()] = by_name[value.lower()]
+    return priorities
+
+
+def _queue_timeouts_from_env() -> Dict[int, float]:
+    return {
+        level: float(os.getenv(f'LLM_QUEUE_TIMEOUT_{PRIORITY_NAMES[level].upper()}', seconds))
+        for level, seconds in DEFAULT_QUEUE_TIMEOUTS.items()
+    }
+
+
+def is_quota_error(error: Exception) -> bool:
+    """
+    Provider quota/rate errors: google.api_core ResourceExhausted/TooManyRequests,
+    or an error carrying HTTP status 429. The message text is not consulted;
+    "429" can appear in anything (a SKU, a prompt echo, a byte count).
+    """
+    if any(cls.__name__ in ("ResourceExhausted", "TooManyRequests") for cls in type(error).__mro__):
+        return True
+    response = getattr(error, 'response', None)
+    return 429 in (getattr(error, 'code', None), getattr(error, 'status_code', None),
+                   getattr(response, 'status_code', None))
+
+
+class TokenBucket:
+    """
+    Token bucket kept in a SQLite row so all workers draw from the same
+    budget; each take is one short IMMEDIATE transaction. Without a path
+    the bucket lives in this process. Storage errors let the call through:
+    the limiter must not become an outage of its own.
+    """
+
+    def __init__(self, path: Optional[str], rate: float, burst: float, name: str = "gemini"):
+        self.path = path or None
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.name = name
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._state = {"tokens": self.burst, "updated_at": time.time(), "blocked_until": 0.0}
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=0.5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit ("
+                "name TEXT PRIMARY KEY, tokens REAL, updated_at REAL, blocked_until REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _update(self, change) -> Any:
+        """Apply change(state, now) -> result to the current state, atomically"""
+        if not self.path:
+            with self._lock:
+                return change(self._state, time.time())
+
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT tokens, updated_at, blocked_until FROM rate_limit WHERE name = ?", (self.name,)
+                ).fetchone()
+                now = time.time()
+                state = ({"tokens": row[0], "updated_at": row[1], "blocked_until": row[2]} if row
+                         else {"tokens": self.burst, "updated_at": now, "blocked_until": 0.0})
+                result = change(state, now)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limit (name, tokens, updated_at, blocked_until) VALUES (?, ?, ?, ?)",
+                    (self.name, state['tokens'], state['updated_at'], state['blocked_until'])
+                )
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+            return None
+
+    def take(self) -> Tuple[bool, float]:
+        """(took a token, seconds until one may be available)"""
+        def change(state, now):
+            state['tokens'] = min(self.burst, state['tokens'] + (now - state['updated_at']) * self.rate)
+            state['updated_at'] = now
+            if now < state['blocked_until']:
+                return False, state['blocked_until'] - now
+            if state['tokens'] >= 1:
+                state['tokens'] -= 1
+                return True, 0.0
+            return False, (1 - state['tokens']) / self.rate
+
+        result = self._update(change)
+        return result if result is not None else (True, 0.0)
+
+    def block(self, seconds: float):
+        """No tokens for anyone until `seconds` from now (after a provider quota error)"""
+        def change(state, now):
+            state['blocked_until'] = max(state['blocked_until'], now + seconds)
+            state['tokens'] = min(state['tokens'], 0.0)
+
+        self._update(change)
+
+
+class _Waiter:
+    __slots__ = ("priority", "shed")
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.shed = False
+
+
+class LLMScheduler:
+    """
+    Admission control for model calls in one worker process.
+
+    A call runs at once if nobody is queued and the shared bucket has a
+    token. Otherwise it queues by priority (then arrival); the head of the
+    queue waits for the next token. A call that waits longer than its
+    priority's queue timeout is shed, and so is the lowest priority call
+    when the queue is full. A shed call raises LLMOverloadedError, and its
+    caller takes the rule-based path it already has for Gemini failures.
+    """
+
+    def __init__(self, bucket: TokenBucket, queue_size: int = LLM_QUEUE_SIZE,
+                 priorities: Optional[Dict[str, int]] = None, queue_timeouts: Optional[Dict[int, float]] = None):
+        self.bucket = bucket
+        self.queue_size = queue_size
+        self.priorities = priorities if priorities is not None else _priorities_from_env()
+        self.queue_timeouts = queue_timeouts if queue_timeouts is not None else _queue_timeouts_from_env()
+        self._cond = threading.Condition()
+        self._queue = []  # heap of (priority, seq, waiter)
+        self._seq = itertools.count()
+        self.stats = {
+            PRIORITY_NAMES[level]: {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_timeout": 0,
+                                    "wait_ms_total": 0.0, "wait_ms_max": 0.0}
+            for level in PRIORITY_NAMES
+        }
+        self.quota_errors = 0
+
+    def priority_for(self, call_type: str) -> int:
+        return self.priorities.get(call_type, NORMAL)
+
+    def _shed(self, waiter: _Waiter, reason: str):
+        self.stats[PRIORITY_NAMES[waiter.priority]][reason] += 1
+        metrics.increment("llm.shed")
+
+    def acquire(self, call_type: str):
+        """Wait for permission to call the model; raises LLMOverloadedError if shed"""
+        if self.bucket.rate <= 0:
+            return
+        priority = self.priority_for(call_type)
+        counters = self.stats[PRIORITY_NAMES[priority]]
+
+        with self._cond:
+            if not self._queue:
+                took, _ = self.bucket.take()
+                if took:
+                    counters['admitted'] += 1
+                    return
+
+            waiter = _Waiter(priority)
+            if len(self._queue) >= self.queue_size:
+                # Full: the newcomer or the lowest priority (latest) waiter gives way
+                lowest = max(self._queue)
+                if (lowest[0], lowest[1]) < (priority, float('inf')):
+                    self._shed(waiter, 'shed_queue_full')
+                    raise LLMOverloadedError(f"LLM queue full, {call_type} call shed")
+                self._queue.remove(lowest)
+                heapq.heapify(self._queue)
+                lowest[2].shed = True
+                self._shed(lowest[2], 'shed_queue_full')
+                self._cond.notify_all()
+
+            entry = (priority, next(self._seq), waiter)
+            heapq.heappush(self._queue, entry)
+            counters['queued'] += 1
+            started = time.perf_counter()
+            deadline = started + self.queue_timeouts.get(priority, 1.0)
+
+            try:
+                while True:
+                    if waiter.shed:
+                        raise LLMOverloadedError(f"LLM queue full, {call_type} call shed")
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                        self._shed(waiter, 'shed_timeout')
+                        raise LLMOverloadedError(f"{call_type} call waited too long for the LLM rate limit")
+                    wait = remaining
+                    if self._queue[0] is entry:
+                        took, retry_in = self.bucket.take()
+                        if took:
+                            heapq.heappop(self._queue)
+                            waited = (time.perf_counter() - started) * 1000
+                            counters['admitted'] += 1
+                            counters['wait_ms_total'] += waited
+                            counters['wait_ms_max'] = max(counters['wait_ms_max'], waited)
+                            return
+                        wait = min(remaining, max(retry_in, 0.005))
+                    self._cond.wait(wait)
+            finally:
+                self._cond.notify_all()
+
+    def report_quota_error(self, retry_after: Optional[float] = None):
+        """The provider rejected a call for quota: every worker backs off"""
+        with self._cond:
+            self.quota_errors += 1
+        metrics.increment("llm.quota_errors")
+        self.bucket.block(retry_after if retry_after else LLM_QUOTA_BACKOFF)
+        print(f"⚠️  Gemini quota exceeded; pausing model calls for {retry_after or LLM_QUOTA_BACKOFF:g}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = {name: dict(counters) for name, counters in self.stats.items()}
+            queued = len(self._queue)
+            quota_errors = self.quota_errors
+        for counters in stats.values():
+            total = counters.pop('wait_ms_total')
+            counters['wait_ms_avg'] = round(total / counters['admitted'], 3) if counters['admitted'] else 0.0
+            counters['wait_ms_max'] = round(counters['wait_ms_max'], 3)
+        return {
+            "rate_per_second": self.bucket.rate,
+            "burst": self.bucket.burst,
+            "shared": self.bucket.path is not None,
+            "queue_size": self.queue_size,
+            "queued_now": queued,
+            "quota_errors": quota_errors,
+            "bucket_errors": self.bucket.errors,
+            "priorities": stats
+        }
+
+
+# Global instance (per worker process; the bucket is shared)
+llm_scheduler = LLMScheduler(TokenBucket(LLM_RATE_LIMIT_PATH, LLM_RATE_LIMIT, LLM_RATE_BURST))
+metrics.register_collector("llm_scheduler", llm_scheduler.snapshot)
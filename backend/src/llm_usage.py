@@ -0,0 +1,85 @@
+"""
+LLM Usage - Prompt/response size and estimated cost per Gemini call type
+"""
+from typing import Dict, Any, Optional, Tuple
+import os
+import threading
+
+from src.metrics import metrics
+
+# USD per million tokens (gemini-2.5-flash-lite list prices); only used for the estimate
+PRICE_INPUT_PER_MTOK = float(os.getenv('LLM_PRICE_INPUT_PER_MTOK', 0.10))
+PRICE_OUTPUT_PER_MTOK = float(os.getenv('LLM_PRICE_OUTPUT_PER_MTOK', 0.40))
+
+# Rough tokens-per-character ratio for English text, used when the backend reports no usage
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def reported_tokens(usage_metadata: Any) -> Tuple[Optional[int], Optional[int]]:
+    """(prompt, output) token counts from a Gemini response's usage_metadata, if present"""
+    if usage_metadata is None:
+        return None, None
+    return (getattr(usage_metadata, 'prompt_token_count', None) or None,
+            getattr(usage_metadata, 'candidates_token_count', None) or None)
+
+
+class LLMUsage:
+    """
+    Characters and tokens sent and received per call type, kept per worker
+    process. Token counts come from the model's usage metadata when it
+    reports them, and are estimated from the character count otherwise.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {}  # call_type -> counters
+
+    def record(self, call_type: str, prompt: str, response: str, usage_metadata: Any = None):
+        prompt_tokens, output_tokens = reported_tokens(usage_metadata)
+        estimated = prompt_tokens is None
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(prompt)
+        if output_tokens is None:
+            output_tokens = estimate_tokens(response)
+
+        with self._lock:
+            counters = self.stats.setdefault(call_type, {
+                "calls": 0, "estimated": 0, "prompt_chars": 0, "prompt_tokens": 0,
+                "max_prompt_tokens": 0, "output_chars": 0, "output_tokens": 0
+            })
+            counters['calls'] += 1
+            counters['estimated'] += estimated
+            counters['prompt_chars'] += len(prompt)
+            counters['prompt_tokens'] += prompt_tokens
+            counters['max_prompt_tokens'] = max(counters['max_prompt_tokens'], prompt_tokens)
+            counters['output_chars'] += len(response)
+            counters['output_tokens'] += output_tokens
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {call_type: dict(counters) for call_type, counters in self.stats.items()}
+
+        total_cost = 0.0
+        for counters in stats.values():
+            calls = counters['calls']
+            counters['avg_prompt_tokens'] = round(counters['prompt_tokens'] / calls, 1) if calls else 0.0
+            counters['avg_output_tokens'] = round(counters['output_tokens'] / calls, 1) if calls else 0.0
+            cost = (counters['prompt_tokens'] * PRICE_INPUT_PER_MTOK
+                    + counters['output_tokens'] * PRICE_OUTPUT_PER_MTOK) / 1e6
+            counters['estimated_cost_usd'] = round(cost, 6)
+            total_cost += cost
+        return {
+            "call_types": stats,
+            "prompt_tokens": sum(c['prompt_tokens'] for c in stats.values()),
+            "output_tokens": sum(c['output_tokens'] for c in stats.values()),
+            "estimated_cost_usd": round(total_cost, 6)
+        }
+
+
+# Global instance (per worker process)
+llm_usage = LLMUsage()
+metrics.register_collector("llm_usage", llm_usage.snapshot)
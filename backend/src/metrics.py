@@ -0,0 +1,94 @@
+"""
+Metrics - In-process counters, timings and cache statistics for /api/metrics
+"""
+from typing import Dict, Any, Callable
+import os
+import threading
+import time
+
+
+class MetricsRegistry:
+    """
+    Counters and timing summaries kept per worker process.
+
+    Components with their own statistics (caches, engines) register a
+    collector callback instead of pushing every event here; collectors are
+    only called when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.counters = {}
+        self.timings = {}  # name -> {"count", "total_ms", "max_ms"}
+        self.collectors = {}
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, milliseconds: float):
+        with self._lock:
+            timing = self.timings.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            timing['count'] += 1
+            timing['total_ms'] += milliseconds
+            timing['max_ms'] = max(timing['max_ms'], milliseconds)
+
+    def timer(self, name: str) -> "_Timer":
+        """with metrics.timer("recommendations.execute"): ..."""
+        return _Timer(self, name)
+
+    def register_collector(self, name: str, collector: Callable[[], Dict[str, Any]]):
+        with self._lock:
+            self.collectors[name] = collector
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.counters)
+            timings = {
+                name: {
+                    "count": t['count'],
+                    "avg_ms": round(t['total_ms'] / t['count'], 3) if t['count'] else 0.0,
+                    "max_ms": round(t['max_ms'], 3)
+                }
+                for name, t in self.timings.items()
+            }
+            collectors = dict(self.collectors)
+
+        collected = {}
+        for name, collector in collectors.items():
+            try:
+                collected[name] = collector()
+            except Exception as e:
+                collected[name] = {"error": str(e)}
+
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "counters": counters,
+            "timings": timings,
+            **collected
+        }
+
+
+class _Timer:
+    def __init__(self, registry: MetricsRegistry, name: str):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+
+def hit_rate(hits: int, misses: int) -> float:
+    total = hits + misses
+    return round(hits / total, 4) if total else 0.0
+
+
+# Global instance (per worker process)
+metrics = MetricsRegistry()
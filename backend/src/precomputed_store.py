@@ -0,0 +1,124 @@
+"""
+Precomputed Recommendations - Keyed store of per-customer top-N picks built offline
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy import create_engine, Column, String, Text, DateTime
+from sqlalchemy.orm import sessionmaker, declarative_base
+from datetime import datetime
+import json
+import os
+import threading
+
+Base = declarative_base()
+
+# Local SQLite file next to the other data files unless a database URL is given
+PRECOMPUTED_STORE_PATH = os.getenv('PRECOMPUTED_RECOMMENDATIONS_PATH', os.path.join('data', 'precomputed_recommendations.db'))
+
+
+class PrecomputedRecommendation(Base):
+    __tablename__ = 'precomputed_recommendations'
+    customer_id = Column(String, primary_key=True)
+    profile_version = Column(String)
+    catalog_version = Column(String)
+    payload = Column(Text)  # {"recommendations": [sku, ...], "complementary_items": [sku, ...]}
+    computed_at = Column(DateTime, default=datetime.utcnow)
+
+
+class PrecomputedStore:
+    """
+    One row per customer holding SKU lists only, so the store stays small.
+
+    Rows remember the customer profile and catalog versions they were
+    computed from; `get` ignores rows that no longer match, and the batch
+    job only recomputes those rows.
+    """
+
+    def __init__(self, path: str = PRECOMPUTED_STORE_PATH, url: Optional[str] = None):
+        self.engine = create_engine(url or os.getenv('PRECOMPUTED_RECOMMENDATIONS_URL') or f"sqlite:///{path}")
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+
+    def get(self, customer_id: str, catalog_version: str, profile_version: str) -> Optional[Dict[str, List[str]]]:
+        session = self.Session()
+        try:
+            row = session.get(PrecomputedRecommendation, customer_id)
+            if row is None or row.catalog_version != catalog_version or row.profile_version != profile_version:
+                return None
+            return json.loads(row.payload)
+        finally:
+            session.close()
+
+    def stored_versions(self) -> Dict[str, Tuple[str, str]]:
+        """customer_id -> (profile version, catalog version) for every stored row"""
+        session = self.Session()
+        try:
+            rows = session.query(
+                PrecomputedRecommendation.customer_id,
+                PrecomputedRecommendation.profile_version,
+                PrecomputedRecommendation.catalog_version
+            ).all()
+            return {customer_id: (profile, catalog) for customer_id, profile, catalog in rows}
+        finally:
+            session.close()
+
+    def put_many(self, rows: List[Dict[str, Any]]):
+        """rows: [{"customer_id", "profile_version", "catalog_version", "payload": dict}, ...]"""
+        if not rows:
+            return
+        now = datetime.utcnow()
+        mappings = [
+            {
+                "customer_id": row['customer_id'],
+                "profile_version": row['profile_version'],
+                "catalog_version": row['catalog_version'],
+                "payload": json.dumps(row['payload'], separators=(',', ':')),
+                "computed_at": now
+            }
+            for row in rows
+        ]
+        session = self.Session()
+        try:
+            # Replace in one transaction: a bulk delete + insert beats a per-row merge
+            session.query(PrecomputedRecommendation).filter(
+                PrecomputedRecommendation.customer_id.in_([m['customer_id'] for m in mappings])
+            ).delete(synchronize_session=False)
+            session.bulk_insert_mappings(PrecomputedRecommendation, mappings)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def delete_except(self, customer_ids: List[str]) -> int:
+        """Drop rows for customers that no longer exist"""
+        keep = set(customer_ids)
+        stale = [customer_id for customer_id in self.stored_versions() if customer_id not in keep]
+        if not stale:
+            return 0
+        session = self.Session()
+        try:
+            for i in range(0, len(stale), 500):
+                session.query(PrecomputedRecommendation).filter(
+                    PrecomputedRecommendation.customer_id.in_(stale[i:i + 500])
+                ).delete(synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+        return len(stale)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_precomputed_store() -> Optional[PrecomputedStore]:
+    """Shared store, or None if the batch job has not been run"""
+    global _store
+    if _store is None:
+        if not os.getenv('PRECOMPUTED_RECOMMENDATIONS_URL') and not os.path.exists(PRECOMPUTED_STORE_PATH):
+            return None
+        with _store_lock:
+            if _store is None:
+                _store = PrecomputedStore()
+    return _store
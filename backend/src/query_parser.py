@@ -0,0 +1,271 @@
+"""
+Query Parser - Extracts shopping slots from a customer message in one pass
+"""
+from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+import re
+import threading
+
+# Surface words that map onto a catalog product type
+PRODUCT_SYNONYMS = {
+    "sari": "saree",
+    "tshirt": "t-shirt",
+    "tee": "t-shirt",
+    "polo": "t-shirt",
+    "pant": "trouser",
+    "chino": "trouser",
+    "handbag": "bag",
+    "jewellery": "jewelry",
+    "anarkali": "anarkali",
+}
+
+# Strings searched for in product names/categories for each product type
+PRODUCT_MATCH_TERMS = {
+    "t-shirt": ["t-shirt", "polo", "tee"],
+    "trouser": ["trouser", "pant", "chino"],
+    "shoe": ["shoe", "shoes"],
+    "bag": ["bag", "handbag"],
+    "accessory": ["accessory", "accessories"],
+}
+
+# Nouns that are the same in singular and plural
+INVARIANT_NOUNS = {"jeans", "shorts", "sunglasses", "leggings", "activewear", "sportswear", "outerwear", "footwear", "jewelry"}
+
+# Product-name words too generic to be a product type
+GENERIC_NAME_WORDS = {"set", "wear", "flops", "bottle"}
+
+AUDIENCE_WORDS = {
+    "men": "men", "man": "men", "mens": "men", "men's": "men", "male": "men", "gents": "men",
+    "women": "women", "woman": "women", "womens": "women", "women's": "women", "female": "women", "ladies": "women",
+    "girl": "girl", "girls": "girl",
+    "boy": "boy", "boys": "boy",
+    "kid": "kid", "kids": "kid", "child": "kid", "children": "kid",
+}
+
+COLOR_SYNONYMS = {"gray": "grey", "maroon": "red", "golden": "gold"}
+
+OCCASION_SYNONYMS = {"festival": "festive", "marriage": "wedding", "work": "office", "daily": "casual"}
+
+PLURAL_WORDS = {"all", "both", "these", "those", "items", "products"}
+
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+
+BUDGET_PATTERN = r"(?:under|below|less\s+than|within|max(?:imum)?|up\s+to)\s+(?:rs\.?\s*|inr\s*|₹\s*)?(?P<amount>\d[\d,]*)(?P<thousands>k)?"
+
+
+def singularize(word: str) -> str:
+    if word in INVARIANT_NOUNS:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "shes", "ches", "xes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def pluralize(word: str) -> str:
+    if word in INVARIANT_NOUNS:
+        return word
+    if word.endswith("y") and not word.endswith(("ay", "ey", "oy")):
+        return word[:-1] + "ies"
+    if word.endswith(("s", "x", "ch", "sh")):
+        return word + "es"
+    return word + "s"
+
+
+class QueryParser:
+    """
+    Slot extractor compiled once from the catalog vocabulary.
+
+    Every known term (product types, colors, materials, occasions, audience
+    words), number words and budget phrases are folded into a single regex
+    alternation, longest first, so `parse` is one left-to-right scan.
+    """
+
+    def __init__(self, product_types: Dict[str, str], colors: List[str], materials: List[str], occasions: List[str]):
+        # surface form -> (slot, canonical value, is_plural_form)
+        self.terms = {}
+
+        for surface, canonical in product_types.items():
+            self._add_term(surface, "product_type", canonical)
+            plural = pluralize(surface)
+            if plural != surface:
+                self._add_term(plural, "product_type", canonical, is_plural=True)
+        for color in colors:
+            self._add_term(color, "color", color)
+        for surface, canonical in COLOR_SYNONYMS.items():
+            self._add_term(surface, "color", canonical)
+        for material in materials:
+            self._add_term(material, "material", material)
+        for occasion in occasions:
+            self._add_term(occasion, "occasion", occasion)
+        for surface, canonical in OCCASION_SYNONYMS.items():
+            if canonical in occasions:
+                self._add_term(surface, "occasion", canonical)
+        for surface, canonical in AUDIENCE_WORDS.items():
+            self._add_term(surface, "audience", canonical)
+        for word in PLURAL_WORDS:
+            self._add_term(word, "plural", word)
+
+        alternation = "|".join(re.escape(term) for term in sorted(self.terms, key=len, reverse=True))
+        numbers = "|".join(NUMBER_WORDS)
+        self.pattern = re.compile(
+            rf"(?P<budget>\b{BUDGET_PATTERN}\b)"
+            rf"|(?P<number>\b(?:\d+|{numbers})\b)"
+            rf"|(?P<term>(?<![\w-])(?:{alternation})(?![\w-]))",
+            re.IGNORECASE
+        )
+
+    def _add_term(self, surface: str, slot: str, canonical: str, is_plural: bool = False):
+        # Product types win over other slots for the same surface word
+        if surface in self.terms and self.terms[surface][0] == "product_type":
+            return
+        self.terms[surface] = (slot, canonical, is_plural)
+
+    @classmethod
+    def from_catalog(cls, products: List[Dict[str, Any]]) -> "QueryParser":
+        """Build the vocabulary from product names, subcategories and attributes"""
+        product_types = {}
+        colors, materials, occasions = set(), set(), set()
+
+        for product in products:
+            name_words = product.get('name', '').lower().split()
+            if name_words and name_words[-1] not in GENERIC_NAME_WORDS:
+                head = singularize(name_words[-1])
+                product_types.setdefault(head, head)
+
+            for word in product.get('subcategory', '').lower().split():
+                word = singularize(word)
+                if word not in GENERIC_NAME_WORDS and word.isalpha():
+                    product_types.setdefault(word, word)
+
+            attributes = product.get('attributes', {})
+            colors.update(c.lower() for c in attributes.get('color', []))
+            for material in attributes.get('material', '').lower().split('/'):
+                material = material.strip()
+                if material and material != 'various':
+                    materials.add(material)
+            if attributes.get('occasion'):
+                occasions.add(attributes['occasion'].lower())
+
+        # Audience words describe who, not what
+        for word in AUDIENCE_WORDS:
+            product_types.pop(word, None)
+        product_types.update(PRODUCT_SYNONYMS)
+        for canonical in set(PRODUCT_SYNONYMS.values()):
+            product_types.setdefault(canonical, canonical)
+
+        return cls(product_types, sorted(colors), sorted(materials), sorted(occasions))
+
+    def parse(self, text: str) -> Dict[str, Any]:
+        """
+        Returns:
+            {
+                "product_type": str or None (first product mentioned),
+                "product_types": List[str],
+                "keywords": List[str] (strings to look for in product names),
+                "colors": List[str], "materials": List[str],
+                "occasion": str or None, "audience": List[str],
+                "quantity": int or None, "max_budget": int or None,
+                "is_plural": bool (a collective word: all, both, these, those, items, products),
+                "plural_product": bool (a product was named in the plural: "sarees")
+            }
+        """
+        slots = {
+            "product_type": None,
+            "product_types": [],
+            "keywords": [],
+            "colors": [],
+            "materials": [],
+            "occasion": None,
+            "audience": [],
+            "quantity": None,
+            "max_budget": None,
+            "is_plural": False,
+            "plural_product": False,
+        }
+        if not text:
+            return slots
+
+        pending_number = None
+        last_end = 0
+
+        for match in self.pattern.finditer(text):
+            # A number only counts as a quantity if nothing but modifiers separate it from the product
+            if text[last_end:match.start()].strip():
+                pending_number = None
+            last_end = match.end()
+
+            if match.group('budget'):
+                amount = int(match.group('amount').replace(',', ''))
+                if match.group('thousands'):
+                    amount *= 1000
+                if slots['max_budget'] is None:
+                    slots['max_budget'] = amount
+                pending_number = None
+                continue
+
+            if match.group('number'):
+                value = match.group('number').lower()
+                pending_number = int(value) if value.isdigit() else NUMBER_WORDS[value]
+                continue
+
+            slot, canonical, is_plural = self.terms[match.group('term').lower()]
+            if slot == "product_type":
+                if canonical not in slots['product_types']:
+                    slots['product_types'].append(canonical)
+                    for term in PRODUCT_MATCH_TERMS.get(canonical, [canonical]):
+                        if term not in slots['keywords']:
+                            slots['keywords'].append(term)
+                if is_plural and not canonical.endswith('s'):
+                    slots['plural_product'] = True
+                if pending_number is not None and slots['quantity'] is None:
+                    slots['quantity'] = pending_number
+                pending_number = None
+            elif slot == "plural":
+                slots['is_plural'] = True
+                pending_number = None
+            elif slot == "occasion":
+                slots['occasion'] = slots['occasion'] or canonical
+            elif slot in ("color", "material"):
+                # Modifiers may sit between a number and its product ("2 blue shirts")
+                key = slot + "s"
+                if canonical not in slots[key]:
+                    slots[key].append(canonical)
+            elif slot == "audience":
+                if canonical not in slots['audience']:
+                    slots['audience'].append(canonical)
+
+        slots['product_type'] = slots['product_types'][0] if slots['product_types'] else None
+        return slots
+
+
+_parsers = OrderedDict()
+_parsers_lock = threading.Lock()
+
+
+def get_query_parser(products: List[Dict[str, Any]], catalog_version: Optional[str] = None) -> QueryParser:
+    """Parser for a catalog, compiled once per catalog version"""
+    key = catalog_version or (len(products), products[0].get('sku') if products else None,
+                              products[-1].get('sku') if products else None)
+    with _parsers_lock:
+        parser = _parsers.get(key)
+        if parser is not None:
+            return parser
+
+    parser = QueryParser.from_catalog(products)
+    with _parsers_lock:
+        _parsers[key] = parser
+        while len(_parsers) > 4:
+            _parsers.popitem(last=False)
+    return parser
+
+
+def peek_query_parser(catalog_version: Optional[str]) -> Optional[QueryParser]:
+    """Already-compiled parser for a catalog version, without needing the products"""
+    if not catalog_version:
+        return None
+    with _parsers_lock:
+        return _parsers.get(catalog_version)
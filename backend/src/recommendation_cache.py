@@ -0,0 +1,106 @@
+"""
+Recommendation Cache - LRU + TTL cache of RecommendationAgent results
+"""
+from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import copy
+import os
+import threading
+import time
+
+from src.metrics import metrics, hit_rate
+
+
+def normalize_query(slots: Dict[str, Any]) -> Tuple:
+    """
+    Order-insensitive form of a parsed request, so rephrasings that ask for
+    the same thing ("2 blue shirts" / "blue shirts, two please") share a key
+    """
+    return (
+        tuple(sorted(slots.get('product_types', []))),
+        tuple(sorted(slots.get('colors', []))),
+        tuple(sorted(slots.get('materials', []))),
+        tuple(sorted(slots.get('audience', []))),
+        tuple(sorted(slots.get('modifiers', []))),
+        slots.get('occasion') or "",
+        slots.get('quantity'),
+        slots.get('max_budget'),
+    )
+
+
+class RecommendationCache:
+    """
+    Results keyed by (customer, normalized query, budget, occasion).
+
+    Each entry remembers the data versions it was computed from (catalog,
+    inventory, customer profile); a lookup with different versions is a miss
+    and drops the entry. Entries also expire after `ttl_seconds`, and the
+    least recently used entry is evicted beyond `max_entries`.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl_seconds: float = 300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (versions, expires_at, result)
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "invalidated": 0, "evictions": 0, "stores": 0}
+
+    @staticmethod
+    def make_key(customer_id: str, slots: Dict[str, Any], budget: Optional[int], occasion: str,
+                 with_message: bool = True) -> Tuple:
+        return (customer_id, normalize_query(slots), budget or None, (occasion or "").strip().lower(), with_message)
+
+    def get(self, key: Tuple, versions: Tuple) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+
+            entry_versions, expires_at, result = entry
+            if expires_at <= now or entry_versions != versions:
+                del self._entries[key]
+                self.stats['expired' if expires_at <= now else 'invalidated'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return copy.deepcopy(result)
+
+    def put(self, key: Tuple, versions: Tuple, result: Dict[str, Any]):
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        entry = (versions, time.time() + self.ttl_seconds, copy.deepcopy(result))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.stats['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            size = len(self._entries)
+        return {
+            **stats,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_rate": hit_rate(stats['hits'], stats['misses'])
+        }
+
+
+# Global instance (per worker process)
+recommendation_cache = RecommendationCache(
+    int(os.getenv('RECOMMENDATION_CACHE_SIZE', 2048)),
+    float(os.getenv('RECOMMENDATION_CACHE_TTL', 300))
+)
+metrics.register_collector("recommendation_cache", recommendation_cache.snapshot)
@@ -0,0 +1,271 @@
+"""
+Recommendation Scoring Engine - Vectorized product scoring with cached customer affinity
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from src.metrics import metrics, hit_rate
+
+# Score weights (kept identical to the original per-product loop)
+KEYWORD_MATCH_SCORE = 100
+BROWSING_MATCH_SCORE = 30
+PURCHASE_MATCH_SCORE = 20
+COLOR_MATCH_SCORE = 15
+# Per requested modifier (color, material) found in the product's name or attributes
+MODIFIER_MATCH_SCORE = 50
+BUDGET_MATCH_SCORE = 25
+OCCASION_MATCH_SCORE = 20
+HIGH_RATING_SCORE = 10
+BIG_DISCOUNT_SCORE = 5
+# Extra points for the most relevant retrieved candidate (scaled by BM25 score)
+RELEVANCE_SCORE = 40
+
+# Sentinel for products removed by a hard filter
+EXCLUDED_SCORE = -10**9
+
+
+def catalog_fingerprint(products: List[Dict[str, Any]]) -> str:
+    """Stable version string for a product list (used when the API sends no version)"""
+    digest = hashlib.sha1()
+    for product in products:
+        digest.update(f"{product.get('sku')}:{product.get('price')}|".encode())
+    return digest.hexdigest()[:16]
+
+
+def parse_budget_range(budget_range: str) -> Tuple[int, int]:
+    try:
+        min_budget, max_budget = map(int, budget_range.split('-'))
+        return min_budget, max_budget
+    except (AttributeError, ValueError):
+        return 0, 999999
+
+
+class CatalogMatrix:
+    """Column-oriented view of the catalog so scoring is whole-array arithmetic"""
+
+    def __init__(self, products: List[Dict[str, Any]], version: str):
+        self.products = products
+        self.version = version
+        self.size = len(products)
+
+        self.prices = np.array([p.get('price', 0) for p in products], dtype=np.float64)
+
+        self.category_vocab = {}
+        self.category_codes = np.array(
+            [self.category_vocab.setdefault(p.get('category', ''), len(self.category_vocab)) for p in products],
+            dtype=np.int32
+        )
+
+        attributes = [p.get('attributes', {}) for p in products]
+
+        self.color_vocab = {}
+        color_rows, color_cols = [], []
+        for i, attrs in enumerate(attributes):
+            for color in attrs.get('color', []):
+                color_rows.append(i)
+                color_cols.append(self.color_vocab.setdefault(color, len(self.color_vocab)))
+        self.colors = np.zeros((self.size, max(1, len(self.color_vocab))), dtype=bool)
+        self.colors[color_rows, color_cols] = True
+
+        self.occasion_vocab = {}
+        self.occasion_codes = np.array(
+            [self.occasion_vocab.setdefault(attrs.get('occasion', '').lower(), len(self.occasion_vocab)) for attrs in attributes],
+            dtype=np.int32
+        )
+
+        # Name and category in one searchable string per product
+        self.search_text = np.array(
+            [f"{p['name'].lower()}\x00{p.get('category', '').lower()}" for p in products],
+            dtype=str
+        )
+
+        # Space-delimited words of name, colors and material, for whole-word modifier matches
+        self.modifier_text = np.array(
+            [" " + " ".join(re.findall(r"[a-z0-9]+", " ".join(
+                [p['name'], *attrs.get('color', []), attrs.get('material', '')]).lower())) + " "
+             for p, attrs in zip(products, attributes)],
+            dtype=str
+        )
+
+        self.static_scores = (
+            np.where(np.array([p.get('rating', 0) for p in products]) >= 4.5, HIGH_RATING_SCORE, 0)
+            + np.where(np.array([p.get('discount', 0) for p in products]) >= 30, BIG_DISCOUNT_SCORE, 0)
+        ).astype(np.int64)
+
+    def category_mask(self, categories) -> np.ndarray:
+        codes = [self.category_vocab[c] for c in set(categories) if c in self.category_vocab]
+        return np.isin(self.category_codes, codes) if codes else np.zeros(self.size, dtype=bool)
+
+    def color_mask(self, colors) -> np.ndarray:
+        columns = [self.color_vocab[c] for c in set(colors) if c in self.color_vocab]
+        return self.colors[:, columns].any(axis=1) if columns else np.zeros(self.size, dtype=bool)
+
+    def occasion_mask(self, occasion: str, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        occasion_lower = occasion.lower()
+        codes = self.occasion_codes if indices is None else self.occasion_codes[indices]
+        matching = np.array([occasion_lower in vocab for vocab in self.occasion_vocab], dtype=bool)
+        return matching[codes] if len(matching) else np.zeros(len(codes), dtype=bool)
+
+    def keyword_mask(self, keywords: List[str]) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        for keyword in keywords:
+            mask |= np.char.find(self.search_text, keyword.lower()) >= 0
+        return mask
+
+    def modifier_matches(self, modifiers: List[str], indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """How many of the modifiers each product matches"""
+        text = self.modifier_text if indices is None else self.modifier_text[indices]
+        counts = np.zeros(len(text), dtype=np.int64)
+        for modifier in set(m.lower().strip() for m in modifiers if m and m.strip()):
+            counts += np.char.find(text, f" {modifier} ") >= 0
+        return counts
+
+    def budget_mask(self, min_budget: float, max_budget: float) -> np.ndarray:
+        return (self.prices >= min_budget) & (self.prices <= max_budget)
+
+
+class RecommendationEngine:
+    """
+    Scores the whole catalog as arrays.
+
+    Customer-dependent terms (browsing, purchase history, color, default budget)
+    are computed once per customer profile and cached; each request only adds the
+    query-dependent terms and selects the top-k with a partial sort.
+    """
+
+    def __init__(self, max_cached_customers: int = 1024):
+        self.max_cached_customers = max_cached_customers
+        self._lock = threading.Lock()
+        self._catalog = None
+        self._affinity = OrderedDict()  # (catalog version, customer key) -> (base, budget_match)
+        self.stats = {"affinity_hits": 0, "affinity_misses": 0, "catalog_builds": 0}
+
+    def catalog(self, products: List[Dict[str, Any]], version: Optional[str] = None) -> CatalogMatrix:
+        """Matrix for the given catalog, rebuilt only when the version changes"""
+        version = version or catalog_fingerprint(products)
+        catalog = self._catalog
+        if catalog is not None and catalog.version == version and catalog.size == len(products):
+            return catalog
+
+        catalog = CatalogMatrix(products, version)
+        with self._lock:
+            self._catalog = catalog
+            self._affinity.clear()
+            self.stats['catalog_builds'] += 1
+        return catalog
+
+    def customer_affinity(self, catalog: CatalogMatrix, customer: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+        """Cached (base score vector, default budget match) for a customer profile"""
+        preferences = customer.get('preferences', {})
+        profile = {
+            "browsing_history": customer.get('browsing_history', []),
+            "purchase_categories": sorted({p.get('category') for p in customer.get('purchase_history', [])}),
+            "favorite_colors": preferences.get('favorite_colors', []),
+            "budget_range": preferences.get('budget_range', '0-999999')
+        }
+        profile_key = hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()
+        cache_key = (catalog.version, customer.get('customer_id'), profile_key)
+
+        with self._lock:
+            cached = self._affinity.get(cache_key)
+            if cached is not None:
+                self._affinity.move_to_end(cache_key)
+                self.stats['affinity_hits'] += 1
+                return cached
+            self.stats['affinity_misses'] += 1
+
+        base = catalog.static_scores.copy()
+        base += np.where(catalog.category_mask(profile['browsing_history']), BROWSING_MATCH_SCORE, 0)
+        base += np.where(catalog.category_mask(profile['purchase_categories']), PURCHASE_MATCH_SCORE, 0)
+        base += np.where(catalog.color_mask(profile['favorite_colors']), COLOR_MATCH_SCORE, 0)
+        budget_match = catalog.budget_mask(*parse_budget_range(profile['budget_range']))
+        entry = (base, budget_match)
+
+        with self._lock:
+            self._affinity[cache_key] = entry
+            while len(self._affinity) > self.max_cached_customers:
+                self._affinity.popitem(last=False)
+        return entry
+
+    def score(self, catalog: CatalogMatrix, customer: Dict[str, Any], keywords: List[str] = None,
+              occasion: str = "", budget_bounds: Optional[Tuple[float, float]] = None,
+              hard_max_price: Optional[float] = None) -> np.ndarray:
+        """Full score vector; hard-filtered products get EXCLUDED_SCORE"""
+        base, default_budget_match = self.customer_affinity(catalog, customer)
+
+        budget_match = default_budget_match if budget_bounds is None else catalog.budget_mask(*budget_bounds)
+        scores = base + np.where(budget_match, BUDGET_MATCH_SCORE, 0)
+
+        if keywords:
+            scores += np.where(catalog.keyword_mask(keywords), KEYWORD_MATCH_SCORE, 0)
+        if occasion:
+            scores += np.where(catalog.occasion_mask(occasion), OCCASION_MATCH_SCORE, 0)
+        if hard_max_price is not None:
+            scores[catalog.prices > hard_max_price] = EXCLUDED_SCORE
+        return scores
+
+    def score_candidates(self, catalog: CatalogMatrix, customer: Dict[str, Any], candidates: np.ndarray,
+                         relevance: np.ndarray, modifiers: Optional[List[str]] = None, occasion: str = "",
+                         budget_bounds: Optional[Tuple[float, float]] = None,
+                         hard_max_price: Optional[float] = None) -> np.ndarray:
+        """
+        Scores for retrieved candidates only (aligned with `candidates`).
+
+        Every candidate matched the request, so each gets the keyword score plus a
+        relevance bonus proportional to its retrieval score. Each requested modifier
+        the product actually has (e.g. "blue") adds MODIFIER_MATCH_SCORE on top.
+        """
+        base, default_budget_match = self.customer_affinity(catalog, customer)
+        prices = catalog.prices[candidates]
+
+        if budget_bounds is None:
+            budget_match = default_budget_match[candidates]
+        else:
+            budget_match = (prices >= budget_bounds[0]) & (prices <= budget_bounds[1])
+        scores = base[candidates] + np.where(budget_match, BUDGET_MATCH_SCORE, 0) + KEYWORD_MATCH_SCORE
+
+        top_relevance = float(relevance.max()) if len(relevance) else 0.0
+        if top_relevance > 0:
+            scores += np.rint(RELEVANCE_SCORE * relevance / top_relevance).astype(np.int64)
+        if modifiers:
+            scores += MODIFIER_MATCH_SCORE * catalog.modifier_matches(modifiers, candidates)
+        if occasion:
+            scores += np.where(catalog.occasion_mask(occasion, candidates), OCCASION_MATCH_SCORE, 0)
+        if hard_max_price is not None:
+            scores[prices > hard_max_price] = EXCLUDED_SCORE
+        return scores
+
+    @staticmethod
+    def top_k(scores: np.ndarray, k: int) -> List[int]:
+        """
+        Indices of the k best scores, highest first; ties keep catalog order
+        (the same order a stable full sort would produce).
+        """
+        valid = np.flatnonzero(scores > EXCLUDED_SCORE)
+        if k <= 0 or not len(valid):
+            return []
+
+        n = len(scores)
+        # Encode (score desc, index asc) in one integer key
+        keys = scores[valid].astype(np.int64) * n + (n - 1 - valid)
+        if len(valid) > k:
+            part = np.argpartition(-keys, k - 1)[:k]
+        else:
+            part = np.arange(len(valid))
+        ordered = part[np.argsort(-keys[part], kind='stable')]
+        return valid[ordered].tolist()
+
+
+# Global instance (per worker process)
+recommendation_engine = RecommendationEngine(int(os.getenv('RECOMMENDATION_AFFINITY_CACHE_SIZE', 1024)))
+metrics.register_collector("recommendation_engine", lambda: {
+    **recommendation_engine.stats,
+    "affinity_hit_rate": hit_rate(recommendation_engine.stats['affinity_hits'], recommendation_engine.stats['affinity_misses'])
+})
@@ -0,0 +1,398 @@
+"""
+Session Cache - Read-through, write-behind cache in front of SessionManager
+"""
+from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+from datetime import datetime
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.metrics import metrics, hit_rate
+from src.conversation_context import CONVERSATION_HISTORY_LIMIT, number_turns
+
+# Host-local store shared by every gunicorn worker: the latest state of each hot
+# session, its version and whether it still has to reach the database.
+# Set to "" to turn the cache off (every call goes to SessionManager).
+SESSION_CACHE_PATH = os.getenv('SESSION_CACHE_PATH', os.path.join('data', 'session_cache.db'))
+
+# Sessions kept parsed in each worker's LRU
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 1000))
+
+# Seconds between write-behind flushes, and sessions written per flush transaction
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', 1.0))
+SESSION_FLUSH_BATCH = int(os.getenv('SESSION_FLUSH_BATCH', 200))
+
+# Dirty rows older than this were left by a worker that died; any worker flushes them
+SESSION_ORPHAN_SECONDS = float(os.getenv('SESSION_ORPHAN_SECONDS', 30))
+
+# Flushed sessions idle this long are dropped from the shared store (reads fall through to the database)
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', 3600))
+
+
+class SessionCache:
+    """
+    Same load_session/save_session/load_turns interface as SessionManager,
+    without the database on the request path.
+
+    A save goes to the shared local store, which bumps the session's version
+    and marks it dirty, and to this worker's LRU. A background thread writes
+    dirty sessions to the database in batches every SESSION_FLUSH_INTERVAL,
+    sooner when a dirty session is evicted from the LRU. A load checks the
+    session's version in the shared store: the LRU copy is used only if no
+    other worker has saved the session since (otherwise it is invalidated and
+    the shared copy is read), and sessions in neither are read through from
+    the database.
+
+    The shared store is a file on this host, so all workers of one server
+    agree; several hosts need sticky sessions. Batches only ever replace
+    older rows in the database (SessionManager.save_many), so overlapping
+    flushes from different workers are safe.
+    """
+
+    def __init__(self, store, path: Optional[str] = SESSION_CACHE_PATH, size: int = SESSION_CACHE_SIZE,
+                 flush_interval: float = SESSION_FLUSH_INTERVAL, batch: int = SESSION_FLUSH_BATCH):
+        self.store = store
+        self.path = path or None
+        self.size = size
+        self.flush_interval = flush_interval
+        self.batch = batch
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._entries = OrderedDict()  # session_id -> (version, state_json)
+        self._dirty = {}  # session_id -> version this worker saved and has not flushed yet
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self.stats = {"hits": 0, "shared_hits": 0, "misses": 0, "invalidations": 0, "saves": 0,
+                      "evictions": 0, "flushed": 0, "flushes": 0, "flush_errors": 0, "errors": 0}
+
+        if self.path:
+            self._flusher = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+            self._flusher.start()
+            atexit.register(self.flush_all)
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, customer_id TEXT, channel TEXT, state TEXT, "
+                "version INTEGER, dirty INTEGER, updated_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_dirty ON sessions (dirty, updated_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "session_id TEXT, seq INTEGER, role TEXT, message TEXT, created_at REAL, flushed INTEGER, "
+                "PRIMARY KEY (session_id, seq))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, session_id: str, version: int, state_json: str):
+        evicted_dirty = False
+        with self._lock:
+            self._entries[session_id] = (version, state_json)
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.size:
+                old_id, _ = self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+                evicted_dirty = evicted_dirty or old_id in self._dirty
+        if evicted_dirty:
+            self._wake.set()  # flush now rather than at the next interval
+
+    def load_session(self, session_id):
+        if not self.path:
+            return self.store.load_session(session_id)
+
+        try:
+            state_json = self._load_cached(session_id)
+        except sqlite3.Error:
+            self._count('errors')
+            return self.store.load_session(session_id)
+        if state_json is not None:
+            return json.loads(state_json)
+
+        self._count('misses')
+        state = self.store.load_session(session_id)
+        if state is not None:
+            state_json = json.dumps(state)
+            try:
+                self._connection().execute(
+                    "INSERT OR IGNORE INTO sessions (session_id, customer_id, channel, state, version, dirty, updated_at) "
+                    "VALUES (?, NULL, NULL, ?, 0, 0, ?)",
+                    (session_id, state_json, time.time())
+                )
+                self._remember(session_id, 0, state_json)
+            except sqlite3.Error:
+                self._count('errors')
+        return state
+
+    def _load_cached(self, session_id: str) -> Optional[str]:
+        """The session's current state from this worker's LRU or the shared store; None if in neither"""
+        conn = self._connection()
+        row = conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry[0] == row[0]:
+                self._entries.move_to_end(session_id)
+                self.stats['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                self.stats['invalidations'] += 1  # another worker saved it since
+
+        row = conn.execute("SELECT version, state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        self._count('shared_hits')
+        self._remember(session_id, row[0], row[1])
+        return row[1]
+
+    def save_session(self, session_id, customer_id, channel, state, turns=None):
+        """Save the state and append `turns` to the conversation log (buffered with it, flushed together)"""
+        if not self.path:
+            return self.store.save_session(session_id, customer_id, channel, state, turns=turns)
+
+        now = time.time()
+        try:
+            with metrics.timer("session_cache.save"):
+                conn = self._connection()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # Numbered under the write lock, so concurrent turns of a session never share a seq
+                    last_seq = conn.execute("SELECT max(seq) FROM turns WHERE session_id = ?", (session_id,)).fetchone()[0]
+                    numbered, state = number_turns(turns or [], last_seq, state)
+                    state_json = json.dumps(state)
+                    conn.executemany(
+                        "INSERT INTO turns (session_id, seq, role, message, created_at, flushed) "
+                        "VALUES (?, ?, ?, ?, ?, 0)",
+                        [(session_id, turn['seq'], turn['role'], turn['message'], now) for turn in numbered]
+                    )
+                    version = conn.execute(
+                        "INSERT INTO sessions (session_id, customer_id, channel, state, version, dirty, updated_at) "
+                        "VALUES (?, ?, ?, ?, 1, 1, ?) "
+                        "ON CONFLICT (session_id) DO UPDATE SET state = excluded.state, version = version + 1, "
+                        "dirty = 1, updated_at = excluded.updated_at, "
+                        "customer_id = coalesce(customer_id, excluded.customer_id), "
+                        "channel = coalesce(channel, excluded.channel) "
+                        "RETURNING version",
+                        (session_id, customer_id, channel, state_json, now)
+                    ).fetchall()[0][0]
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error:
+            self._count('errors')
+            self.store.save_session(session_id, customer_id, channel, state, turns=turns)
+            self._invalidate(session_id)
+            return
+
+        with self._lock:
+            self._dirty[session_id] = version
+            self.stats['saves'] += 1
+        self._remember(session_id, version, state_json)
+
+    def _invalidate(self, session_id: str):
+        """
+        Drop a session saved straight to the database from the cache, so loads
+        read it through again instead of serving the older cached copy. Its
+        unflushed state and messages are written first; a copy another worker
+        saved in the meantime is newer than ours and is kept.
+        """
+        with self._lock:
+            self._entries.pop(session_id, None)
+        try:
+            with self._flush_lock:
+                conn = self._connection()
+                row = conn.execute(
+                    "SELECT session_id, customer_id, channel, state, version, updated_at, dirty "
+                    "FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is None:
+                    return
+                turn_rows = self._unflushed_turns(conn, [session_id])
+                if row[6] or turn_rows:
+                    # Older than the row just saved, so save_many leaves that row as it is
+                    self.store.save_many([(row[0], row[1], row[2], row[3], datetime.fromtimestamp(row[5]))], [
+                        {"session_id": sid, "seq": seq, "role": role, "message": message,
+                         "created_at": datetime.fromtimestamp(created_at)}
+                        for sid, seq, role, message, created_at in turn_rows
+                    ])
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    dropped = conn.execute("DELETE FROM sessions WHERE session_id = ? AND version = ?",
+                                           (session_id, row[4])).rowcount
+                    if dropped:
+                        conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+                    else:
+                        conn.executemany("UPDATE turns SET flushed = 1 WHERE session_id = ? AND seq = ?",
+                                         [(session_id, turn[1]) for turn in turn_rows])
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            if dropped:
+                self._forget_flushed({session_id: row[4]})
+        except Exception as e:
+            self._count('errors')
+            print(f"⚠️  Could not drop session {session_id} from the cache: {e}")
+
+    def _flush_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self._count('flush_errors')
+                print(f"⚠️  Session flush failed: {e}")
+
+    def flush(self) -> int:
+        """Write up to one batch of dirty sessions to the database; returns how many"""
+        with self._lock:
+            mine = dict(list(self._dirty.items())[:self.batch])
+        with self._flush_lock:
+            conn = self._connection()
+            rows = self._dirty_rows(conn, list(mine))
+            if not rows:
+                self._forget_flushed(mine)
+                return 0
+
+            turn_rows = self._unflushed_turns(conn, [row[0] for row in rows])
+            self.store.save_many([
+                (session_id, customer_id, channel, state, datetime.fromtimestamp(updated_at))
+                for session_id, customer_id, channel, state, version, updated_at in rows
+            ], [
+                {"session_id": session_id, "seq": seq, "role": role, "message": message,
+                 "created_at": datetime.fromtimestamp(created_at)}
+                for session_id, seq, role, message, created_at in turn_rows
+            ])
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "UPDATE sessions SET dirty = 0 WHERE session_id = ? AND version = ?",
+                    [(row[0], row[4]) for row in rows]
+                )
+                conn.executemany(
+                    "UPDATE turns SET flushed = 1 WHERE session_id = ? AND seq = ?",
+                    [(row[0], row[1]) for row in turn_rows]
+                )
+                # Keep only the latest flushed messages of each session, for history reads
+                conn.executemany(
+                    "DELETE FROM turns WHERE session_id = ? AND flushed = 1 AND seq <= "
+                    "(SELECT max(seq) FROM turns WHERE session_id = ?) - ?",
+                    [(row[0], row[0], CONVERSATION_HISTORY_LIMIT) for row in rows]
+                )
+                conn.execute("DELETE FROM sessions WHERE dirty = 0 AND updated_at < ?",
+                             (time.time() - SESSION_CACHE_TTL,))
+                conn.execute("DELETE FROM turns WHERE flushed = 1 AND session_id NOT IN (SELECT session_id FROM sessions)")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        self._forget_flushed(mine)
+        with self._lock:
+            self.stats['flushed'] += len(rows)
+            self.stats['flushes'] += 1
+        metrics.increment("session_cache.flushed", len(rows))
+        return len(rows)
+
+    def _forget_flushed(self, flushed: Dict[str, int]):
+        """Sessions saved again while flushing stay dirty (their version moved on)"""
+        with self._lock:
+            for session_id, version in flushed.items():
+                if self._dirty.get(session_id) == version:
+                    del self._dirty[session_id]
+
+    def _unflushed_turns(self, conn: sqlite3.Connection, session_ids: List[str]) -> List[tuple]:
+        turns = []
+        for start in range(0, len(session_ids), 500):
+            chunk = session_ids[start:start + 500]
+            turns += conn.execute(
+                "SELECT session_id, seq, role, message, created_at FROM turns "
+                f"WHERE flushed = 0 AND session_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+        return turns
+
+    def load_turns(self, session_id, limit=CONVERSATION_HISTORY_LIMIT):
+        """
+        The last `limit` messages, oldest first. Recent (and not yet flushed)
+        messages come from the shared store; older ones from the database.
+        """
+        if not self.path:
+            return self.store.load_turns(session_id, limit)
+        try:
+            rows = self._connection().execute(
+                "SELECT seq, role, message FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+                (session_id, limit)
+            ).fetchall()
+        except sqlite3.Error:
+            self._count('errors')
+            return self.store.load_turns(session_id, limit)
+
+        turns = [{"seq": seq, "role": role, "message": message} for seq, role, message in reversed(rows)]
+        if len(turns) < limit and (not turns or turns[0]['seq'] > 0):
+            before = turns[0]['seq'] if turns else None
+            turns = self.store.load_turns(session_id, limit - len(turns), before=before) + turns
+        return turns
+
+    def _dirty_rows(self, conn: sqlite3.Connection, mine: List[str]) -> List[tuple]:
+        """This worker's dirty sessions, plus dirty sessions abandoned by a worker that stopped"""
+        columns = "session_id, customer_id, channel, state, version, updated_at"
+        rows = {}
+        for start in range(0, len(mine), 500):
+            chunk = mine[start:start + 500]
+            for row in conn.execute(
+                f"SELECT {columns} FROM sessions WHERE dirty = 1 AND session_id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ):
+                rows[row[0]] = row
+        for row in conn.execute(
+            f"SELECT {columns} FROM sessions WHERE dirty = 1 AND updated_at < ? LIMIT ?",
+            (time.time() - SESSION_ORPHAN_SECONDS, self.batch)
+        ):
+            rows[row[0]] = row
+        return list(rows.values())
+
+    def flush_all(self):
+        """Flush until nothing this worker saved is dirty (at exit)"""
+        for _ in range(1000):
+            with self._lock:
+                if not self._dirty:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Session flush at exit failed: {e}")
+                return
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            entries = len(self._entries)
+            dirty = len(self._dirty)
+        return {
+            **stats,
+            "entries": entries,
+            "dirty": dirty,
+            "hit_rate": hit_rate(stats['hits'] + stats['shared_hits'], stats['misses']),
+            "flush_interval_seconds": self.flush_interval,
+            "path": self.path
+        }
@@ -0,0 +1,245 @@
+"""
+Similarity Index - Hashed product feature vectors with top-k nearest-neighbour lookup
+"""
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+import hashlib
+import math
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+
+# Where build_similarity_index.py writes the index (relative to backend/, like data/*.json)
+SIMILARITY_INDEX_PATH = os.getenv('SIMILARITY_INDEX_PATH', os.path.join('data', 'similarity_index.npz'))
+
+# Hashed feature space; collisions stay rare with a few hundred distinct features
+DEFAULT_DIMENSIONS = int(os.getenv('SIMILARITY_INDEX_DIMENSIONS', 256))
+
+# How much each attribute contributes to similarity
+FEATURE_WEIGHTS = {
+    "category": 1.0,
+    "subcategory": 1.5,
+    "material": 0.75,
+    "color": 1.0,
+    "occasion": 1.0,
+    "audience": 1.0,
+    "price_band": 1.0,
+}
+
+# Who a product is for, from words in its category, subcategory or name (checked in order)
+AUDIENCE_PATTERNS = [
+    ("kids", re.compile(r"\b(?:kids?|boys?|girls?)\b")),
+    ("women", re.compile(r"\b(?:women'?s?|ladies)\b")),
+    ("men", re.compile(r"\b(?:men'?s?|gents)\b")),
+]
+
+# Price bands double in width: <500, 500-999, 1000-1999, 2000-3999, ...
+PRICE_BAND_BASE = 500
+
+
+def price_band(price: float) -> int:
+    if not price or price < PRICE_BAND_BASE:
+        return 0
+    return int(math.log2(price / PRICE_BAND_BASE)) + 1
+
+
+def audience_of(product: Dict[str, Any]) -> Optional[str]:
+    text = f"{product.get('category', '')} {product.get('subcategory', '')} {product.get('name', '')}".lower()
+    for audience, pattern in AUDIENCE_PATTERNS:
+        if pattern.search(text):
+            return audience
+    return None
+
+
+def product_features(product: Dict[str, Any]) -> List[Tuple[str, float]]:
+    """(feature name, weight) pairs describing a product"""
+    attributes = product.get('attributes', {})
+    features = [
+        (f"category:{product.get('category', '').lower()}", FEATURE_WEIGHTS['category']),
+        (f"subcategory:{product.get('subcategory', '').lower()}", FEATURE_WEIGHTS['subcategory']),
+    ]
+
+    # Multi-valued attributes share their weight so a 6-color item doesn't outweigh a 1-color one
+    materials = [m.strip().lower() for m in attributes.get('material', '').split('/') if m.strip()]
+    materials = [m for m in materials if m != 'various']
+    for material in materials:
+        features.append((f"material:{material}", FEATURE_WEIGHTS['material'] / math.sqrt(len(materials))))
+
+    colors = [c.lower() for c in attributes.get('color', [])]
+    for color in colors:
+        features.append((f"color:{color}", FEATURE_WEIGHTS['color'] / math.sqrt(len(colors))))
+
+    if attributes.get('occasion'):
+        features.append((f"occasion:{attributes['occasion'].lower()}", FEATURE_WEIGHTS['occasion']))
+
+    audience = audience_of(product)
+    if audience:
+        features.append((f"audience:{audience}", FEATURE_WEIGHTS['audience']))
+
+    # Neighbouring bands get partial credit so similarity falls off smoothly with price
+    band = price_band(product.get('price', 0))
+    features.append((f"price_band:{band}", FEATURE_WEIGHTS['price_band']))
+    features.append((f"price_band:{band - 1}", FEATURE_WEIGHTS['price_band'] / 2))
+    features.append((f"price_band:{band + 1}", FEATURE_WEIGHTS['price_band'] / 2))
+    return features
+
+
+def features_fingerprint(products: List[Dict[str, Any]]) -> str:
+    """Changes whenever a SKU or any attribute that feeds the vectors changes"""
+    digest = hashlib.sha1()
+    for product in products:
+        digest.update(product.get('sku', '').encode())
+        for name, weight in product_features(product):
+            digest.update(f"|{name}={weight:.4f}".encode())
+        digest.update(b"\n")
+    return digest.hexdigest()[:16]
+
+
+def _hash_feature(name: str, dimensions: int) -> Tuple[int, float]:
+    """Bucket and sign for a feature (signed hashing keeps collisions unbiased)"""
+    encoded = name.encode()
+    bucket = zlib.crc32(encoded) % dimensions
+    sign = 1.0 if zlib.crc32(b"sign:" + encoded) & 1 else -1.0
+    return bucket, sign
+
+
+class SimilarityIndex:
+    """
+    L2-normalized hashed feature vectors for every product.
+
+    Cosine similarity is a dot product, so a lookup is one matrix-vector
+    product over the candidate rows followed by an argpartition. Rows are
+    grouped by category so complementary lookups only touch the categories
+    they ask for.
+    """
+
+    def __init__(self, skus: List[str], categories: List[str], vectors: np.ndarray, fingerprint: str):
+        self.skus = list(skus)
+        self.categories = list(categories)
+        self.vectors = vectors
+        self.fingerprint = fingerprint
+        self.size = len(self.skus)
+        self.positions = {sku: i for i, sku in enumerate(self.skus)}
+
+        rows_by_category = {}
+        for i, category in enumerate(self.categories):
+            rows_by_category.setdefault(category, []).append(i)
+        self.rows_by_category = {c: np.array(rows, dtype=np.int64) for c, rows in rows_by_category.items()}
+
+    @classmethod
+    def build(cls, products: List[Dict[str, Any]], dimensions: int = DEFAULT_DIMENSIONS) -> "SimilarityIndex":
+        vectors = np.zeros((len(products), dimensions), dtype=np.float32)
+        buckets = {}
+        for i, product in enumerate(products):
+            for name, weight in product_features(product):
+                if name not in buckets:
+                    buckets[name] = _hash_feature(name, dimensions)
+                bucket, sign = buckets[name]
+                vectors[i, bucket] += sign * weight
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+        return cls(
+            [p.get('sku', '') for p in products],
+            [p.get('category', '') for p in products],
+            vectors,
+            features_fingerprint(products)
+        )
+
+    def save(self, path: str = SIMILARITY_INDEX_PATH):
+        np.savez_compressed(
+            path,
+            skus=np.array(self.skus),
+            categories=np.array(self.categories),
+            vectors=self.vectors,
+            fingerprint=np.array(self.fingerprint)
+        )
+
+    @classmethod
+    def load(cls, path: str = SIMILARITY_INDEX_PATH) -> "SimilarityIndex":
+        with np.load(path) as data:
+            return cls(
+                data['skus'].tolist(),
+                data['categories'].tolist(),
+                data['vectors'].astype(np.float32, copy=False),
+                str(data['fingerprint'])
+            )
+
+    def similar(self, sku: str, k: int = 5, categories: Optional[List[str]] = None,
+                exclude: Optional[List[str]] = None, within: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Top-k (sku, cosine similarity) nearest to a product, best first.
+
+        Args:
+            categories: only consider products in these categories
+            exclude: SKUs to leave out (the query product is always excluded)
+            within: only consider these SKUs (overrides `categories`)
+        """
+        position = self.positions.get(sku)
+        if position is None or k <= 0:
+            return []
+
+        if within is not None:
+            rows = np.array(sorted({self.positions[s] for s in within if s in self.positions}), dtype=np.int64)
+        elif categories is None:
+            rows = np.arange(self.size)
+        else:
+            groups = [self.rows_by_category[c] for c in categories if c in self.rows_by_category]
+            rows = np.sort(np.concatenate(groups)) if groups else np.zeros(0, dtype=np.int64)
+
+        excluded = {position} | {self.positions[s] for s in exclude or [] if s in self.positions}
+        if excluded:
+            rows = rows[~np.isin(rows, list(excluded))]
+        if not len(rows):
+            return []
+
+        scores = self.vectors[rows] @ self.vectors[position]
+        if len(rows) > k:
+            part = np.argpartition(-scores, k - 1)[:k]
+        else:
+            part = np.arange(len(rows))
+        # Best first; earlier catalog position on ties
+        ordered = part[np.lexsort((rows[part], -scores[part]))]
+        return [(self.skus[rows[i]], round(float(scores[i]), 4)) for i in ordered]
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_similarity_index(products: List[Dict[str, Any]], catalog_version: Optional[str] = None,
+                         path: str = SIMILARITY_INDEX_PATH) -> SimilarityIndex:
+    """
+    Index for a catalog, once per catalog version.
+
+    Prefers the offline-built file; if it is missing or was built from a
+    different catalog, the index is built in-process instead.
+    """
+    key = catalog_version or (len(products), products[0].get('sku') if products else None,
+                              products[-1].get('sku') if products else None)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is not None:
+            return index
+
+    index = None
+    if path and os.path.exists(path):
+        try:
+            stored = SimilarityIndex.load(path)
+            if stored.fingerprint == features_fingerprint(products):
+                index = stored
+            else:
+                print(f"⚠️  {path} is stale for the current catalog; rebuilding in memory")
+        except Exception as e:
+            print(f"⚠️  Could not load {path}: {e}")
+    if index is None:
+        index = SimilarityIndex.build(products)
+
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > 2:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,77 @@
+"""
+Single Flight - Concurrent identical calls within a worker share one execution
+"""
+from typing import Dict, Any, Callable, Hashable, List
+import threading
+
+from src.metrics import metrics
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    The first caller for a key runs the function; callers arriving with the
+    same key while it is in flight wait and get its result (or exception)
+    instead of making the call again. Nothing is kept once the call
+    returns, so this suppresses duplicates only; it is not a cache.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {"calls": 0, "executed": 0, "shared": 0}
+        _groups.append(self)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats['executed'] += 1
+            else:
+                self.stats['shared'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['in_flight'] = len(self._calls)
+        stats['shared_rate'] = round(stats['shared'] / stats['calls'], 4) if stats['calls'] else 0.0
+        return stats
+
+
+_groups: List[SingleFlight] = []
+
+
+def _snapshot() -> Dict[str, Any]:
+    return {group.name: group.snapshot() for group in _groups}
+
+
+metrics.register_collector("singleflight", _snapshot)
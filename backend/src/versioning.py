@@ -0,0 +1,11 @@
+"""
+Versioning - Content hashes used as cache keys for catalog and customer data
+"""
+from typing import Any
+import hashlib
+import json
+
+
+def content_version(data: Any) -> str:
+    """Short stable hash of any JSON-serializable value; changes whenever the content does"""
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()[:16]
@@ -0,0 +1,113 @@
+"""
+Train the local intent classifier from labelled examples and logged traffic
+
+Examples are JSON lines {"text": ..., "intent": ...}: the curated set in
+data/intent_examples.jsonl plus any traffic logs (turns Gemini labelled, as
+written by the API when INTENT_LOG_PATH is set). A curated label wins over a
+logged one for the same text.
+
+A held-out split is scored first so the confidence threshold can be checked:
+"coverage" is the share of messages decided locally, "accuracy" is measured
+on those. The saved model is then trained on everything.
+
+Usage (from backend/):
+    python train_intent_classifier.py
+    python train_intent_classifier.py --traffic data/intent_log.jsonl --threshold 0.9
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from src.intent_classifier import IntentClassifier, INTENT_MODEL_PATH, CONFIDENCE_THRESHOLD, tokens
+
+
+def read_examples(path):
+    stream = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('text') and record.get('intent'):
+                yield record['text'], record['intent']
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def evaluate(classifier, examples, threshold):
+    covered = correct = correct_all = 0
+    for text, intent in examples:
+        predicted, confidence = classifier.predict(text)
+        correct_all += predicted == intent
+        if confidence >= threshold:
+            covered += 1
+            correct += predicted == intent
+    return {
+        "accuracy_all": correct_all / len(examples),
+        "coverage": covered / len(examples),
+        "accuracy_covered": correct / covered if covered else float('nan')
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--examples', default=os.path.join('data', 'intent_examples.jsonl'))
+    parser.add_argument('--traffic', action='append', default=[], help="logged turns (JSON lines, '-' for stdin); repeatable")
+    parser.add_argument('--output', default=INTENT_MODEL_PATH)
+    parser.add_argument('--epochs', type=int, default=200)
+    parser.add_argument('--l2', type=float, default=1e-4)
+    parser.add_argument('--min-count', type=int, default=1, help="drop features seen fewer times")
+    parser.add_argument('--holdout', type=float, default=0.2, help="share of examples scored before the final fit")
+    parser.add_argument('--threshold', type=float, default=CONFIDENCE_THRESHOLD)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # Same normalized text -> one example; curated labels are read last so they win
+    labelled = {}
+    for path in args.traffic + [args.examples]:
+        for text, intent in read_examples(path):
+            labelled[" ".join(tokens(text))] = (text, intent)
+    examples = list(labelled.values())
+    if not examples:
+        print("No labelled examples found")
+        return
+    counts = {}
+    for _, intent in examples:
+        counts[intent] = counts.get(intent, 0) + 1
+    print(f"{len(examples)} examples: " + ", ".join(f"{intent} {n}" for intent, n in sorted(counts.items())))
+
+    train_kwargs = {"epochs": args.epochs, "l2": args.l2, "min_count": args.min_count, "seed": args.seed}
+    if args.holdout > 0:
+        shuffled = examples[:]
+        random.Random(args.seed).shuffle(shuffled)
+        split = max(1, int(len(shuffled) * args.holdout))
+        held_out, training = shuffled[:split], shuffled[split:]
+        scores = evaluate(IntentClassifier.train(training, **train_kwargs), held_out, args.threshold)
+        print(f"Held-out ({len(held_out)}): accuracy {scores['accuracy_all']:.3f}; at threshold {args.threshold}: "
+              f"coverage {scores['coverage']:.3f}, accuracy {scores['accuracy_covered']:.3f}")
+
+    start = time.perf_counter()
+    classifier = IntentClassifier.train(examples, **train_kwargs)
+    elapsed = time.perf_counter() - start
+
+    texts = [text for text, _ in examples]
+    start = time.perf_counter()
+    for text in texts:
+        classifier.predict(text)
+    per_message = (time.perf_counter() - start) / len(texts) * 1e6
+
+    classifier.save(args.output)
+    print(f"✅ Trained on {len(examples)} examples in {elapsed:.2f}s ({classifier.meta['features']} features, "
+          f"{per_message:.1f}µs per prediction) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()